@@ -20,8 +20,8 @@
         test suite), client, clients, delete, describe (no test suite),
         diff, edit (no test suite), files (no test suite), filelog (no
         test suite), flush, have (no test suite), label, labels, opened,
-        print (as print_, no test suite), resolve, revert (no test
-        suite), submit, sync, where (no test suite), fstat (no test suite)
+        print (as print_), resolve, revert (no test suite), submit, sync,
+        where (no test suite), fstat (no test suite)
     Partially implemented commands:
         diff2
     Unimplemented commands:
@@ -43,13 +43,23 @@ __version__ = '.'.join(map(str, __version_info__))
 
 import os
 import sys
+import io
 import pprint
 import re
 import marshal
+import select
 import getopt
+import bisect
 import tempfile
 import copy
+import hashlib
+import json
 import subprocess
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 #---- exceptions
 
@@ -156,28 +166,56 @@ def _joinArgv(argv):
     return cmdstr
 
 
-def _call_subprocess(arguments, stdin=None):
-    old_pwd = os.environ.get('PWD', None)
-    if old_pwd:
-        del os.environ["PWD"]
+def _subprocess_environment(cwd=None):
+    """Return the environment to run a single p4 process with.
 
+    p4 trusts $PWD over its real working directory. $PWD is stale as soon
+    as this process (or 'cwd') changes directory so it is dropped, or set
+    to 'cwd'. This is a copy: os.environ itself is never modified, which
+    is what makes running commands from several threads safe.
+    """
+    env = dict(os.environ)
+    if cwd:
+        env['PWD'] = cwd
+    else:
+        env.pop('PWD', None)
+    return env
+
+
+# The most precise clock for durations.
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def _call_subprocess(arguments, stdin=None, cwd=None, marshalled=False,
+                     timings=None):
+    start = _clock()
     proc = subprocess.Popen(arguments,
                             stdin=stdin,
                             stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE,
-                            universal_newlines=True)
+                            cwd=cwd,
+                            env=_subprocess_environment(cwd),
+                            universal_newlines=not marshalled)
+    if timings is not None:
+        timings['spawnTime'] = _clock() - start
+        timings['firstByteTime'] = None
+        if not sys.platform.startswith('win'):
+            # Wait for the first output, without reading it (Windows
+            # cannot poll pipes).
+            select.select([proc.stdout, proc.stderr], [], [])
+            timings['firstByteTime'] = _clock() - start
     output, error = proc.communicate()
+    if timings is not None:
+        timings['bytesRead'] = len(output) + len(error)
 
-    if not isinstance(output, str):
+    if not isinstance(error, str):
         # Then we got byte arrays
-        output = output.decode()
         error = error.decode()
+        if not marshalled:
+            output = output.decode()
 
     retval = proc.returncode
 
-    if old_pwd:
-        os.environ['PWD'] = old_pwd
-
     return output, error, retval
 
 
@@ -185,26 +223,39 @@ def _args_contain_stdin_redirection(args):
     return '<' in args and len(args) > 2 and args[-2] == '<'
 
 
-def _run(argv):
+def _run(argv, cwd=None, marshalled=False, timings=None):
     """Prepare and run the given arg vector, 'argv', and return the
     results.  Returns (<stdout lines>, <stderr lines>, <return value>).
     Note: 'argv' may also just be the command string.
+
+    "cwd" is the working directory of the process. Defaults to the
+        current directory.
+    "marshalled" specifies to return stdout as bytes (for 'p4 -G').
+    "timings" is a dict in which to set the 'spawnTime' and
+        'firstByteTime' of the process, in seconds from its start (the
+        latter is None where pipes cannot be polled), and its
+        'bytesRead' (or characters for text output).
     """
+    # The arguments are given to the process as they are: joining them
+    # then splitting the command string would split the ones with spaces
+    # (e.g. an fstat -F filter) and keep the quotes around them.
     if isinstance(argv, list) or isinstance(argv, tuple):
-        cmd = _joinArgv(argv)
+        cmd = list(argv)
     else:
-        cmd = argv
-
-    log.debug("Running '%s'..." % cmd)
+        cmd = argv.split()
 
-    cmd = cmd.split()
+    log.debug("Running '%s'..." % _joinArgv(cmd))
 
     if _args_contain_stdin_redirection(cmd):
         with open(cmd[-1]) as tmp:
             cmd = cmd[:-2]
-            output, error, retval = _call_subprocess(cmd, tmp)
+            output, error, retval = _call_subprocess(cmd, tmp, cwd=cwd,
+                                                     marshalled=marshalled,
+                                                     timings=timings)
     else:
-        output, error, retval = _call_subprocess(cmd)
+        output, error, retval = _call_subprocess(cmd, cwd=cwd,
+                                                 marshalled=marshalled,
+                                                 timings=timings)
 
     if retval:
         raise P4LibError("Error running '%s': error='%s' retval='%s'"
@@ -215,6 +266,113 @@ def _run(argv):
     return output, error, retval
 
 
+def _stream(argv, cwd=None, marshalled=False):
+    """Run the given arg vector, 'argv', and generate its output lines as
+    the process writes them.
+
+    "cwd" is the working directory of the process. Defaults to the
+        current directory.
+    "marshalled" specifies to generate the dicts unmarshalled from the
+        output (for 'p4 -G') instead of lines. See _checkMarshalNodes()
+        for the handling of error dicts.
+
+    The error output goes to a temporary file so that the process never
+    blocks on it. Closing the generator before the end of the output
+    terminates the process. A P4LibError is raised once all the output
+    has been read if the process failed.
+    """
+    # See _run() for why the arguments are not joined.
+    if isinstance(argv, list) or isinstance(argv, tuple):
+        cmd = list(argv)
+    else:
+        cmd = argv.split()
+
+    log.debug("Streaming '%s'..." % _joinArgv(cmd))
+
+    errfile = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(cmd,
+                                stdout=subprocess.PIPE,
+                                stderr=errfile,
+                                cwd=cwd,
+                                env=_subprocess_environment(cwd),
+                                universal_newlines=not marshalled)
+        if marshalled:
+            records = _checkMarshalNodes(_iterMarshalNodes(proc.stdout))
+        else:
+            records = iter(proc.stdout.readline, '')
+        complete = False
+        try:
+            for record in records:
+                yield record
+            complete = True
+        finally:
+            if not complete and proc.poll() is None:
+                proc.terminate()
+            proc.stdout.close()
+            retval = proc.wait()
+
+        if retval:
+            errfile.seek(0)
+            error = errfile.read()
+            if not isinstance(error, str):
+                error = error.decode(errors='replace')
+            raise P4LibError("Error running '%s': error='%s' retval='%s'"
+                             % (cmd, error, retval))
+    finally:
+        errfile.close()
+
+
+def _process_stream(lines, process_lines):
+    """Generate the records parsed by 'process_lines' from the output
+    'lines' of a command.
+
+    'lines' is closed with this generator, even when it is closed before
+    the end of the output, so that the process is not left running.
+    """
+    try:
+        for record in process_lines(lines):
+            yield record
+    finally:
+        lines.close()
+
+
+def _atomicWrite(path, data):
+    """Write the bytes 'data' to 'path' through a temporary file renamed
+    into place, so that other processes see either no file or all of
+    it."""
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        try:
+            getattr(os, 'replace', os.rename)(tmpPath, path)
+        except OSError:
+            # Windows without os.replace: another process wrote it first.
+            if not os.path.exists(path):
+                raise
+            os.remove(tmpPath)
+    except:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+
+def _decodeJSON(value):
+    """Return 'value' loaded from JSON with 'str' strings, like the
+    results of the parsers, where Python 2 loads 'unicode' ones."""
+    if sys.version_info.major > 2:
+        return value
+    if isinstance(value, dict):
+        return dict((_decodeJSON(key), _decodeJSON(item))
+                    for key, item in value.items())
+    if isinstance(value, list):
+        return [_decodeJSON(item) for item in value]
+    if isinstance(value, type(u'')):
+        return value.encode('utf-8')
+    return value
+
+
 def _writeTemporaryForm(form):
     formfile = tempfile.mktemp()
     fout = open(formfile, 'w')
@@ -247,6 +405,14 @@ def _prune_none_values(dictionnary):
     return result
 
 
+def _asRecord(fields, record):
+    """Return the parsed dict 'fields' as a 'record' (a _Record class),
+    or as is if 'record' is None."""
+    if record is None:
+        return fields
+    return record(fields)
+
+
 def _argumentGenerator(arguments):
     result = []
     for key, value in arguments.items():
@@ -323,62 +489,331 @@ def _isText(txt):
     return isinstance(txt, str)
 
 
-def _parseDiffOutput(output):
-    if _isText(output):
-        outputLines = output.splitlines(True)
-    else:
-        outputLines = output
-    hits = []
-    # Example header lines:
-    #   - from 'p4 describe':
-    #       ==== //depot/apps/px/ReadMe.txt#5 (text) ====
-    #       ==== //depot/main/Apps/Komodo-4.2/src/udl/luddite.py#2 (text+kwx) ====
-    #   - from 'p4 diff':
-    #       ==== //depot/apps/px/p4lib.py#12 - c:\trentm\apps\px\p4lib.py ====
-    #       ==== //depot/foo.doc#42 - c:\trentm\foo.doc ==== (binary)
-    header1Re = re.compile(r"^==== (?P<depotFile>//.*?)#(?P<rev>\d+) "
-                           r"\((?P<type>[\w+(/\w)?]+)\) ====$")
-    header2Re = re.compile("^==== (?P<depotFile>//.*?)#(?P<rev>\d+) - "
-                           "(?P<localFile>.+?) ===="
-                           "(?P<binary> \(binary\))?$")
-    header3Re = re.compile(r"^--- (?P<depotFile>//.*?)\s+.*$")
-    header4Re = re.compile(r"^\+\+\+ (?P<localFile>//.*?)\s+.*$")
-
-    LINE_DIFFER_TEXT = "(... files differ ...)\n"
-    for line in outputLines:
-        header1 = header1Re.match(line)
-        header2 = header2Re.match(line)
-        header3 = header3Re.match(line)
-        header4 = header4Re.match(line)
-
-        if header1:
-            hit = header1.groupdict()
+# Example header lines:
+#   - from 'p4 describe':
+#       ==== //depot/apps/px/ReadMe.txt#5 (text) ====
+#       ==== //depot/main/Apps/Komodo-4.2/src/udl/luddite.py#2 (text+kwx) ====
+#   - from 'p4 diff':
+#       ==== //depot/apps/px/p4lib.py#12 - c:\trentm\apps\px\p4lib.py ====
+#       ==== //depot/foo.doc#42 - c:\trentm\foo.doc ==== (binary)
+_diffHeader1Re = re.compile(r"^==== (?P<depotFile>//.*?)#(?P<rev>\d+) "
+                            r"\((?P<type>[\w+(/\w)?]+)\) ====$")
+_diffHeader2Re = re.compile(r"^==== (?P<depotFile>//.*?)#(?P<rev>\d+) - "
+                            r"(?P<localFile>.+?) ===="
+                            r"(?P<binary> \(binary\))?$")
+_diffHeader3Re = re.compile(r"^--- (?P<depotFile>//.*?)\s+.*$")
+_diffHeader4Re = re.compile(r"^\+\+\+ (?P<localFile>//.*?)\s+.*$")
+
+_DIFF_LINE_DIFFER_TEXT = "(... files differ ...)\n"
+
+
+def _diffHeader(line):
+    """Return the hit started by the diff header 'line', the dict to
+    update the current hit with for a '+++' header, or None if 'line' is
+    not a header."""
+    first = line[0]
+    if first == '=':
+        header = _diffHeader1Re.match(line)
+        if header:
+            hit = header.groupdict()
             hit['rev'] = int(hit['rev'])
-            hits.append(hit)
-        elif header2:
-            hit = header2.groupdict()
+            return hit
+        header = _diffHeader2Re.match(line)
+        if header:
+            hit = header.groupdict()
             hit['rev'] = int(hit['rev'])
             hit['binary'] = not not hit['binary']  # get boolean value
-            hits.append(hit)
-        elif header3:
-            hit = header3.groupdict()
+            return hit
+    elif first == '-':
+        header = _diffHeader3Re.match(line)
+        if header:
+            hit = header.groupdict()
             hit['rev'] = 0
             hit['binary'] = False
-            hits.append(hit)
-        elif header4:
-            hits[-1].update(header4.groupdict())
-        elif 'text' not in hits[-1] and line == LINE_DIFFER_TEXT:
-            hits[-1]['notes'] = [line]
+            return hit
+    else:
+        header = _diffHeader4Re.match(line)
+        if header:
+            return header.groupdict()
+    return None
+
+
+_unifiedHunkRe = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_normalHunkRe = re.compile(r"^(\d+)(?:,(\d+))?([acd])(\d+)(?:,(\d+))?$")
+_contextOldHunkRe = re.compile(r"^\*\*\* (\d+)(?:,(\d+))? \*\*\*\*$")
+_contextNewHunkRe = re.compile(r"^--- (\d+)(?:,(\d+))? ----$")
+_rcsHunkRe = re.compile(r"^([ad])(\d+) (\d+)$")
+
+
+def _rangeLines(start, end):
+    # The '<start>,<end>' ranges of the normal and context formats.
+    if end is None:
+        return 1
+    return int(end) - int(start) + 1
+
+
+class _DiffHunkCounter:
+    """Build the hunks of one file diff from its diff lines.
+
+    Each hunk is a dict with 'oldStart', 'oldLines', 'newStart' and
+    'newLines' keys (the line ranges of the hunk header) and 'added' and
+    'removed' keys (the number of lines the hunk adds and removes). The
+    unified, context, normal and RCS formats are recognized; the summary
+    format has no hunks.
+    """
+    def __init__(self):
+        self.hunks = []
+        self._hunk = None
+        # The prefixes of the added and removed lines in the current
+        # hunk, for the current diff format.
+        self._width = 0
+        self._addedMarks = ()
+        self._removedMarks = ()
+        # RCS diffs: the added lines still to skip and the shift of the
+        # line numbers between the old and the new file.
+        self._pending = 0
+        self._offset = 0
+
+    def _start(self, oldStart, oldLines, newStart, newLines,
+               width, addedMarks, removedMarks):
+        self._hunk = {'oldStart': oldStart, 'oldLines': oldLines,
+                      'newStart': newStart, 'newLines': newLines,
+                      'added': 0, 'removed': 0}
+        self.hunks.append(self._hunk)
+        self._width = width
+        self._addedMarks = addedMarks
+        self._removedMarks = removedMarks
+
+    def feed(self, line):
+        if self._pending:
+            self._pending -= 1
+            return
+        mark = line[:self._width]
+        if mark in self._addedMarks:
+            self._hunk['added'] += 1
+            return
+        if mark in self._removedMarks:
+            self._hunk['removed'] += 1
+            return
+
+        first = line[:1]
+        if first == '@':
+            match = _unifiedHunkRe.match(line)
+            if match:
+                oldStart, oldLines, newStart, newLines = match.groups()
+                self._start(int(oldStart),
+                            1 if oldLines is None else int(oldLines),
+                            int(newStart),
+                            1 if newLines is None else int(newLines),
+                            1, ('+',), ('-',))
+        elif first.isdigit():
+            match = _normalHunkRe.match(line)
+            if match:
+                oldStart, oldEnd, action, newStart, newEnd = match.groups()
+                self._start(int(oldStart),
+                            0 if action == 'a'
+                            else _rangeLines(oldStart, oldEnd),
+                            int(newStart),
+                            0 if action == 'd'
+                            else _rangeLines(newStart, newEnd),
+                            1, ('>',), ('<',))
+        elif first == '*':
+            match = _contextOldHunkRe.match(line)
+            if match:
+                start, end = match.groups()
+                self._start(int(start), _rangeLines(start, end), 0, 0,
+                            2, ('+ ',), ('- ', '! '))
+        elif first == '-' and self._width == 2:
+            match = _contextNewHunkRe.match(line)
+            if match:
+                start, end = match.groups()
+                self._hunk['newStart'] = int(start)
+                self._hunk['newLines'] = _rangeLines(start, end)
+                self._addedMarks = ('+ ', '! ')
+                self._removedMarks = ('- ',)
+        elif first == 'a' or first == 'd':
+            match = _rcsHunkRe.match(line)
+            if match:
+                action, start, count = match.groups()
+                start = int(start)
+                count = int(count)
+                if action == 'a':
+                    self._start(start, 0, start + self._offset + 1, count,
+                                0, (), ())
+                    self._hunk['added'] = count
+                    self._pending = count
+                    self._offset += count
+                else:
+                    self._start(start, count, start + self._offset - 1, 0,
+                                0, (), ())
+                    self._hunk['removed'] = count
+                    self._offset -= count
+
+
+def _diff_parse_lines(lines, hunks=False):
+    """Generate the dicts of the files in the 'p4 diff' or 'p4 describe'
+    diff output 'lines', each one once its diff has been read.
+
+    Only the lines starting like a file header are matched against the
+    header regexes and the diff text of a file is joined once it is
+    complete, so parsing is linear in the size of the output and only
+    holds one file diff at a time.
+
+    If "hunks" is true, each dict also has a 'hunks' key: the list of
+    dicts describing its hunks (see _DiffHunkCounter).
+    """
+    hit = None
+    text = []
+    counter = None
+    for line in lines:
+        first = line[:1]
+        if (first == '=' and line.startswith('==== ')) \
+           or (first == '-' and line.startswith('--- //')) \
+           or (first == '+' and line.startswith('+++ //')):
+            header = _diffHeader(line)
         else:
-            # This is a diff line.
-            if 'text' not in hits[-1]:
-                hits[-1]['text'] = ''
+            header = None
+
+        if header is None:
+            if hit is None:
+                continue
+            if not text and line == _DIFF_LINE_DIFFER_TEXT:
+                hit['notes'] = [line]
+            else:
+                # This is a diff line.
                 # XXX 'p4 describe' diff text includes a single
                 #     blank line after each header line before the
                 #     actual diff. Should this be stripped?
-            hits[-1]['text'] += line
+                text.append(line)
+                if counter is not None:
+                    counter.feed(line)
+        elif first == '+':
+            if hit is not None:
+                hit.update(header)
+        else:
+            if hit is not None:
+                yield _diffHit(hit, text, counter)
+            hit = header
+            text = []
+            if hunks:
+                counter = _DiffHunkCounter()
+
+    if hit is not None:
+        yield _diffHit(hit, text, counter)
+
+
+def _diffHit(hit, text, counter):
+    if text:
+        hit['text'] = ''.join(text)
+    if counter is not None:
+        hit['hunks'] = counter.hunks
+    return hit
+
+
+def _parseDiffOutput(output, hunks=False):
+    if _isText(output):
+        outputLines = output.splitlines(True)
+    else:
+        outputLines = output
+    return list(_diff_parse_lines(outputLines, hunks))
+
+
+def _decodeMarshalNode(node):
+    """Return a dict unmarshalled from 'p4 -G' output with text keys and
+    values.
+
+    p4 marshals strings as byte strings, which Python 3 loads as 'bytes'.
+    'surrogateescape' keeps bytes which are not UTF-8 round-trippable.
+    """
+    if sys.version_info.major == 2:
+        return node
+    return {key.decode('utf-8', 'surrogateescape'):
+            value.decode('utf-8', 'surrogateescape')
+            if value.__class__ is bytes else value
+            for key, value in node.items()}
+
+
+def _iterMarshalNodes(stream):
+    """Generate the dicts marshalled by 'p4 -G' on the file object
+    'stream'."""
+    while 1:
+        try:
+            node = marshal.load(stream)
+        except EOFError:
+            break
+        yield _decodeMarshalNode(node)
+
+
+def _iterMarshalBuffer(data):
+    """Generate the dicts marshalled by 'p4 -G' in the bytes 'data'."""
+    if sys.version_info.major == 2:
+        # marshal.load() only reads real files, but reads them quickly.
+        stream = tempfile.TemporaryFile()
+        stream.write(data)
+        stream.seek(0)
+        return _iterMarshalNodes(stream)
+    return _loadMarshalBuffer(data)
+
+
+def _loadMarshalBuffer(data):
+    # marshal.load() reads a file object with many small reads, which
+    # costs more than decoding the dicts. Instead each dict is loaded
+    # from the buffer with marshal.loads() and its size is found by
+    # marshalling it back. Should that not give the bytes written by p4
+    # (e.g. keys in another order), the rest is read with marshal.load().
+    view = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        node = marshal.loads(view[pos:])
+        dumped = marshal.dumps(node, 0)
+        if view[pos:pos + len(dumped)] != dumped:
+            stream = io.BytesIO(data)
+            stream.seek(pos)
+            for node in _iterMarshalNodes(stream):
+                yield node
+            return
+        pos += len(dumped)
+        yield _decodeMarshalNode(node)
+
+
+# The severity from which a 'p4 -G' error dict makes the command fail.
+_E_FAILED = 3
+
+
+def _checkMarshalNodes(nodes):
+    """Generate the 'p4 -G' dicts 'nodes', raising a P4LibError on an
+    error which makes the command fail.
+
+    Lesser errors (warnings such as 'file(s) not on client.') are
+    dropped: in text mode p4 writes them on stderr, which the parsers do
+    not see either.
+    """
+    for node in nodes:
+        if node.get('code') == 'error':
+            if int(node.get('severity', _E_FAILED)) >= _E_FAILED:
+                raise P4LibError("p4 error: %s"
+                                 % node.get('data', '').strip())
+        else:
+            yield node
 
-    return hits
+
+def _marshalOutputNodes(output):
+    """Generate the dicts of the complete 'p4 -G' output 'output'."""
+    return _checkMarshalNodes(_iterMarshalBuffer(output))
+
+
+def _marshalDate(value, dateFormat='%Y/%m/%d'):
+    # 'p4 -G' gives times as seconds since the epoch where the text
+    # output gives dates.
+    return time.strftime(dateFormat, time.localtime(int(value)))
+
+
+def _marshalDescription(desc, longOutput):
+    # The text output gives the full description only in long output
+    # and otherwise its truncated start, on one line.
+    if longOutput:
+        return desc
+    return desc.rstrip('\n').replace('\n', ' ')
 
 
 def _match_or_raise(regex, line, command_msg):
@@ -394,6 +829,857 @@ def _rstriponce(line):
         line = line[:-1]
     return line
 
+
+def _opened_parse_lines(lines, record=None):
+    # Output examples:
+    # - normal:
+    #   //depot/apps/px/px.py#3 - edit default change (text)
+    # - with '-a':
+    #   //depot/foo.txt#1 - edit change 12345 (text+w) by trentm@trentm-pliers
+    # - none opened:
+    #   foo.txt - file(s) not opened on this client.
+    lineRe = re.compile('''^
+        (?P<depotFile>.*?)\#(?P<rev>\d+)    # //depot/foo.txt#1
+        \s-\s(?P<action>\w+)                # - edit
+        \s(default\schange|change\s(?P<change>\d+))  # change 12345
+        \s\((?P<type>[\w+]+)\)          # (text+w)
+        (\sby\s)?                           # by
+        ((?P<user>[^\s@]+)@(?P<client>[^\s@]+))?    # trentm@trentm-pliers
+        ''', re.VERBOSE)
+    for line in lines:
+        match = _match_or_raise(lineRe, line, "opened")
+        fileinfo = match.groupdict()
+        fileinfo = _values_to_int(fileinfo, ['rev', 'change'])
+
+        if not fileinfo['change']:
+            fileinfo['change'] = 'default'
+
+        yield _asRecord(_prune_none_values(fileinfo), record)
+
+
+def _opened_parse_cb(output, record=None):
+    return list(_opened_parse_lines(output.splitlines(True), record))
+
+
+def _opened_parse_nodes(nodes, allClients=False, record=None):
+    keys = ['depotFile', 'rev', 'action', 'change', 'type']
+    if allClients:
+        keys += ['user', 'client']
+    for node in nodes:
+        fileinfo = dict((key, node[key]) for key in keys if key in node)
+        yield _asRecord(_values_to_int(fileinfo, ['rev', 'change']), record)
+
+
+def _where_result_cb(output, record=None):
+    # Output examples:
+    #  -//depot/foo/Py-2_1/... //trentm-ra/foo/Py-2_1/... c:\trentm\foo\Py-2_1\...
+    #  //depot/foo/win/... //trentm-ra/foo/win/... c:\trentm\foo\win\...
+    #  //depot/foo/Py Exts.dsw //trentm-ra/foo/Py Exts.dsw c:\trentm\foo\Py Exts.dsw
+    #  //depot/foo/%1 //trentm-ra/foo/%1 c:\trentm\foo\%1
+    # The last one is surprising. It comes from using '*' in the
+    # client spec.
+    results = []
+    for line in output.splitlines(True):
+        # With spaces inside filenames, the parsing is done by
+        # searching // and platform specific marker for the
+        # third part.
+        # Rather dans Regular Expressions.
+        fileinfo = {}
+        line = _rstriponce(line)
+        if line.startswith('-'):
+            fileinfo['minus'] = 1
+            line = line[1:]
+        else:
+            fileinfo['minus'] = 0
+        depotStart = line.find('//')
+        clientStart = line.find('//', depotStart + 2)
+        fileinfo['depotFile'] = line[depotStart:clientStart - 1]
+        if sys.platform.startswith('win'):
+            assert ':' not in fileinfo['depotFile'],\
+                   "Current parsing cannot handle this line '%s'." %\
+                   line
+            localStart = line.find(':', clientStart + 2) - 1
+        else:
+            assert fileinfo['depotFile'].find(' /') == -1,\
+                "Current parsing cannot handle this line '%s'." % line
+            localStart = line.find(' /', clientStart + 2) + 1
+        fileinfo['clientFile'] = line[clientStart:localStart - 1]
+        fileinfo['localFile'] = line[localStart:]
+        results.append(_asRecord(fileinfo, record))
+    return results
+
+
+def _where_parse_nodes(nodes, record=None):
+    for node in nodes:
+        yield _asRecord({'minus': int('unmap' in node),
+                         'depotFile': node['depotFile'],
+                         'clientFile': node['clientFile'],
+                         'localFile': node['path']}, record)
+
+
+def _have_parse_lines(lines, record=None):
+    # Output format is 'depot-file#revision - client-file'
+    haveRe = re.compile('(?P<depotFile>.+)#(?P<rev>\d+)'
+                        ' - (?P<localFile>.+)')
+
+    all_matches = (_match_or_raise(haveRe, _rstriponce(l), "have")
+                   for l in lines)
+    return (_asRecord(_values_to_int(match.groupdict(), ['rev']), record)
+            for match in all_matches)
+
+
+def _have_result_cb(output, record=None):
+    return list(_have_parse_lines(output.splitlines(True), record))
+
+
+def _have_parse_nodes(nodes, record=None):
+    for node in nodes:
+        yield _asRecord({'depotFile': node['depotFile'],
+                         'rev': int(node['haveRev']),
+                         'localFile': node['path']}, record)
+
+
+def _describe_result_cb(output, shortForm=False):
+    desc = {}
+    lines = output.splitlines(True)
+
+    changeRe = re.compile('^Change (?P<change>\d+) by (?P<user>[^\s@]+)@'
+                          '(?P<client>[^\s@]+) on (?P<date>[\d/ :]+?)'
+                          '( \*pending\*)?$')
+
+    desc = changeRe.match(lines[0]).groupdict()
+    desc['change'] = int(desc['change'])
+
+    filesIdx = lines.index("Affected files ...\n")
+
+    desc['description'] = ""
+    for line in lines[2:filesIdx - 1]:
+        desc['description'] += line[1:].strip()  # drop the leading \t
+
+    if shortForm:
+        diffsIdx = len(lines)
+        moveIdx = -1
+    else:
+        try:
+            moveIdx = lines.index("Moved files ...\n")
+        except ValueError:
+            moveIdx = -1
+        try:
+            diffsIdx = lines.index("Differences ...\n")
+        except ValueError:
+            # A pending change has no diffs.
+            diffsIdx = len(lines)
+
+    stopFilesIdx = diffsIdx - 1
+
+    if moveIdx != -1:
+        # ... //depot/file1.cpp#1 moved from ... //depot/file2.cpp#1
+        moveRe = re.compile('^... (?P<destDepotFile>.+?)#(?P<destRev>\d+) '
+                            'moved from (?P<sourceDepotFile>.+?)#(?P<sourceRev>\d+)$')
+        all_matches = (_match_or_raise(moveRe, l, "describe")
+                       for l in lines[filesIdx + 2:moveIdx - 1])
+        stopFilesIdx = moveIdx - 1
+
+    fileRe = re.compile('^... (?P<depotFile>.+?)#(?P<rev>\d+) '
+                        '(?P<action>\w+(/\w+)?)$')
+
+    all_matches = (_match_or_raise(fileRe, l, "describe")
+                   for l in lines[filesIdx + 2:stopFilesIdx])
+    desc['files'] = [_values_to_int(match.groupdict(), ['rev'])
+                     for match in all_matches]
+
+    if not shortForm:
+        desc['diff'] = _parseDiffOutput(lines[diffsIdx + 2:])
+    return desc
+
+
+def _isPendingDescription(output):
+    """Return whether the 'p4 describe' output 'output' is the one of a
+    pending change."""
+    return output.split('\n', 1)[0].endswith(' *pending*')
+
+
+def _describe_parse_node(node):
+    # Only for the short form: 'p4 -G describe' does not give the diffs.
+    desc = {'change': int(node['change']),
+            'user': node['user'],
+            'client': node['client'],
+            'date': _marshalDate(node['time'], '%Y/%m/%d %H:%M:%S'),
+            'description': ''.join(line.strip()
+                                   for line in node['desc'].splitlines()),
+            'files': []}
+    i = 0
+    while 'depotFile%d' % i in node:
+        desc['files'].append({'depotFile': node['depotFile%d' % i],
+                              'rev': int(node['rev%d' % i]),
+                              'action': node['action%d' % i]})
+        i += 1
+    return desc
+
+
+def _changes_argv(files, followIntegrations, longOutput, maximum, status):
+    if maximum is not None and not isinstance(maximum, int):
+        raise P4LibError("Incorrect 'maximum' value. It must be an integer: "
+                         "'%s' (type '%s')" % (maximum, type(maximum)))
+    if status is not None and status not in ("pending", "submitted"):
+        raise P4LibError("Incorrect 'status' value: '%s'" % status)
+
+    optv = _argumentGenerator({'-i': followIntegrations,
+                               '-l': longOutput,
+                               '-m': maximum,
+                               '-s': status})
+
+    argv = ['changes'] + optv
+    if files:
+        argv += _normalizeFiles(files)
+    return argv
+
+
+def _changes_parse_lines(lines, longOutput=False, record=None):
+    if longOutput:
+        changeRe = re.compile("^Change (?P<change>\d+) on "
+                              "(?P<date>[\d/]+) by (?P<user>[^\s@]+)@"
+                              "(?P<client>[^\s@]+)$")
+
+        # A change is complete once the next one starts.
+        change = None
+        for line in lines:
+            if not line.strip():
+                continue  # skip blank lines
+            if line.startswith('\t'):
+                # Append this line (minus leading tab) to last
+                # change's description.
+                change['description'] += line[1:]
+            else:
+                if change is not None:
+                    yield _asRecord(change, record)
+                change = changeRe.match(line).groupdict()
+                change = _values_to_int(change, ['change'])
+                change['description'] = ''
+        if change is not None:
+            yield _asRecord(change, record)
+    else:
+        changeRe = re.compile("^Change (?P<change>\d+) on "
+                              "(?P<date>[\d/]+) by (?P<user>[^\s@]+)@"
+                              "(?P<client>[^\s@]+) (\*pending\* )?"
+                              "'(?P<description>.*?)'?$")
+
+        for line in lines:
+            match = _match_or_raise(changeRe, line, "changes")
+            yield _asRecord(_values_to_int(match.groupdict(), ['change']),
+                            record)
+
+
+def _changes_parse_cb(output, longOutput=False, record=None):
+    return list(_changes_parse_lines(output.splitlines(True), longOutput,
+                                     record))
+
+
+def _changes_parse_nodes(nodes, longOutput=False, record=None):
+    for node in nodes:
+        yield _asRecord({'change': int(node['change']),
+                         'date': _marshalDate(node['time']),
+                         'user': node['user'],
+                         'client': node['client'],
+                         'description': _marshalDescription(node['desc'],
+                                                            longOutput)},
+                        record)
+
+
+def _files_parse_lines(lines, record=None):
+    fileRe = re.compile("^(?P<depotFile>//.*?)#(?P<rev>\d+) - "
+                        "(?P<action>[\w/]+) change (?P<change>\d+) "
+                        "\((?P<type>[\w+]+)\)$")
+
+    all_matches = (_match_or_raise(fileRe, l.strip(), "files")
+                   for l in lines)
+    return (_asRecord(_values_to_int(match.groupdict(), ['rev', 'change']),
+                      record)
+            for match in all_matches)
+
+
+def _files_parse_cb(output, record=None):
+    return list(_files_parse_lines(output.splitlines(True), record))
+
+
+def _files_parse_nodes(nodes, record=None):
+    for node in nodes:
+        hit = dict((key, node[key])
+                   for key in ('depotFile', 'rev', 'action', 'change',
+                               'type'))
+        yield _asRecord(_values_to_int(hit, ['rev', 'change']), record)
+
+
+def _filelog_argv(files, followIntegrations, longOutput, maxRevs):
+    if maxRevs is not None and not isinstance(maxRevs, int):
+        raise P4LibError("Incorrect 'maxRevs' value. It must be an "
+                         "integer: '%s' (type '%s')"
+                         % (maxRevs, type(maxRevs)))
+    if not files:
+        raise P4LibError("Missing/wrong number of arguments.")
+
+    optv = _argumentGenerator({'-i': followIntegrations,
+                               '-l': longOutput,
+                               '-m': maxRevs})
+    return ['filelog'] + optv + _normalizeFiles(files)
+
+
+def _filelog_hit(hit, record):
+    # The revisions are records once they are complete.
+    if record is not None:
+        hit['revs'] = [record(rev) for rev in hit['revs']]
+    return hit
+
+
+def _filelog_parse_lines(lines, longOutput=False, record=None):
+    # A file's history is complete once the next file starts.
+    hit = None
+    revRe = re.compile("^... #(?P<rev>\d+) change (?P<change>\d+) "
+                       "(?P<action>\w+) on (?P<date>[\d/]+) by "
+                       "(?P<user>[^\s@]+)@(?P<client>[^\s@]+) "
+                       "\((?P<type>[\w+]+)\)( '(?P<description>.*?)')?$")
+    for line in lines:
+        if longOutput and not line.strip():
+            continue  # skip blank lines
+        elif line.startswith('//'):
+            if hit is not None:
+                yield _filelog_hit(hit, record)
+            hit = {'depotFile': line.strip(), 'revs': []}
+        elif line.startswith('... ... '):
+            hit['revs'][-1]['notes'].append(line[8:].strip())
+        elif line.startswith('... '):
+            match = _match_or_raise(revRe, line, "filelog/Internal")
+            d = match.groupdict('')
+            d = _values_to_int(d, ['change', 'rev'])
+            d['notes'] = []
+            hit['revs'].append(d)
+        elif longOutput and line.startswith('\t'):
+            # Append this line (minus leading tab) to last hit's
+            # last rev's description.
+            hit['revs'][-1]['description'] += line[1:]
+        else:
+            raise P4LibError("Unexpected 'p4 filelog' output: '%s'"
+                             % line)
+    if hit is not None:
+        yield _filelog_hit(hit, record)
+
+
+def _filelog_parse_cb(output, longOutput=False, record=None):
+    return list(_filelog_parse_lines(output.splitlines(True), longOutput,
+                                     record))
+
+
+def _filelog_note(how, filename, startRev, endRev):
+    # 'p4 -G' gives the range of integrated revisions as '#<start>'
+    # (exclusive, '#none' from the first one) and '#<end>', the text
+    # output as '#<first>,#<last>' or '#<last>' for a single revision.
+    last = int(endRev[1:])
+    if startRev == '#none':
+        first = 1
+    else:
+        first = int(startRev[1:]) + 1
+    if first == last:
+        return '%s %s#%d' % (how, filename, last)
+    return '%s %s#%d,#%d' % (how, filename, first, last)
+
+
+def _filelog_parse_nodes(nodes, longOutput=False, record=None):
+    # One dict per file, with numbered keys for its revisions and their
+    # integration records ('how<rev>,<record>' and the like).
+    for node in nodes:
+        hit = {'depotFile': node['depotFile'], 'revs': []}
+        i = 0
+        while 'rev%d' % i in node:
+            rev = {'rev': int(node['rev%d' % i]),
+                   'change': int(node['change%d' % i]),
+                   'action': node['action%d' % i],
+                   'date': _marshalDate(node['time%d' % i]),
+                   'user': node['user%d' % i],
+                   'client': node['client%d' % i],
+                   'type': node['type%d' % i],
+                   'description': _marshalDescription(
+                       node.get('desc%d' % i, ''), longOutput),
+                   'notes': []}
+            j = 0
+            while 'how%d,%d' % (i, j) in node:
+                key = '%d,%d' % (i, j)
+                rev['notes'].append(_filelog_note(node['how' + key],
+                                                  node['file' + key],
+                                                  node['srev' + key],
+                                                  node['erev' + key]))
+                j += 1
+            hit['revs'].append(rev)
+            i += 1
+        yield _filelog_hit(hit, record)
+
+
+def _sync_parse_lines(lines):
+    # Forms of output:
+    #    //depot/foo#1 - updating C:\foo
+    #    //depot/foo#1 - is opened and not being changed
+    #    //depot/foo#1 - is opened at a later revision - not changed
+    #    //depot/foo#1 - deleted as C:\foo
+    #    ... //depot/foo - must resolve #2 before submitting
+    # There are probably others forms.
+    # A file is complete once the next one starts, as notes follow it.
+    hit = None
+    lineRe = re.compile('^(?P<depotFile>.+?)#(?P<rev>\d+) - '
+                        '(?P<comment>.+?)$')
+
+    for line in lines:
+        if line.startswith('... '):
+            note = line.split(' - ')[-1].strip()
+            hit['notes'].append(note)
+        else:
+            match = _match_or_raise(lineRe, line, "sync")
+            if hit is not None:
+                yield hit
+            hit = match.groupdict()
+            hit = _values_to_int(hit, ['rev'])
+            hit['notes'] = []
+    if hit is not None:
+        yield hit
+
+
+def _sync_parse_cb(output):
+    return list(_sync_parse_lines(output.splitlines(True)))
+
+
+# The 'p4 -G sync' actions, with the comments of the text output.
+_syncComments = {'added': 'added as %s',
+                 'deleted': 'deleted as %s',
+                 'updated': 'updating %s',
+                 'refreshed': 'refreshing %s'}
+
+
+def _sync_parse_nodes(nodes):
+    # Files come in 'stat' dicts. Messages about the last one, such as
+    # the ones about resolves, come in 'info' dicts.
+    hit = None
+    for node in nodes:
+        if node['code'] == 'info':
+            if hit is not None:
+                hit['notes'].append(node['data'].split(' - ')[-1].strip())
+            continue
+        if hit is not None:
+            yield hit
+        action = node.get('action', '')
+        comment = _syncComments.get(action, action + ' %s')
+        hit = {'depotFile': node['depotFile'],
+               'rev': int(node['rev']),
+               'comment': comment % node.get('clientFile', ''),
+               'notes': []}
+    if hit is not None:
+        yield hit
+
+
+# A depot file at a given revision, whose content never changes. A file at
+# a change ('@N') is not: N may be beyond the last change of the server,
+# and a later submit changes what it is.
+_pinnedFileSpecRe = re.compile(r'^(?P<path>//[^#@*]+?)#(?P<rev>\d+)$')
+
+
+def _pinnedFileSpec(spec):
+    """Return the (path, rev) of 'spec' if it is a single file at a fixed
+    revision, None otherwise."""
+    match = _pinnedFileSpecRe.match(spec)
+    if match is None:
+        return None
+    path = match.group('path')
+    if '...' in path or '%%' in path:
+        return None
+    return path, int(match.group('rev'))
+
+
+def _printData(data):
+    # The bytes of a 'p4 -G print' content chunk, which p4 gives as is.
+    if data.__class__ is bytes:
+        return data
+    return data.encode('utf-8', 'surrogateescape')
+
+
+class _PrintOutput:
+    """Where print_() writes the content of the printed files.
+
+    "output" is a path or a binary file object receiving the content of
+    all the files, or a callable returning such a path or file object
+    (or None to skip the file) for each hit.
+    """
+    def __init__(self, output):
+        self.output = output
+        self.perFile = callable(output) and not hasattr(output, 'write')
+        self.file = None
+        self.owned = False
+
+    def start(self, hit):
+        """Return the file object to write the content of 'hit' to."""
+        if not self.perFile:
+            if self.file is None:
+                self._open(self.output)
+        else:
+            self.close()
+            target = self.output(hit)
+            if target is not None:
+                self._open(target)
+        return self.file
+
+    def _open(self, target):
+        if hasattr(target, 'write'):
+            self.file = target
+            self.owned = False
+        else:
+            self.file = open(target, 'wb')
+            self.owned = True
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+        self.file = None
+        self.owned = False
+
+
+def _print_parse_nodes(nodes, binary=False, output=None):
+    """Return the print_() hits from the 'p4 -G print' dicts 'nodes'.
+
+    "binary" specifies to keep the content of all the files, binary
+        ones included, as bytes in the 'text' keys.
+    "output" specifies to write the content of the files as it comes
+        (see _PrintOutput) instead of keeping it in the hits.
+    """
+    # A file is started by a 'stat' node (an 'info' node for older
+    # servers) and its content comes in 'text' nodes ('binary' nodes for
+    # binary files), the last of which is empty.
+    hits = []
+    fileRe = re.compile("^(?P<depotFile>//.*?)#(?P<rev>\d+) - "
+                        "(?P<action>\w+) change (?P<change>\d+) "
+                        "\((?P<type>[\w+]+)\)$")
+    if binary or output is not None:
+        contentCodes = ('text', 'binary')
+    else:
+        contentCodes = ('text',)
+    target = _PrintOutput(output) if output is not None else None
+    # The content of the current hit: a list of chunks, or the file
+    # object it is written to.
+    chunks = None
+    sink = None
+    startHitWithNextNode = 1
+    try:
+        for node in nodes:
+            code = node['code']
+            if code == 'info' or code == 'stat':
+                if code == 'info':
+                    # Always start a new hit with an 'info' node.
+                    match = fileRe.match(node['data'])
+                    hit = match.groupdict()
+                else:
+                    hit = dict((key, node[key])
+                               for key in ('depotFile', 'rev', 'action',
+                                           'change', 'type')
+                               if key in node)
+                _printContent(hits, chunks, binary)
+                hits.append(_values_to_int(hit, ['change', 'rev']))
+                chunks = None
+                if target is not None:
+                    sink = target.start(hits[-1])
+                startHitWithNextNode = 0
+            elif code in contentCodes:
+                data = node['data']
+                if startHitWithNextNode:
+                    _printContent(hits, chunks, binary)
+                    hits.append({})
+                    chunks = None
+                    if target is not None:
+                        sink = target.start(hits[-1])
+                if target is not None:
+                    if sink is not None and data:
+                        sink.write(_printData(data))
+                elif chunks is None:
+                    chunks = [_printData(data) if binary else data]
+                elif data:
+                    chunks.append(_printData(data) if binary else data)
+                startHitWithNextNode = not data
+        _printContent(hits, chunks, binary)
+    finally:
+        if target is not None:
+            target.close()
+    return hits
+
+
+def _printContent(hits, chunks, binary):
+    # Set the 'text' of the last hit from its content chunks, if any.
+    if chunks is not None:
+        hits[-1]['text'] = (b'' if binary else '').join(chunks)
+
+
+_baseStat = {'clientFile': '',
+             'depotFile': '',
+             'path': '',
+             'headAction': '',
+             'headChange': 0,
+             'headRev': 0,
+             'headType': '',
+             'headTime': 0,
+             'haveRev': 0,
+             'action': '',
+             'actionOwner': '',
+             'change': '',
+             'unresolved': '',
+             'ourLock': 0,
+             }
+
+
+# The fstat fields whose values are numbers.
+_fstatIntFields = ('headChange', 'headRev', 'headTime', 'haveRev')
+
+
+def _fstat_hit(fields, record=None):
+    hit = copy.copy(_baseStat)
+    hit.update(fields)
+
+    if 'ourLock' in fields:
+        hit['ourLock'] = 1
+
+    return _asRecord(_values_to_int(hit, _fstatIntFields), record)
+
+
+def _fstat_projected_hit(fields, wanted, record=None):
+    # Only the 'wanted' fields, the missing ones of _baseStat with their
+    # default value.
+    hit = {}
+    for key in wanted:
+        if key in fields:
+            hit[key] = fields[key]
+        elif key in _baseStat:
+            hit[key] = _baseStat[key]
+
+    if 'ourLock' in fields and 'ourLock' in hit:
+        hit['ourLock'] = 1
+
+    return _asRecord(_values_to_int(hit, _fstatIntFields), record)
+
+
+def _fstat_argv(fields, filterExpression):
+    if fields is not None and (isinstance(fields, str) or not fields):
+        raise P4LibError("Incorrect 'fields' value. It must be a non-empty "
+                         "list of field names: '%s'" % (fields,))
+
+    argv = ['fstat', '-C', '-P']
+    if fields:
+        argv += ['-T', ','.join(fields)]
+    if filterExpression:
+        argv += ['-F', filterExpression]
+    return argv
+
+
+def _fstat_parse_lines(lines, record=None):
+    fileRe = re.compile("...\s(.*?)\s(.*)")
+
+    def match_file_block(stat):
+        matches = fileRe.findall(stat)
+        if not matches:
+            return None
+
+        return _fstat_hit(dict(matches), record)
+
+    # Files are separated by blank lines.
+    block = []
+    for line in lines:
+        if line.strip():
+            block.append(line)
+        elif block:
+            hit = match_file_block(''.join(block))
+            if hit:
+                yield hit
+            block = []
+    if block:
+        hit = match_file_block(''.join(block))
+        if hit:
+            yield hit
+
+
+def _fstat_parse_field_lines(lines, wanted, record=None):
+    # Only the 'wanted' fields: see _fstat_projected_hit(). The lines are
+    # split rather than matched, as there may be millions of them.
+    fields = {}
+    for line in lines:
+        if line.startswith('... '):
+            key, _, value = line[4:].rstrip('\n').partition(' ')
+            fields[key] = value
+        elif fields and not line.strip():
+            yield _fstat_projected_hit(fields, wanted, record)
+            fields = {}
+    if fields:
+        yield _fstat_projected_hit(fields, wanted, record)
+
+
+def _fstat_parse_cb(output, wanted=None, record=None):
+    lines = output.splitlines(True)
+    if wanted:
+        return list(_fstat_parse_field_lines(lines, wanted, record))
+    return list(_fstat_parse_lines(lines, record))
+
+
+def _fstat_parse_nodes(nodes, wanted=None, record=None):
+    for node in nodes:
+        if wanted:
+            yield _fstat_projected_hit(node, wanted, record)
+            continue
+        fields = dict(node)
+        del fields['code']
+        yield _fstat_hit(fields, record)
+
+
+def _diff2_parse_nodes(nodes):
+    diff = {}
+    infoRe = re.compile("^==== (?P<depotFile1>.+?)#(?P<rev1>\d+) "
+                        "\((?P<type1>[\w+]+)\) - "
+                        "(?P<depotFile2>.+?)#(?P<rev2>\d+) "
+                        "\((?P<type2>[\w+]+)\) "
+                        "==== (?P<summary>\w+)$")
+    for node in nodes:
+        if node['code'] == 'info'\
+           and node['data'] == '(... files differ ...)':
+            diff.setdefault('notes', []).append(node['data'])
+        elif node['code'] == 'info':
+            match = infoRe.match(node['data'])
+            d = match.groupdict()
+            d['rev1'] = int(d['rev1'])
+            d['rev2'] = int(d['rev2'])
+            diff.update(d)
+        elif node['code'] == 'stat':
+            # Newer servers give the header as a dict.
+            diff.update({'depotFile1': node['depotFile'],
+                         'rev1': int(node['rev']),
+                         'type1': node['type'],
+                         'depotFile2': node['depotFile2'],
+                         'rev2': int(node['rev2']),
+                         'type2': node['type2'],
+                         'summary': node['status']})
+        elif node['code'] == 'text':
+            if 'text' not in diff or diff['text'] is None:
+                diff['text'] = node['data']
+            else:
+                diff['text'] += node['data']
+    return diff
+
+
+_annotateHeaderRe = re.compile(r"^(?P<depotFile>//.*?)#(?P<rev>\d+) - "
+                               r"(?P<action>[\w/]+) change (?P<change>\d+) "
+                               r"\((?P<type>[\w+]+)\)$")
+
+
+def _annotate_parse_lines(lines):
+    # Example output ('<lower>-<upper>: ' with -a):
+    #   //depot/foo.txt#3 - edit change 1234 (text)
+    #   1: first line
+    #   3: second line
+    hits = []
+    for line in lines:
+        if line.startswith('//'):
+            hit = _match_or_raise(_annotateHeaderRe, line[:-1],
+                                  "annotate").groupdict()
+            hit = _values_to_int(hit, ['change', 'rev'])
+            hit['lines'] = []
+            hits.append(hit)
+            continue
+        prefix, sep, text = line.partition(': ')
+        if not sep or not hits:
+            raise P4LibError("Unexpected 'annotate' output: '%s'" % line)
+        lower, sep, upper = prefix.partition('-')
+        lower = int(lower)
+        hits[-1]['lines'].append((lower, sep and int(upper) or lower, text))
+    return hits
+
+
+def _splitLines(text):
+    """Return the lines of 'text' with their '\n', split on '\n' only as
+    p4 counts them: str.splitlines() also splits on '\f', '\v', '\x1c'
+    to '\x1e', '\x85' and more."""
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _annotate_parse_cb(output):
+    return _annotate_parse_lines(_splitLines(output))
+
+
+def _annotate_parse_nodes(nodes):
+    hits = []
+    for node in nodes:
+        if 'depotFile' in node:
+            hit = dict((key, node[key])
+                       for key in ('depotFile', 'rev', 'action', 'change',
+                                   'type')
+                       if key in node)
+            hit = _values_to_int(hit, ['change', 'rev'])
+            hit['lines'] = []
+            hits.append(hit)
+        elif 'data' in node and hits:
+            hits[-1]['lines'].append((int(node['lower']),
+                                      int(node['upper']), node['data']))
+    return hits
+
+
+def _diffHunks(text):
+    """Return the hunks of the diff text 'text' (see _DiffHunkCounter)."""
+    counter = _DiffHunkCounter()
+    for line in _splitLines(text):
+        counter.feed(line)
+    return counter.hunks
+
+
+def _annotateRuns(runs, hunks, origin):
+    """Return the runs of line origins of a file revision made from the
+    runs 'runs' of the previous revision and the 'hunks' of the normal
+    (not unified nor context, whose hunks include unchanged lines) diff
+    between both (see _DiffHunkCounter). The lines added by the diff
+    come from 'origin'.
+
+    A run is a [<count>, <origin>] list for consecutive lines coming
+    from the same revision, so that applying a diff costs a pass over
+    the runs instead of the lines.
+    """
+    result = []
+    # The runs not consumed yet, the next one last.
+    pending = runs[::-1]
+
+    def append(count, origin):
+        if result and result[-1][1] == origin:
+            result[-1][0] += count
+        elif count:
+            result.append([count, origin])
+
+    def consume(count, keep):
+        while count > 0:
+            if not pending:
+                raise P4LibError("Diff hunks beyond the end of the file.")
+            run = pending.pop()
+            if run[0] > count:
+                pending.append([run[0] - count, run[1]])
+                taken = count
+            else:
+                taken = run[0]
+            if keep:
+                append(taken, run[1])
+            count -= taken
+
+    line = 0
+    for hunk in hunks:
+        unchanged = hunk['oldStart'] - line
+        if hunk['oldLines']:
+            unchanged -= 1
+        consume(unchanged, True)
+        consume(hunk['oldLines'], False)
+        line += unchanged + hunk['oldLines']
+        append(hunk['newLines'], origin)
+    for run in pending[::-1]:
+        append(run[0], run[1])
+    return result
+
+
 #---- public stuff
 
 
@@ -638,13 +1924,665 @@ def parseOptv(optv):
     return optd
 
 
+def _commandName(argv):
+    """Return the name of the p4 command 'argv' (without the p4
+    options)."""
+    # Skip the '-x <argfile>' of the 'argfile' batch mode.
+    if argv[:1] == ['-x']:
+        return argv[2]
+    return argv[0]
+
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    _intern = intern  # Python 2
+
+
+def _recordSlots(fields, pathFields):
+    # A path field is kept as its interned directory and its file name.
+    slots = []
+    for field in fields:
+        if field in pathFields:
+            slots += ['_%sDir' % field, '_%sName' % field]
+        else:
+            slots.append(field)
+    return tuple(slots)
+
+
+def _record(cls):
+    """Complete the _Record subclass 'cls': its lookup tables and the
+    attributes of its path fields."""
+    cls._slotFields = frozenset(field for field in cls._fields
+                                if field not in cls._pathFields)
+    cls._pathSlots = dict((field, ('_%sDir' % field, '_%sName' % field))
+                          for field in cls._pathFields)
+    for field in cls._pathFields:
+        setattr(cls, field, property(lambda self, field=field: self[field]))
+    return cls
+
+
+class _Record(object):
+    """The base of the compact records of P4(compactRecords=True).
+
+    A record keeps the fields of the dict a parser would give in
+    __slots__, and has the read interface of a dict so that it can be
+    used as one. Its fields can also be set, and fields which are not
+    in its class are kept aside. The fields which were not given are
+    not in the record, as they would not be in the dict.
+
+    A record takes about half the memory of the dict: path fields are
+    kept as an interned directory and a file name, as most of them share
+    their directories, and the short strings which repeat, such as
+    actions and file types, are interned.
+    """
+    __slots__ = ('_extra',)
+    _fields = ()
+    _pathFields = ()
+    _internedFields = ()
+    _slotFields = frozenset()
+    _pathSlots = {}
+
+    def __init__(self, fields):
+        self._extra = None
+        for key, value in fields.items():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if key in self._pathSlots:
+            dirSlot, nameSlot = self._pathSlots[key]
+            if isinstance(value, str):
+                i = max(value.rfind('/'), value.rfind('\\')) + 1
+                setattr(self, dirSlot, _intern(value[:i]))
+                value = value[i:]
+            else:
+                setattr(self, dirSlot, '')
+            setattr(self, nameSlot, value)
+        elif key in self._slotFields:
+            if key in self._internedFields and isinstance(value, str):
+                value = _intern(value)
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __getitem__(self, key):
+        try:
+            if key in self._pathSlots:
+                dirSlot, nameSlot = self._pathSlots[key]
+                return getattr(self, dirSlot) + getattr(self, nameSlot)
+            if key in self._slotFields:
+                return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [field for field in self._fields if field in self]
+        if self._extra:
+            keys += list(self._extra)
+        return keys
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, _Record)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return self.__class__, (dict(self.items()),)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self.items()))
+
+
+@_record
+class HaveEntry(_Record):
+    """A file revision of have()."""
+    _fields = ('depotFile', 'rev', 'localFile')
+    _pathFields = ('depotFile', 'localFile')
+    __slots__ = _recordSlots(_fields, _pathFields)
+
+
+@_record
+class WhereEntry(_Record):
+    """A mapping of where()."""
+    _fields = ('minus', 'depotFile', 'clientFile', 'localFile')
+    _pathFields = ('depotFile', 'clientFile', 'localFile')
+    __slots__ = _recordSlots(_fields, _pathFields)
+
+
+@_record
+class FileRev(_Record):
+    """A file revision of files() or opened()."""
+    _fields = ('depotFile', 'rev', 'action', 'change', 'type', 'user',
+               'client')
+    _pathFields = ('depotFile',)
+    _internedFields = ('action', 'change', 'type', 'user', 'client')
+    __slots__ = _recordSlots(_fields, _pathFields)
+
+
+@_record
+class ChangeSummary(_Record):
+    """A changelist of changes()."""
+    _fields = ('change', 'date', 'user', 'client', 'description')
+    _pathFields = ()
+    _internedFields = ('date', 'user', 'client')
+    __slots__ = _recordSlots(_fields, _pathFields)
+
+
+@_record
+class FilelogRev(_Record):
+    """A revision of the 'revs' of a filelog() file."""
+    _fields = ('rev', 'change', 'action', 'date', 'user', 'client', 'type',
+               'description', 'notes')
+    _pathFields = ()
+    _internedFields = ('action', 'date', 'user', 'client', 'type')
+    __slots__ = _recordSlots(_fields, _pathFields)
+
+
+@_record
+class FstatRecord(_Record):
+    """A file of fstat()."""
+    _fields = ('clientFile', 'depotFile', 'path', 'headAction',
+               'headChange', 'headRev', 'headType', 'headTime', 'haveRev',
+               'action', 'actionOwner', 'change', 'unresolved', 'ourLock')
+    _pathFields = ('clientFile', 'depotFile', 'path')
+    _internedFields = ('headAction', 'headType', 'action', 'actionOwner',
+                       'change', 'unresolved')
+    __slots__ = _recordSlots(_fields, _pathFields)
+
+
+class ResultCache:
+    """A cache of the output of read-only p4 commands, for P4(cache=...).
+
+    Entries are keyed by the complete command line (p4 options
+    included), the working directory and the output format. They expire
+    after the time to live of their command and the least recently used
+    ones are evicted beyond 'maxEntries'. The commands which modify the
+    client or the depot, when run by a P4 using the cache, invalidate
+    the entries of the commands whose output they may change.
+
+    A cache may be shared by several P4 instances and threads.
+    """
+    # Times to live, in seconds, of the cached commands.
+    defaultTTLs = {'changes': 30,
+                   'client': 60,
+                   'have': 60,
+                   'opened': 30,
+                   'where': 300}
+
+    # The cached commands whose output each command may change.
+    invalidations = {'add': ('opened',),
+                     'edit': ('opened',),
+                     'delete': ('opened',),
+                     'revert': ('have', 'opened'),
+                     'submit': ('changes', 'have', 'opened'),
+                     'sync': ('have',),
+                     'flush': ('have',),
+                     'resolve': ('opened',),
+                     'change': ('changes', 'opened'),
+                     'client': ('client', 'have', 'opened', 'where')}
+
+    # Commands which only read their form with '-o'.
+    _formCommands = ('branch', 'change', 'client', 'label')
+
+    def __init__(self, ttls=None, maxEntries=1000):
+        """Create a result cache.
+
+        "ttls" is a dict of the times to live, in seconds, of the
+            commands to cache, updating 'defaultTTLs'. A time to live
+            of 0 disables the caching of a command.
+        "maxEntries" is the number of cached results beyond which the
+            least recently used ones are evicted.
+        """
+        self.ttls = dict(self.defaultTTLs)
+        if ttls:
+            self.ttls.update(ttls)
+        self.maxEntries = maxEntries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented by each invalidation, so that the output of a
+        # command which was running meanwhile is not stored.
+        self._generation = 0
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0,
+                          'invalidations': 0}
+        self._commandCounters = {}
+
+    def isCached(self, argv):
+        """Return true if the output of the p4 command 'argv' (without
+        the p4 options) is cached."""
+        command = _commandName(argv)
+        if not self.ttls.get(command):
+            return False
+        return command not in self._formCommands or '-o' in argv
+
+    def _key(self, argv, p4argv, runOptions):
+        return (_commandName(argv), tuple(p4argv),
+                tuple(sorted(runOptions.items())))
+
+    def get(self, argv, p4argv, runOptions):
+        """Return (<found>, <output>, <generation>) for the p4 command
+        'argv' run as the complete arg vector 'p4argv' with the _run()
+        keyword arguments 'runOptions'. <generation> is to be given to
+        put().
+        """
+        command = _commandName(argv)
+        key = self._key(argv, p4argv, runOptions)
+        with self._lock:
+            counters = self._commandCounters.setdefault(
+                command, {'hits': 0, 'misses': 0})
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                self._entries[key] = entry
+                self._counters['hits'] += 1
+                counters['hits'] += 1
+                return True, entry[1], self._generation
+            self._counters['misses'] += 1
+            counters['misses'] += 1
+            return False, None, self._generation
+
+    def put(self, argv, p4argv, runOptions, output, generation):
+        """Store the output of a p4 command (see get()), unless the cache
+        was invalidated since get() gave 'generation'.
+        """
+        key = self._key(argv, p4argv, runOptions)
+        expiry = time.time() + self.ttls[_commandName(argv)]
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (expiry, output)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, argv):
+        """Invalidate the entries whose output the p4 command 'argv' may
+        change."""
+        command = _commandName(argv)
+        if command not in self.invalidations or '-n' in argv:
+            return
+        if command in self._formCommands and '-o' in argv:
+            return
+        commands = self.invalidations[command]
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries
+                        if key[0] in commands]:
+                del self._entries[key]
+                self._counters['invalidations'] += 1
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Return the cache counters as a dict with the 'hits', 'misses',
+        'evictions', 'invalidations' and current 'entries' counts, and
+        the 'hits' and 'misses' of each command in 'commands'.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['commands'] = dict((command, dict(counters))
+                                     for command, counters
+                                     in self._commandCounters.items())
+            return stats
+
+
+class _DirectoryCache:
+    """An on-disk cache of the results of commands which never change,
+    one file per key in the subdirectories of 'directory'.
+
+    The files are written under a temporary name then renamed, so that
+    several processes may share the directory. Beyond 'maxSize' bytes,
+    the least recently used files are removed.
+
+    Subclasses build the key of their results in _key() and, unless they
+    are kept as zlib compressed JSON, encode them in _encode() and
+    _decode().
+    """
+    def __init__(self, directory, subdirs, maxSize):
+        self.directory = directory
+        self.maxSize = maxSize
+        self._subdirs = [os.path.join(directory, subdir)
+                         for subdir in subdirs]
+        for path in self._subdirs:
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # Created by another process meanwhile.
+                    if not os.path.isdir(path):
+                        raise
+        self._lock = threading.Lock()
+        # The size of the cached files, scanned on the first write.
+        self._size = None
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0,
+                          'evictions': 0}
+
+    def _count(self, counter, increment=1):
+        with self._lock:
+            self._counters[counter] += increment
+
+    def _key(self, *args):
+        """Return the parts of the key of a result as a tuple."""
+        raise NotImplementedError
+
+    def _path(self, *args):
+        key = '\0'.join('%s' % part for part in self._key(*args))
+        return os.path.join(self._subdirs[0],
+                            hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def _encode(self, value):
+        """Return the bytes to cache for 'value', or None if it cannot be
+        cached."""
+        try:
+            data = json.dumps(value, sort_keys=True, separators=(',', ':'))
+        except UnicodeDecodeError:
+            # Python 2 text which is not UTF-8: not cached.
+            return None
+        return zlib.compress(data.encode('utf-8'))
+
+    def _decode(self, data):
+        """Return the value of the cached bytes 'data', or None."""
+        return _decodeJSON(json.loads(zlib.decompress(data).decode('utf-8')))
+
+    def get(self, *args):
+        """Return the result cached for the key arguments 'args' (see the
+        subclass), or None if it is not cached."""
+        data = self._read(self._path(*args))
+        value = None
+        if data is not None:
+            try:
+                value = self._decode(data)
+            except (ValueError, zlib.error):
+                # Truncated, or written by an incompatible version.
+                pass
+        self._count(value is None and 'misses' or 'hits')
+        return value
+
+    def put(self, *args):
+        """Store the result given last in 'args' for the key arguments
+        before it (see get())."""
+        data = self._encode(args[-1])
+        if data is not None:
+            self._write(self._path(*args[:-1]), data)
+            self._count('stores')
+
+    def _read(self, path):
+        """Return the content of the cached file 'path', or None."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            # Not cached, or removed by another process meanwhile.
+            return None
+        return data
+
+    def _write(self, path, data):
+        """Cache the bytes 'data' as 'path'."""
+        _atomicWrite(path, data)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._files())
+            else:
+                self._size += len(data)
+            if self._size > self.maxSize:
+                self._evict()
+
+    def _files(self):
+        files = []
+        for directory in self._subdirs:
+            for name in os.listdir(directory):
+                if name.startswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def _evict(self):
+        # Down to 90% of the maximum size so as not to scan the
+        # directories on every write.
+        files = sorted(self._files())
+        size = sum(size for _, size, _ in files)
+        for mtime, fileSize, path in files:
+            if size <= self.maxSize * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= fileSize
+            self._counters['evictions'] += 1
+        self._size = size
+
+    def stats(self):
+        """Return the cache counters as a dict with the 'hits', 'misses',
+        'stores' and 'evictions' counts of this instance."""
+        with self._lock:
+            return dict(self._counters)
+
+
+class PrintCache(_DirectoryCache):
+    """An on-disk cache of the print_() results of pinned file
+    revisions, for P4(printCache=...).
+
+    A depot file at a revision ('//depot/foo.c#12') always has the same
+    content, so its result is kept in 'directory':
+        index/<hash>        the print_ result of a file specification on
+                            a server, without the text (JSON)
+        objects/<digest>    the text, named by its MD5 digest as in the
+                            'digest' field of 'p4 fstat -Ol', and shared
+                            by the revisions with the same content
+    Only specifications in depot syntax should be used: the file a
+    client syntax specification maps to depends on the client view.
+
+    The results are looked up with get(port, spec) and stored with
+    put(port, spec, hit).
+    """
+    def __init__(self, directory, maxSize=256 * 1024 * 1024):
+        """Create a print cache in 'directory' (created if needed).
+
+        "maxSize" is the size in bytes of the cached files beyond which
+            the least recently used ones are removed.
+        """
+        _DirectoryCache.__init__(self, directory, ['index', 'objects'],
+                                 maxSize)
+
+    def _key(self, port, spec):
+        return (port, spec)
+
+    def _objectPath(self, digest):
+        return os.path.join(self._subdirs[1], digest)
+
+    def content(self, digest):
+        """Return the cached bytes with the given MD5 'digest', or None."""
+        return self._read(self._objectPath(digest.upper()))
+
+    def _encode(self, hit):
+        # The text is stored apart, under its digest.
+        entry = dict((key, value) for key, value in hit.items()
+                     if key != 'text')
+        if hit.get('text') is not None:
+            data = hit['text']
+            if sys.version_info.major > 2:
+                data = data.encode('utf-8', 'surrogateescape')
+            entry['digest'] = hashlib.md5(data).hexdigest().upper()
+            path = self._objectPath(entry['digest'])
+            if not os.path.exists(path):
+                self._write(path, data)
+        return json.dumps(entry, sort_keys=True).encode('utf-8')
+
+    def _decode(self, data):
+        hit = _decodeJSON(json.loads(data.decode('utf-8')))
+        # Index entries left without their object are misses.
+        digest = hit.pop('digest', None)
+        if digest is not None:
+            data = self.content(digest)
+            if data is None:
+                return None
+            if sys.version_info.major > 2:
+                data = data.decode('utf-8', 'surrogateescape')
+            hit['text'] = data
+        return hit
+
+
+class DescribeCache(_DirectoryCache):
+    """An on-disk cache of the describe() results of submitted
+    changelists, for P4(describeCache=...).
+
+    A submitted changelist does not change, so its description is kept
+    in 'directory' as zlib compressed JSON, one file per server, change
+    number, diff format and form. The descriptions of pending changes
+    are never cached.
+
+    The results are looked up with get(port, change, diffFormat,
+    shortForm) and stored with put(port, change, diffFormat, shortForm,
+    desc).
+    """
+    def __init__(self, directory, maxSize=64 * 1024 * 1024):
+        """Create a describe cache in 'directory' (created if needed).
+
+        "maxSize" is the size in bytes of the cached files beyond which
+            the least recently used ones are removed.
+        """
+        _DirectoryCache.__init__(self, directory, ['describe'], maxSize)
+
+    def _key(self, port, change, diffFormat, shortForm):
+        return (port, change, diffFormat, int(bool(shortForm)))
+
+
+class AnnotateCache(_DirectoryCache):
+    """An on-disk cache of the annotate() results of file revisions, for
+    P4(annotateCache=...).
+
+    The revision or change each line of a file revision comes from never
+    changes. It is kept in 'directory' as zlib compressed JSON, one file
+    per server, file revision and numbering (revisions or changes), as
+    runs of [<count>, <origin>] for consecutive lines of the same origin.
+    The text of the lines is not kept: print_() gives it (from its own
+    cache with a 'printCache').
+
+    The entries are looked up with get(port, depotFile, rev,
+    changeNumbers) and stored with put(port, depotFile, rev,
+    changeNumbers, entry). An entry is the annotate() dict without
+    'lines' and with 'runs', the list of the runs of its lines.
+    """
+    def __init__(self, directory, maxSize=64 * 1024 * 1024):
+        """Create an annotate cache in 'directory' (created if needed).
+
+        "maxSize" is the size in bytes of the cached files beyond which
+            the least recently used ones are removed.
+        """
+        _DirectoryCache.__init__(self, directory, ['annotate'], maxSize)
+
+    def _key(self, port, depotFile, rev, changeNumbers):
+        return (port, depotFile, int(rev), int(bool(changeNumbers)))
+
+
 class P4:
     """A proxy to the Perforce client app 'p4'."""
-    def __init__(self, p4='p4', **options):
+    def __init__(self, p4='p4', batchMode='chunks', maxWorkers=1,
+                 useMarshal=False, cache=None, printCache=None,
+                 describeCache=None, annotateCache=None, instrument=False,
+                 compactRecords=False, **options):
         """Create a 'p4' proxy object.
 
         "p4" is the Perforce client to execute commands with. Defaults
             to 'p4'.
+        "batchMode" controls how commands working on a large set of
+            files ('opened', 'sync' and 'resolve') are run:
+                'chunks'    (the default) run one 'p4' process for
+                            every 10 files.
+                'argfile'   write all the files to a temporary argument
+                            file and run a single 'p4 -x <argfile> ...'
+                            process, whatever the number of files.
+            The number of spawned processes and the wall time spent in
+            these commands are accumulated in the 'batchStats'
+            attribute.
+        "maxWorkers" is the number of 'p4' processes that may run at
+            the same time for one of these batched commands (as well as
+            'have' and 'fstat'). The default, 1, runs them one after
+            the other. Otherwise the files are split over up to
+            "maxWorkers" processes run from a thread pool and their
+            outputs are merged back in the original order.
+        "useMarshal" specifies to run the commands with 'p4 -G' and to
+            build their results from the marshalled dicts rather than by
+            parsing the text output. The results are the same, except
+            for dates which come from the client's timezone. This is
+            done for changes, describe (with 'shortForm'), files,
+            filelog, fstat, have, opened, sync and where, and for their
+            iter_* variants. Calls with '_raw' still return the text
+            output. print_ and diff2 always use 'p4 -G'.
+        "cache" is a ResultCache in which to keep the output of the
+            read-only commands (by default changes, client, have,
+            opened and where), or True for a new ResultCache with the
+            default settings. The commands run by this instance which
+            modify the client or the depot invalidate the affected
+            entries. Defaults to None, no cache.
+        "printCache" is a PrintCache, or the directory of one, in which
+            print_() keeps and looks up the content of files at a
+            revision.
+        "describeCache" is a DescribeCache, or the directory of one, in
+            which describe() keeps and looks up the descriptions of
+            submitted changes.
+        "annotateCache" is an AnnotateCache, or the directory of one, in
+            which annotate() keeps and looks up the line origins of file
+            revisions.
+        "instrument" specifies to measure the p4 processes run and the
+            parsing of their output, see stats() and addHook().
+        "compactRecords" specifies to return the files and changes of
+            have(), where(), opened(), files(), changes(), filelog()
+            (its 'revs') and fstat(), and of their iter_*() versions, as
+            HaveEntry, WhereEntry, FileRev, ChangeSummary, FilelogRev
+            and FstatRecord objects. These records can be read like the
+            dicts they replace in a fraction of their memory, but they
+            are not dicts: use dict(record) where one is needed.
         Optional keyword arguments:
             "client" specifies the client name, overriding the value of
                 $P4CLIENT in the environment and the default (the hostname).
@@ -661,56 +2599,410 @@ class P4:
             "user" specifies the user name, overriding the value of $P4USER,
                 $USER, and $USERNAME in the environment.
         """
+        if batchMode not in ('chunks', 'argfile'):
+            raise P4LibError("Incorrect 'batchMode' value: '%s'" % batchMode)
+        if not isinstance(maxWorkers, int) or maxWorkers < 1:
+            raise P4LibError("Incorrect 'maxWorkers' value. It must be a "
+                             "positive integer: '%s'" % maxWorkers)
         self.p4 = p4
+        self.batchMode = batchMode
+        self.maxWorkers = maxWorkers
+        self.batchStats = {'runs': 0, 'files': 0, 'spawns': 0, 'time': 0.0}
+        self.useMarshal = useMarshal
+        if cache is True:
+            cache = ResultCache()
+        self.cache = cache
+        if isinstance(printCache, str):
+            printCache = PrintCache(printCache)
+        self.printCache = printCache
+        if isinstance(describeCache, str):
+            describeCache = DescribeCache(describeCache)
+        self.describeCache = describeCache
+        if isinstance(annotateCache, str):
+            annotateCache = AnnotateCache(annotateCache)
+        self.annotateCache = annotateCache
+        self.instrument = instrument
+        self.compactRecords = compactRecords
+        self.hooks = []
+        # The changes known to be submitted, by server: see change_status().
+        self._submittedChanges = set()
+        self._statsLock = threading.Lock()
+        self._stats = {}
         self.optd = options
         self._optv = makeOptv(**self.optd)
 
-    def _p4run(self, argv, **p4options):
+    # The upper bounds, in seconds, of the buckets of the histograms of
+    # stats(). The last bucket has no bound.
+    histogramBounds = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2,
+                       0.5, 1, 2, 5, 10)
+
+    def addHook(self, callback):
+        """Call 'callback' with a dict describing each p4 process run by
+        this instance and each parsing of an output, and turn
+        'instrument' on.
+
+        The dicts describing a p4 process have the keys:
+            'event'         'run'
+            'command'       the p4 command, e.g. 'opened'
+            'argvSize'      the length of the command line
+            'marshalled'    true if the command was run with 'p4 -G'
+            'spawnTime'     the time taken to start the process
+            'firstByteTime' the time from the start of the process to
+                            its first output, None on Windows
+            'runTime'       the time from the start of the process to
+                            the end of its output
+            'bytesRead'     the size of the output (in characters for
+                            text output)
+        The dicts describing a parsing have the keys:
+            'event'         'parse'
+            'command'       the p4 command
+            'parseTime'     the time taken to make the results
+            'records'       the number of results
+        Times are in seconds. The callbacks are called by the thread
+        running the command (see 'maxWorkers'). The iter_* generators
+        are not measured.
+        """
+        self.instrument = True
+        self.hooks.append(callback)
+
+    def removeHook(self, callback):
+        """Stop calling 'callback' added by addHook()."""
+        self.hooks.remove(callback)
+
+    def stats(self):
+        """Return the measures aggregated per p4 command since this
+        instance is instrumented (see 'instrument' and addHook()).
+
+        Returns a dict with a dict for each command, with the number of
+        processes run ('runs') and of outputs parsed ('parses'), the
+        totals of the 'spawnTime', 'firstByteTime', 'runTime',
+        'bytesRead', 'parseTime' and 'records' measures, and the
+        'runTimeHistogram' and 'parseTimeHistogram' lists of
+        (<upper bound>, <count>) pairs, the last upper bound being None.
+        """
+        bounds = list(self.histogramBounds) + [None]
+        with self._statsLock:
+            stats = {}
+            for command, measures in self._stats.items():
+                stats[command] = dict(measures)
+                for key in ('runTimeHistogram', 'parseTimeHistogram'):
+                    stats[command][key] = list(zip(bounds, measures[key]))
+            return stats
+
+    def _report(self, event):
+        """Add the measures of 'event' to stats() and pass it to the
+        hooks."""
+        with self._statsLock:
+            measures = self._stats.get(event['command'])
+            if measures is None:
+                buckets = len(self.histogramBounds) + 1
+                measures = {'runs': 0, 'spawnTime': 0.0,
+                            'firstByteTime': 0.0, 'runTime': 0.0,
+                            'bytesRead': 0, 'runTimeHistogram': [0] * buckets,
+                            'parses': 0, 'parseTime': 0.0, 'records': 0,
+                            'parseTimeHistogram': [0] * buckets}
+                self._stats[event['command']] = measures
+            if event['event'] == 'run':
+                measures['runs'] += 1
+                for key in ('spawnTime', 'firstByteTime', 'runTime',
+                            'bytesRead'):
+                    measures[key] += event[key] or 0
+                duration = event['runTime']
+            else:
+                measures['parses'] += 1
+                measures['parseTime'] += event['parseTime']
+                measures['records'] += event['records']
+                duration = event['parseTime']
+            histogram = measures[event['event'] + 'TimeHistogram']
+            histogram[bisect.bisect_left(self.histogramBounds,
+                                         duration)] += 1
+        for hook in list(self.hooks):
+            hook(event)
+
+    def _spawn(self, argv, p4argv, kwargs):
+        """Run the p4 command 'argv' as the complete arg vector 'p4argv'
+        with the _run() keyword arguments 'kwargs', measured if
+        'instrument'."""
+        if not self.instrument:
+            return _run(p4argv, **kwargs)
+
+        timings = {'spawnTime': None, 'firstByteTime': None,
+                   'bytesRead': 0}
+        start = _clock()
+        try:
+            return _run(p4argv, timings=timings, **kwargs)
+        finally:
+            event = {'event': 'run', 'command': _commandName(argv),
+                     'argvSize': len(_joinArgv(p4argv)),
+                     'marshalled': bool(kwargs.get('marshalled')),
+                     'runTime': _clock() - start}
+            event.update(timings)
+            self._report(event)
+
+    def _parse(self, argv, parse, *args):
+        """Return 'parse(*args)', the results made from the output of the
+        p4 command 'argv', measured if 'instrument'."""
+        if not self.instrument:
+            return parse(*args)
+
+        start = _clock()
+        results = parse(*args)
+        self._report({'event': 'parse', 'command': _commandName(argv),
+                      'parseTime': _clock() - start,
+                      'records': (len(results) if isinstance(results, list)
+                                  else 1)})
+        return results
+
+    def _p4optv(self, p4options):
+        """Return the p4 option vector and the working directory to run a
+        command with.
+
+        The current instance's p4 options are optionally overriden by
+        'p4options'. The working directory is the 'dir' option if it is
+        an existing directory, None otherwise.
+        """
+        if p4options:
+            d = dict(self.optd)
+            d.update(p4options)
+            p4optv = makeOptv(**d)
+        else:
+            d = self.optd
+            p4optv = self._optv
+
+        cwd = d.get('dir')
+        if cwd and os.path.isdir(cwd):
+            cwd = os.path.abspath(cwd)
+        else:
+            cwd = None
+        return p4optv, cwd
+
+    def _port(self, p4options):
+        """Return the server used with the given per-call p4 options."""
+        return p4options.get('port', self.optd.get('port',
+                                                   os.environ.get('P4PORT',
+                                                                  '')))
+
+    def _p4argv(self, argv, marshalled, p4options):
+        """Return the complete p4 arg vector to run 'argv' with and the
+        keyword arguments for _run() or _stream().
+        """
+        p4optv, cwd = self._p4optv(p4options)
+        kwargs = {}
+        if cwd:
+            kwargs['cwd'] = cwd
+        if marshalled:
+            p4optv = ['-G'] + p4optv
+            kwargs['marshalled'] = True
+        return [self.p4] + p4optv + argv, kwargs
+
+    def _p4run(self, argv, marshalled=False, **p4options):
         """Run the given p4 command.
         
         The current instance's p4 and p4 options (optionally overriden by
         **p4options) are used. The 3-tuple (<output>, <error>, <retval>) is
-        returned.
+        returned. If "marshalled", the command is run with 'p4 -G' and
+        <output> is the marshalled bytes.
         """
-        if p4options:
-            d = self.optd
-            d.update(p4options)
-            p4optv = makeOptv(**d)
-        else:
-            p4optv = self._optv
-        argv = [self.p4] + p4optv + argv
-        return _run(argv)
+        p4argv, kwargs = self._p4argv(argv, marshalled, p4options)
+        return self._cached_run(argv, p4argv, kwargs,
+                                lambda: self._spawn(argv, p4argv, kwargs))
+
+    def _cached_run(self, argv, p4argv, kwargs, spawn):
+        """Return the output of 'spawn()', which runs the p4 command
+        'argv', from the result cache if it is cached there under the
+        complete arg vector 'p4argv' and the _run() keyword arguments
+        'kwargs'.
+        """
+        if self.cache is None:
+            return spawn()
+
+        if self.cache.isCached(argv):
+            found, output, generation = self.cache.get(argv, p4argv, kwargs)
+            if not found:
+                output = spawn()
+                self.cache.put(argv, p4argv, kwargs, output, generation)
+            return output
+
+        try:
+            return spawn()
+        finally:
+            self.cache.invalidate(argv)
+
+    def _p4stream(self, argv, marshalled=False, **p4options):
+        """Generate the output lines of the given p4 command as it
+        writes them, or its dicts if "marshalled".
+
+        See _p4run(). Nothing is run before the first line is requested.
+        """
+        p4argv, kwargs = self._p4argv(argv, marshalled, p4options)
+        lines = _stream(p4argv, **kwargs)
+        if self.cache is None:
+            return lines
+        return self._invalidating_stream(argv, lines)
+
+    def _invalidating_stream(self, argv, lines):
+        # Invalidate the cache once the command is over (e.g. an
+        # 'iter_sync()' changes the output of 'have').
+        try:
+            for line in lines:
+                yield line
+        finally:
+            lines.close()
+            self.cache.invalidate(argv)
+
+    def _record(self, recordClass):
+        """Return the record class for parsers to make their results with,
+        None to keep dicts."""
+        if self.compactRecords:
+            return recordClass
+        return None
 
     def _run_and_process(self, argv, process_callback,
-                         raw, **p4options):
+                         raw, process_nodes=None, **p4options):
+        """Run the given p4 command and return its results made by
+        'process_callback' from its output.
+
+        With 'useMarshal', the command is run with 'p4 -G' instead and
+        the results are made by 'process_nodes' from the dicts, if
+        given.
+        """
+        if self.useMarshal and process_nodes is not None and not raw:
+            output, error, retval = self._p4run(argv, marshalled=True,
+                                                **p4options)
+            return self._parse(argv, process_nodes,
+                               _marshalOutputNodes(output))
+
         output, error, retval = self._p4run(argv, **p4options)
 
         if raw:
             return {'stdout': output, 'stderr': error, 'retval': retval}
 
-        return process_callback(output)
+        return self._parse(argv, process_callback, output)
+
+    def _batch_run_nodes(self, argv, files, process_nodes, p4options):
+        """Run 'argv' on 'files' like _batch_run() but with 'p4 -G' and
+        return the list of the results made by 'process_nodes' from the
+        dicts.
+        """
+        results = self._batch_run(argv, files, p4options, marshalled=True)
+        return self._parse(argv, lambda: list(process_nodes(
+            _marshalOutputNodes(results["stdout"]))))
 
-    def _batch_run(self, argv, files, p4options):
+    def _batch_run(self, argv, files, p4options, marshalled=False):
         SET_SIZE = 10
 
-        results = {"stdout": '', "stderr": '', "retval": 0}
+        start = time.time()
+        if files and self.batchMode == 'argfile':
+            # One argument file per worker.
+            count = min(self.maxWorkers, len(files))
+            size = -(-len(files) // count)
+            sets = [files[i:i + size] for i in range(0, len(files), size)]
+            run_set = lambda set_files: self._argfile_run(argv, set_files,
+                                                          p4options,
+                                                          marshalled)
+        elif files:
+            # Chunks only for the workers to share: one process is
+            # cheaper than several one after the other.
+            if self.maxWorkers > 1:
+                sets = [files[i:i + SET_SIZE]
+                        for i in range(0, len(files), SET_SIZE)]
+            else:
+                sets = [files]
+            run_set = lambda set_files: self._p4run(argv[:] + set_files,
+                                                    marshalled, **p4options)
+        else:
+            sets = [[]]
+            run_set = lambda set_files: self._p4run(argv, marshalled,
+                                                    **p4options)
+
+        if self.maxWorkers > 1 and len(sets) > 1:
+            pool = ThreadPool(min(self.maxWorkers, len(sets)))
+            try:
+                outputs = pool.map(run_set, sets)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            outputs = [run_set(set_files) for set_files in sets]
+
+        if marshalled:
+            stdout = b''.join(stdout for stdout, _, _ in outputs)
+        else:
+            stdout = ''.join(stdout for stdout, _, _ in outputs)
+        results = {"stdout": stdout,
+                   "stderr": ''.join(stderr for _, stderr, _ in outputs)}
         if files:
-            for i in range(0, len(files), SET_SIZE):
-                set_argv = argv[:] + files[i:i + SET_SIZE]
-                stdout, stderr, retval = self._p4run(set_argv, **p4options)
-                results["stdout"] += stdout
-                results["stderr"] += stderr
-
-                #XXX just add up retvals for now?!
-                results["retval"] += retval or 0
+            #XXX just add up retvals for now?!
+            results["retval"] = sum(retval or 0 for _, _, retval in outputs)
         else:
-            stdout, stderr, retval = self._p4run(argv, **p4options)
-            results["stdout"] = stdout
-            results["stderr"] = stderr
-            results["retval"] = retval
+            results["retval"] = outputs[0][2]
+
+        self.batchStats['runs'] += 1
+        self.batchStats['files'] += len(files or [])
+        self.batchStats['spawns'] += len(sets)
+        self.batchStats['time'] += time.time() - start
 
         return results
 
+    def _argfile_run(self, argv, files, p4options, marshalled=False):
+        """Run 'argv' once for all 'files' using 'p4 -x <argfile>'.
+
+        p4 runs the command on the arguments read from the file and
+        writes the output for each of them, in order, on the same
+        stream. The output is therefore in the same form as the one of
+        the 'chunks' batch mode and goes through the same parsers.
+        """
+        def spawn():
+            argfile = None
+            try:
+                argfile = _writeTemporaryForm(''.join(f + '\n'
+                                                      for f in files))
+                argfileArgv = ['-x', argfile] + argv
+                p4argv, kwargs = self._p4argv(argfileArgv, marshalled,
+                                              p4options)
+                return self._spawn(argfileArgv, p4argv, kwargs)
+            finally:
+                _removeTemporaryForm(argfile)
+
+        # Cached under the files, as in the 'chunks' batch mode: the
+        # argument file has a new name on every run.
+        p4argv, kwargs = self._p4argv(argv + files, marshalled, p4options)
+        return self._cached_run(argv, p4argv, kwargs, spawn)
+
+    def _batch_stream(self, argv, files, p4options, marshalled=False):
+        """Generate the output lines (or dicts if "marshalled") of 'argv'
+        run on 'files'.
+
+        The streaming counterpart of _batch_run(), with the same sets of
+        files, but run one after the other whatever 'maxWorkers' is, so
+        that the output comes in order as it is read.
+        """
+        SET_SIZE = 10
+
+        argfile = None
+        if files and self.batchMode == 'argfile':
+            argfile = _writeTemporaryForm(''.join(f + '\n' for f in files))
+            argvs = [['-x', argfile] + argv]
+        elif files and self.maxWorkers > 1:
+            argvs = [argv + files[i:i + SET_SIZE]
+                     for i in range(0, len(files), SET_SIZE)]
+        else:
+            argvs = [argv + (files or [])]
+
+        self.batchStats['runs'] += 1
+        self.batchStats['files'] += len(files or [])
+        try:
+            for set_argv in argvs:
+                lines = self._p4stream(set_argv, marshalled, **p4options)
+                self.batchStats['spawns'] += 1
+                try:
+                    for line in lines:
+                        yield line
+                finally:
+                    lines.close()
+        finally:
+            _removeTemporaryForm(argfile)
+
     def opened(self, files=[], allClients=False, change=None, _raw=False,
                **p4options):
         """Get a list of files opened in a pending changelist.
@@ -730,43 +3022,44 @@ class P4:
         with the unprocessed results of calling p4:
             {'stdout': <stdout>, 'stderr': <stderr>, 'retval': <retval>}
         """
-        # Output examples:
-        # - normal:
-        #   //depot/apps/px/px.py#3 - edit default change (text)
-        # - with '-a':
-        #   //depot/foo.txt#1 - edit change 12345 (text+w) by trentm@trentm-pliers
-        # - none opened:
-        #   foo.txt - file(s) not opened on this client.
         optv = _argumentGenerator({'-a': allClients, '-c': change})
 
         argv = ['opened'] + optv
+        record = self._record(FileRev)
+        if self.useMarshal and not _raw:
+            return self._batch_run_nodes(
+                argv, _normalizeFiles(files),
+                lambda nodes: _opened_parse_nodes(nodes, allClients, record),
+                p4options)
+
         results = self._batch_run(argv, _normalizeFiles(files), p4options)
         
         if _raw:
             return results
 
-        lineRe = re.compile('''^
-            (?P<depotFile>.*?)\#(?P<rev>\d+)    # //depot/foo.txt#1
-            \s-\s(?P<action>\w+)                # - edit
-            \s(default\schange|change\s(?P<change>\d+))  # change 12345
-            \s\((?P<type>[\w+]+)\)          # (text+w)
-            (\sby\s)?                           # by
-            ((?P<user>[^\s@]+)@(?P<client>[^\s@]+))?    # trentm@trentm-pliers
-            ''', re.VERBOSE)
-        files = []
-        for line in results["stdout"].splitlines(True):
-            match = _match_or_raise(lineRe, line, "opened")
-            fileinfo = match.groupdict()
-            fileinfo = _values_to_int(fileinfo, ['rev', 'change'])
+        return self._parse(argv, _opened_parse_cb, results["stdout"],
+                           record)
 
-            if not fileinfo['change']:
-                fileinfo['change'] = 'default'
+    def iter_opened(self, files=[], allClients=False, change=None,
+                    **p4options):
+        """Generate the files opened in pending changelists as p4 lists
+        them.
 
-            fileinfo = _prune_none_values(fileinfo)
+        Takes the same arguments as .opened() and generates the same
+        dicts, each one as soon as it has been read.
+        """
+        optv = _argumentGenerator({'-a': allClients, '-c': change})
 
-            files.append(fileinfo)
+        argv = ['opened'] + optv
+        lines = self._batch_stream(argv, _normalizeFiles(files), p4options,
+                                   self.useMarshal)
+        record = self._record(FileRev)
 
-        return files
+        if self.useMarshal:
+            return _process_stream(lines, lambda nodes: _opened_parse_nodes(
+                nodes, allClients, record))
+        return _process_stream(lines, lambda lines: _opened_parse_lines(
+            lines, record))
 
     def where(self, files=[], _raw=0, **p4options):
         """Show how filenames map through the client view.
@@ -783,51 +3076,17 @@ class P4:
         with the unprocessed results of calling p4:
             {'stdout': <stdout>, 'stderr': <stderr>, 'retval': <retval>}
         """
-        # Output examples:
-        #  -//depot/foo/Py-2_1/... //trentm-ra/foo/Py-2_1/... c:\trentm\foo\Py-2_1\...
-        #  //depot/foo/win/... //trentm-ra/foo/win/... c:\trentm\foo\win\...
-        #  //depot/foo/Py Exts.dsw //trentm-ra/foo/Py Exts.dsw c:\trentm\foo\Py Exts.dsw
-        #  //depot/foo/%1 //trentm-ra/foo/%1 c:\trentm\foo\%1
-        # The last one is surprising. It comes from using '*' in the
-        # client spec.
-        def where_result_cb(output):
-            results = []
-            for line in output.splitlines(True):
-                # With spaces inside filenames, the parsing is done by
-                # searching // and platform specific marker for the
-                # third part.
-                # Rather dans Regular Expressions.
-                fileinfo = {}
-                line = _rstriponce(line)
-                if line.startswith('-'):
-                    fileinfo['minus'] = 1
-                    line = line[1:]
-                else:
-                    fileinfo['minus'] = 0
-                depotStart = line.find('//')
-                clientStart = line.find('//', depotStart + 2)
-                fileinfo['depotFile'] = line[depotStart:clientStart - 1]
-                if sys.platform.startswith('win'):
-                    assert ':' not in fileinfo['depotFile'],\
-                           "Current parsing cannot handle this line '%s'." %\
-                           line
-                    localStart = line.find(':', clientStart + 2) - 1
-                else:
-                    assert fileinfo['depotFile'].find(' /') == -1,\
-                        "Current parsing cannot handle this line '%s'." % line
-                    localStart = line.find(' /', clientStart + 2) + 1
-                fileinfo['clientFile'] = line[clientStart:localStart - 1]
-                fileinfo['localFile'] = line[localStart:]
-                results.append(fileinfo)
-            return results
-
         argv = ['where']
         if files:
             argv += _normalizeFiles(files)
+        record = self._record(WhereEntry)
 
         return self._run_and_process(argv,
-                                     where_result_cb,
+                                     lambda output: _where_result_cb(
+                                         output, record),
                                      raw=_raw,
+                                     process_nodes=lambda nodes: list(
+                                         _where_parse_nodes(nodes, record)),
                                      **p4options)
 
     def have(self, files=[], _raw=0, **p4options):
@@ -846,26 +3105,37 @@ class P4:
         with the unprocessed results of calling p4:
             {'stdout': <stdout>, 'stderr': <stderr>, 'retval': <retval>}
         """
-        def have_result_cb(output):
-            # Output format is 'depot-file#revision - client-file'
-            haveRe = re.compile('(?P<depotFile>.+)#(?P<rev>\d+)'
-                                ' - (?P<localFile>.+)')
+        argv = ['have']
+        record = self._record(HaveEntry)
+        if self.useMarshal and not _raw:
+            return self._batch_run_nodes(argv, _normalizeFiles(files),
+                                         lambda nodes: _have_parse_nodes(
+                                             nodes, record),
+                                         p4options)
 
-            all_matches = (_match_or_raise(haveRe, _rstriponce(l), "have")
-                           for l in output.splitlines(True))
-            hits = [_values_to_int(match.groupdict(), ['rev'])
-                    for match in all_matches]
+        results = self._batch_run(argv, _normalizeFiles(files), p4options)
 
-            return hits
+        if _raw:
+            return results
 
-        argv = ['have']
-        if files:
-            argv += _normalizeFiles(files)
+        return self._parse(argv, _have_result_cb, results["stdout"], record)
 
-        return self._run_and_process(argv,
-                                     have_result_cb,
-                                     raw=_raw,
-                                     **p4options)
+    def iter_have(self, files=[], **p4options):
+        """Generate the file revisions last synced as p4 lists them.
+
+        Takes the same arguments as .have() and generates the same
+        dicts, each one as soon as it has been read. Unlike .have(), the
+        memory use does not depend on the number of files.
+        """
+        lines = self._batch_stream(['have'], _normalizeFiles(files),
+                                   p4options, self.useMarshal)
+        record = self._record(HaveEntry)
+
+        if self.useMarshal:
+            return _process_stream(lines, lambda nodes: _have_parse_nodes(
+                nodes, record))
+        return _process_stream(lines, lambda lines: _have_parse_lines(
+            lines, record))
 
     def describe(self, change, diffFormat='', shortForm=False, _raw=False,
                  **p4options):
@@ -883,68 +3153,75 @@ class P4:
         'change', 'date', 'client', 'user', 'description', 'files', 'diff'
         (the latter is not included iff 'shortForm').
 
+        With a 'describeCache', the descriptions of submitted changes are
+        taken from the cache or added to it.
+
         If '_raw' is true then the return value is simply a dictionary
         with the unprocessed results of calling p4:
             {'stdout': <stdout>, 'stderr': <stderr>, 'retval': <retval>}
         """
-        def describe_result_cb(output):
-            desc = {}
-            lines = output.splitlines(True)
-
-            changeRe = re.compile('^Change (?P<change>\d+) by (?P<user>[^\s@]+)@'
-                                  '(?P<client>[^\s@]+) on (?P<date>[\d/ :]+)$')
-
-            desc = changeRe.match(lines[0]).groupdict()
-            desc['change'] = int(desc['change'])
-
-            filesIdx = lines.index("Affected files ...\n")
+        if diffFormat not in ('', 'n', 'c', 's', 'u'):
+            raise P4LibError("Incorrect diff format flag: '%s'" % diffFormat)
 
-            desc['description'] = ""
-            for line in lines[2:filesIdx - 1]:
-                desc['description'] += line[1:].strip()  # drop the leading \t
+        optv = _argumentGenerator({'-d%s': diffFormat, '-s': shortForm})
+        argv = ['describe'] + optv + [str(change)]
 
-            if shortForm:
-                diffsIdx = len(lines)
-                moveIdx = -1
-            else:
-                try:
-                    moveIdx = lines.index("Moved files ...\n")
-                except ValueError:
-                    moveIdx = -1
-                diffsIdx = lines.index("Differences ...\n")
+        cacheKey = None
+        if self.describeCache is not None and not _raw:
+            cacheKey = (self._port(p4options), str(change), diffFormat,
+                        shortForm)
+            desc = self.describeCache.get(*cacheKey)
+            if desc is not None:
+                return desc
+
+        def store(desc, pending):
+            if cacheKey is not None and not pending:
+                self.describeCache.put(*(cacheKey + (desc,)))
+            return desc
 
-            stopFilesIdx = diffsIdx - 1
+        def process_output(output):
+            return store(_describe_result_cb(output, shortForm),
+                         _isPendingDescription(output))
 
-            if moveIdx != -1:
-                # ... //depot/file1.cpp#1 moved from ... //depot/file2.cpp#1
-                moveRe = re.compile('^... (?P<destDepotFile>.+?)#(?P<destRev>\d+) '
-                                    'moved from (?P<sourceDepotFile>.+?)#(?P<sourceRev>\d+)$')
-                all_matches = (_match_or_raise(moveRe, l, "describe")
-                               for l in lines[filesIdx + 2:moveIdx - 1])
-                stopFilesIdx = moveIdx - 1
+        def process_nodes(nodes):
+            node = next(nodes)
+            return store(_describe_parse_node(node),
+                         node.get('status') == 'pending')
 
-            fileRe = re.compile('^... (?P<depotFile>.+?)#(?P<rev>\d+) '
-                                '(?P<action>\w+(/\w+)?)$')
+        return self._run_and_process(argv,
+                                     process_output,
+                                     raw=_raw,
+                                     process_nodes=(process_nodes if shortForm
+                                                    else None),
+                                     **p4options)
 
-            all_matches = (_match_or_raise(fileRe, l, "describe")
-                           for l in lines[filesIdx + 2:stopFilesIdx])
-            desc['files'] = [_values_to_int(match.groupdict(), ['rev'])
-                             for match in all_matches]
+    def iter_describe_diff(self, change, diffFormat='', hunks=False,
+                           **p4options):
+        """Generate the file diffs of the given changelist as p4 writes
+        them.
 
-            if not shortForm:
-                desc['diff'] = _parseDiffOutput(lines[diffsIdx + 2:])
-            return desc
+        "change" is the changelist number to describe.
+        "diffFormat" and "hunks" are as for .describe() and .diff().
 
+        Generates the dicts of the 'diff' key of .describe(), each one as
+        soon as its diff has been read, so that describing a huge change
+        only holds one file diff at a time. Nothing is generated for a
+        pending change. The 'describeCache' is not used.
+        """
         if diffFormat not in ('', 'n', 'c', 's', 'u'):
             raise P4LibError("Incorrect diff format flag: '%s'" % diffFormat)
 
-        optv = _argumentGenerator({'-d%s': diffFormat, '-s': shortForm})
+        optv = _argumentGenerator({'-d%s': diffFormat})
         argv = ['describe'] + optv + [str(change)]
 
-        return self._run_and_process(argv,
-                                     describe_result_cb,
-                                     raw=_raw,
-                                     **p4options)
+        def diff_lines(lines):
+            for line in lines:
+                if line == "Differences ...\n":
+                    break
+            return _diff_parse_lines(lines, hunks)
+
+        lines = self._p4stream(argv, **p4options)
+        return _process_stream(lines, diff_lines)
 
     def change(self, files=None, description=None, change=None, delete=0,
                _raw=0, **p4options):
@@ -1093,6 +3370,46 @@ class P4:
 
         raise P4LibError("Incomplete/missing arguments.")
 
+    def change_status(self, change, **p4options):
+        """Return the status of the given changelist.
+
+        "change" is a changelist number, or 'default'.
+
+        Returns 'pending' or 'submitted' ('pending' for the default
+        changelist), or None if there is no such changelist. Only that
+        changelist is queried, with 'p4 change -o', where .changes()
+        would list all of them. Submitted changelists cannot change
+        anymore, so they are remembered by this instance and only
+        queried once.
+        """
+        if str(change).lower() == 'default':
+            return 'pending'
+        try:
+            change = int(change)
+        except ValueError:
+            raise P4LibError("Invalid changelist number: '%s'" % change)
+
+        key = (self._port(p4options), change)
+        if key in self._submittedChanges:
+            return 'submitted'
+
+        argv = ['change', '-o', str(change)]
+        try:
+            status = self._run_and_process(
+                argv,
+                lambda output: parseForm(output).get('status'),
+                raw=False,
+                process_nodes=lambda nodes: next(nodes).get('Status'),
+                **p4options)
+        except P4LibError as ex:
+            if 'Change %d unknown.' % change in str(ex):
+                return None
+            raise
+
+        if status == 'submitted':
+            self._submittedChanges.add(key)
+        return status
+
     def changes(self, files=[], followIntegrations=False, longOutput=False,
                 maximum=None, status=None, _raw=False, **p4options):
         """Return a list of pending and submitted changelists.
@@ -1115,58 +3432,112 @@ class P4:
         with the unprocessed results of calling p4:
             {'stdout': <stdout>, 'stderr': <stderr>, 'retval': <retval>}
         """
-        def changes_parse_cb(output):
-            changes = []
-            if longOutput:
-                changeRe = re.compile("^Change (?P<change>\d+) on "
-                                      "(?P<date>[\d/]+) by (?P<user>[^\s@]+)@"
-                                      "(?P<client>[^\s@]+)$")
-
-                for line in output.splitlines(True):
-                    if not line.strip():
-                        continue  # skip blank lines
-                    if line.startswith('\t'):
-                        # Append this line (minus leading tab) to last
-                        # change's description.
-                        changes[-1]['description'] += line[1:]
-                    else:
-                        change = changeRe.match(line).groupdict()
-                        change = _values_to_int(change, ['change'])
-                        change['description'] = ''
-                        changes.append(change)
-            else:
-                changeRe = re.compile("^Change (?P<change>\d+) on "
-                                      "(?P<date>[\d/]+) by (?P<user>[^\s@]+)@"
-                                      "(?P<client>[^\s@]+) (\*pending\* )?"
-                                      "'(?P<description>.*?)'?$")
-
-                all_matches = (_match_or_raise(changeRe, l, "changes")
-                               for l in output.splitlines(True))
-                changes = [_values_to_int(match.groupdict(), ['change'])
-                           for match in all_matches]
-
-            return changes
-
-        if maximum is not None and not isinstance(maximum, int):
-            raise P4LibError("Incorrect 'maximum' value. It must be an integer: "
-                             "'%s' (type '%s')" % (maximum, type(maximum)))
-        if status is not None and status not in ("pending", "submitted"):
-            raise P4LibError("Incorrect 'status' value: '%s'" % status)
-
-        optv = _argumentGenerator({'-i': followIntegrations,
-                                   '-l': longOutput,
-                                   '-m': maximum,
-                                   '-s': status})
-
-        argv = ['changes'] + optv
-        if files:
-            argv += _normalizeFiles(files)
+        argv = _changes_argv(files, followIntegrations, longOutput,
+                             maximum, status)
+        record = self._record(ChangeSummary)
 
         return self._run_and_process(argv,
-                                     changes_parse_cb,
+                                     lambda output: _changes_parse_cb(
+                                         output, longOutput, record),
                                      raw=_raw,
+                                     process_nodes=lambda nodes: list(
+                                         _changes_parse_nodes(nodes,
+                                                              longOutput,
+                                                              record)),
                                      **p4options)
 
+    def iter_changes(self, files=[], followIntegrations=False,
+                     longOutput=False, maximum=None, status=None,
+                     pageSize=None, prefetch=False, **p4options):
+        """Generate pending and submitted changelists as p4 lists them.
+
+        Takes the same arguments as .changes() and generates the same
+        dicts, each one as soon as it has been read.
+
+        "pageSize" specifies to list the changes by pages of that many
+            changes, each one with a 'p4 changes -m <pageSize>' of the
+            changes before the last one of the previous page (given to
+            p4 as '<file>@<change - 1>'), so that only one page is in
+            memory at a time and scanning the recent history does not
+            read the whole of it. Paging only lists submitted changes,
+            the files must not have revisions, and the files default to
+            '//...'.
+        "prefetch" specifies to fetch the next page on a background
+            thread while the changes of the current one are generated.
+        """
+        if pageSize is not None:
+            return self._iter_changes_pages(files, followIntegrations,
+                                            longOutput, maximum, status,
+                                            pageSize, prefetch, p4options)
+        argv = _changes_argv(files, followIntegrations, longOutput,
+                             maximum, status)
+
+        lines = self._p4stream(argv, self.useMarshal, **p4options)
+        record = self._record(ChangeSummary)
+
+        if self.useMarshal:
+            return _process_stream(lines, lambda nodes: _changes_parse_nodes(
+                nodes, longOutput, record))
+        return _process_stream(lines, lambda lines: _changes_parse_lines(
+            lines, longOutput, record))
+
+    def _iter_changes_pages(self, files, followIntegrations, longOutput,
+                            maximum, status, pageSize, prefetch, p4options):
+        """Return the generator of iter_changes() with "pageSize"."""
+        # The arguments are checked on the call, as the other iter_*()
+        # do, not on the first change.
+        _changes_argv(files, followIntegrations, longOutput, maximum, status)
+        if not isinstance(pageSize, int) or pageSize < 1:
+            raise P4LibError("Incorrect 'pageSize' value. It must be a "
+                             "positive integer: '%s'" % pageSize)
+        if status == 'pending':
+            raise P4LibError("Pending changes cannot be listed by pages.")
+        files = _normalizeFiles(files) or ['//...']
+        for f in files:
+            if _filenameAndRevRangeTuple(f)[1] or '#' in f:
+                raise P4LibError("Files listed by pages cannot have "
+                                 "revisions: '%s'" % f)
+
+        def page(before, count):
+            specs = files
+            if before is not None:
+                specs = ['%s@%d' % (f, before - 1) for f in files]
+            return self.changes(specs, followIntegrations, longOutput,
+                                count, 'submitted', **p4options)
+
+        def pages():
+            remaining = maximum
+            count = pageSize if remaining is None else min(pageSize,
+                                                           remaining)
+            pool = ThreadPool(1) if prefetch else None
+            try:
+                changes = page(None, count)
+                while changes:
+                    last = changes[-1]['change']
+                    if remaining is not None:
+                        remaining -= len(changes)
+                    more = len(changes) == count and last > 1 \
+                        and remaining != 0
+                    nextPage = None
+                    if more:
+                        if remaining is not None:
+                            count = min(pageSize, remaining)
+                        if pool is not None:
+                            nextPage = pool.apply_async(page, (last, count))
+                    for change in changes:
+                        yield change
+                    if not more:
+                        break
+                    elif nextPage is not None:
+                        changes = nextPage.get()
+                    else:
+                        changes = page(last, count)
+            finally:
+                if pool is not None:
+                    pool.terminate()
+
+        return pages()
+
     def sync(self, files=[], force=False, dryrun=False, _raw=0, **p4options):
         """Synchronize the client with its view of the depot.
         
@@ -1187,35 +3558,34 @@ class P4:
         optv = _argumentGenerator({'-f': force, '-n': dryrun})
 
         argv = ['sync'] + optv
+        if self.useMarshal and not _raw:
+            return self._batch_run_nodes(argv, _normalizeFiles(files),
+                                         _sync_parse_nodes, p4options)
+
         results = self._batch_run(argv, _normalizeFiles(files), p4options)
 
         if _raw:
             return results
 
-        # Forms of output:
-        #    //depot/foo#1 - updating C:\foo
-        #    //depot/foo#1 - is opened and not being changed
-        #    //depot/foo#1 - is opened at a later revision - not changed
-        #    //depot/foo#1 - deleted as C:\foo
-        #    ... //depot/foo - must resolve #2 before submitting
-        # There are probably others forms.
-        hits = []
-        lineRe = re.compile('^(?P<depotFile>.+?)#(?P<rev>\d+) - '
-                            '(?P<comment>.+?)$')
+        return self._parse(argv, _sync_parse_cb, results["stdout"])
 
-        for line in results["stdout"].splitlines(True):
-            if line.startswith('... '):
-                note = line.split(' - ')[-1].strip()
-                hits[-1]['notes'].append(note)
-            else:
-                match = _match_or_raise(lineRe, line, "sync")
-                if match:
-                    hit = match.groupdict()
-                    hit = _values_to_int(hit, ['rev'])
-                    hit['notes'] = []
-                    hits.append(hit)
+    def iter_sync(self, files=[], force=False, dryrun=False, **p4options):
+        """Synchronize the client with its view of the depot, generating
+        the sync'd files as p4 reports them.
 
-        return hits
+        Takes the same arguments as .sync() and generates the same
+        dicts, each one as soon as its notes have been read. Closing
+        the generator early interrupts the sync.
+        """
+        optv = _argumentGenerator({'-f': force, '-n': dryrun})
+
+        argv = ['sync'] + optv
+        lines = self._batch_stream(argv, _normalizeFiles(files), p4options,
+                                   self.useMarshal)
+
+        if self.useMarshal:
+            return _process_stream(lines, _sync_parse_nodes)
+        return _process_stream(lines, _sync_parse_lines)
 
     def edit(self, files, change=None, filetype=None, _raw=0, **p4options):
         """Open an existing file for edit.
@@ -1353,28 +3723,39 @@ class P4:
         with the unprocessed results of calling p4:
             {'stdout': <stdout>, 'stderr': <stderr>, 'retval': <retval>}
         """
-        def files_parse_cb(output):
-            fileRe = re.compile("^(?P<depotFile>//.*?)#(?P<rev>\d+) - "
-                                "(?P<action>[\w/]+) change (?P<change>\d+) "
-                                "\((?P<type>[\w+]+)\)$")
-
-            all_matches = (_match_or_raise(fileRe, l.strip(), "files")
-                           for l in output.splitlines(True))
-            hits = [_values_to_int(match.groupdict(), ['rev', 'change'])
-                    for match in all_matches]
-
-            return hits
-
         if not files:
             raise P4LibError("Missing/wrong number of arguments.")
 
         argv = ['files'] + _normalizeFiles(files)
+        record = self._record(FileRev)
 
         return self._run_and_process(argv,
-                                     files_parse_cb,
+                                     lambda output: _files_parse_cb(
+                                         output, record),
                                      raw=_raw,
+                                     process_nodes=lambda nodes: list(
+                                         _files_parse_nodes(nodes, record)),
                                      **p4options)
 
+    def iter_files(self, files, **p4options):
+        """Generate the files in the depot as p4 lists them.
+
+        Takes the same arguments as .files() and generates the same
+        dicts, each one as soon as it has been read.
+        """
+        if not files:
+            raise P4LibError("Missing/wrong number of arguments.")
+
+        argv = ['files'] + _normalizeFiles(files)
+        lines = self._p4stream(argv, self.useMarshal, **p4options)
+        record = self._record(FileRev)
+
+        if self.useMarshal:
+            return _process_stream(lines, lambda nodes: _files_parse_nodes(
+                nodes, record))
+        return _process_stream(lines, lambda lines: _files_parse_lines(
+            lines, record))
+
     def filelog(self, files, followIntegrations=False, longOutput=False, maxRevs=None,
                 _raw=0, **p4options):
         """List revision histories of files.
@@ -1395,118 +3776,152 @@ class P4:
         with the unprocessed results of calling p4:
             {'stdout': <stdout>, 'stderr': <stderr>, 'retval': <retval>}
         """
-        def filelog_parse_cb(output):
-            hits = []
-            revRe = re.compile("^... #(?P<rev>\d+) change (?P<change>\d+) "
-                               "(?P<action>\w+) on (?P<date>[\d/]+) by "
-                               "(?P<user>[^\s@]+)@(?P<client>[^\s@]+) "
-                               "\((?P<type>[\w+]+)\)( '(?P<description>.*?)')?$")
-            for line in output.splitlines(True):
-                if longOutput and not line.strip():
-                    continue  # skip blank lines
-                elif line.startswith('//'):
-                    hit = {'depotFile': line.strip(), 'revs': []}
-                    hits.append(hit)
-                elif line.startswith('... ... '):
-                    hits[-1]['revs'][-1]['notes'].append(line[8:].strip())
-                elif line.startswith('... '):
-                    match = _match_or_raise(revRe, line, "filelog/Internal")
-                    d = match.groupdict('')
-                    d = _values_to_int(d, ['change', 'rev'])
-                    hits[-1]['revs'].append(d)
-                    hits[-1]['revs'][-1]['notes'] = []
-                elif longOutput and line.startswith('\t'):
-                    # Append this line (minus leading tab) to last hit's
-                    # last rev's description.
-                    hits[-1]['revs'][-1]['description'] += line[1:]
-                else:
-                    raise P4LibError("Unexpected 'p4 filelog' output: '%s'"
-                                     % line)
-            return hits
-
-        if maxRevs is not None and not isinstance(maxRevs, int):
-            raise P4LibError("Incorrect 'maxRevs' value. It must be an "
-                             "integer: '%s' (type '%s')"
-                             % (maxRevs, type(maxRevs)))
-        if not files:
-            raise P4LibError("Missing/wrong number of arguments.")
-
-        optv = _argumentGenerator({'-i': followIntegrations,
-                                   '-l': longOutput,
-                                   '-m': maxRevs})
-        argv = ['filelog'] + optv + _normalizeFiles(files)
+        argv = _filelog_argv(files, followIntegrations, longOutput, maxRevs)
+        record = self._record(FilelogRev)
 
         return self._run_and_process(argv,
-                                     filelog_parse_cb,
+                                     lambda output: _filelog_parse_cb(
+                                         output, longOutput, record),
                                      raw=_raw,
+                                     process_nodes=lambda nodes: list(
+                                         _filelog_parse_nodes(nodes,
+                                                              longOutput,
+                                                              record)),
                                      **p4options)
 
-    def print_(self, files, localFile=None, quiet=False, **p4options):
+    def iter_filelog(self, files, followIntegrations=False,
+                     longOutput=False, maxRevs=None, **p4options):
+        """Generate revision histories of files as p4 lists them.
+
+        Takes the same arguments as .filelog() and generates the same
+        hits, each one as soon as all the revisions of its file have
+        been read.
+        """
+        argv = _filelog_argv(files, followIntegrations, longOutput, maxRevs)
+
+        lines = self._p4stream(argv, self.useMarshal, **p4options)
+        record = self._record(FilelogRev)
+
+        if self.useMarshal:
+            return _process_stream(lines, lambda nodes: _filelog_parse_nodes(
+                nodes, longOutput, record))
+        return _process_stream(lines, lambda lines: _filelog_parse_lines(
+            lines, longOutput, record))
+
+    def print_(self, files, localFile=None, quiet=False, output=None,
+               binary=False, **p4options):
         """Retrieve depot file contents.
         
         "files" is a list of files or file wildcards to print.
         "localFile" (-o) is the name of a local file in which to put the
             output text.
         "quiet" (-q) suppresses some file meta-information.
+        "output" is where to write the content of the files as p4 sends
+            it, without keeping it in memory: either a path or a binary
+            file object receiving the content of all the files, or a
+            callable taking each hit (without its 'text') and returning a
+            path or a binary file object for it, or None to skip it.
+            The content of binary files is written too.
+        "binary" specifies to return the content of the files as bytes,
+            binary files included.
 
         Returns a list of dicts, each representing one matching file.
         Keys are: 'depotFile', 'rev', 'type', 'change', 'action',
         and 'text'. If 'quiet', the first five keys will not be present.
-        The 'text' key will not be present if the file is binary. If
-        both 'quiet' and 'localFile', there will be no hits at all.
+        The 'text' key will not be present if the file is binary (unless
+        "binary") or if "output" is given. If both 'quiet' and
+        'localFile', there will be no hits at all.
+
+        With a 'printCache', the results of files given at a revision
+        ('//depot/foo.c#3') are taken from the cache or added to it,
+        provided that no 'localFile', "output" or "binary" is given, that
+        all the files are given this way and that the server is known
+        (from the 'port' option or $P4PORT): the server of a P4CONFIG
+        file or the default one of p4 could be any.
         """
         if not files:
             raise P4LibError("Missing/wrong number of arguments.")
 
+        if self.printCache is not None and not localFile \
+           and output is None and not binary and self._port(p4options):
+            specs = _normalizeFiles(files)
+            if all(_pinnedFileSpec(spec) for spec in specs):
+                hits = self._cached_print(specs, p4options)
+                if quiet:
+                    hits = [{'text': hit['text']} for hit in hits
+                            if 'text' in hit]
+                return hits
+
         optv = _argumentGenerator({'-o': localFile, '-q': quiet})
 
         # There is *no* way to properly and reliably parse out multiple file
         # output without using -s or -G. Use the latter.
-        if p4options:
-            d = self.optd
-            d.update(p4options)
-            p4optv = makeOptv(**d)
-        else:
-            p4optv = self._optv
-
-        argv = [self.p4, '-G'] + p4optv + ['print'] + \
-            optv + _normalizeFiles(files)
+        argv = ['print'] + optv + _normalizeFiles(files)
+        if output is not None:
+            # Stream the dicts so that only one chunk is held at a time.
+            nodes = self._p4stream(argv, marshalled=True, **p4options)
+            try:
+                return _print_parse_nodes(nodes, binary, output)
+            finally:
+                nodes.close()
+
+        stdout, error, retval = self._p4run(argv, marshalled=True,
+                                            **p4options)
+
+        return self._parse(argv, _print_parse_nodes,
+                           _marshalOutputNodes(stdout), binary)
+
+    def _cached_print(self, specs, p4options):
+        """Return the print_() results of the pinned file specifications
+        'specs', running 'p4 print' only for the ones not in the print
+        cache."""
+        port = self._port(p4options)
+        hits = [self.printCache.get(port, spec) for spec in specs]
+        missing = [spec for spec, hit in zip(specs, hits) if hit is None]
+        if not missing:
+            return hits
 
-        cmd = _joinArgv(argv)
-        log.debug("popen3 '%s'..." % cmd)
-        i, o, e = os.popen3(cmd)
-        hits = []
-        fileRe = re.compile("^(?P<depotFile>//.*?)#(?P<rev>\d+) - "
-                            "(?P<action>\w+) change (?P<change>\d+) "
-                            "\((?P<type>[\w+]+)\)$")
-        try:
-            startHitWithNextNode = 1
-            while 1:
-                node = marshal.load(o)
-                if node['code'] == 'info':
-                    # Always start a new hit with an 'info' node.
-                    match = fileRe.match(node['data'])
-                    hit = match.groupdict()
-                    hit = _values_to_int(hit, ['change', 'rev'])
-                    hits.append(hit)
-                    startHitWithNextNode = 0
-                elif node['code'] == 'text':
-                    if startHitWithNextNode:
-                        hit = {'text': node['data']}
-                        hits.append(hit)
-                    else:
-                        if 'text' not in hits[-1] \
-                           or hits[-1]['text'] is None:
-                            hits[-1]['text'] = node['data']
-                        else:
-                            hits[-1]['text'] += node['data']
-                    startHitWithNextNode = not node['data']
-        except EOFError:
-            pass
-        return hits
+        output, error, retval = self._p4run(['print'] + missing,
+                                            marshalled=True, **p4options)
+        printed = self._parse(['print'], _print_parse_nodes,
+                              _marshalOutputNodes(output))
+
+        # p4 prints the files in the order of the specifications, without
+        # the revisions which do not exist, and may name them differently
+        # (e.g. in another case on a case-insensitive server). A hit is
+        # cached under the specification with its path and revision, and
+        # the other hits are returned in place of the specifications left
+        # without one, as p4 would give them.
+        keys = [(hit.get('depotFile'), hit.get('rev')) for hit in printed]
+        matches = {}
+        i = 0
+        for spec in missing:
+            key = _pinnedFileSpec(spec)
+            for j in range(i, len(printed)):
+                if keys[j] == key:
+                    matches[spec] = j
+                    i = j + 1
+                    break
+        matched = set(matches.values())
+
+        results = []
+        i = 0
+        for spec, hit in zip(specs, hits):
+            if hit is not None:
+                results.append(hit)
+            elif spec in matches:
+                j = matches[spec]
+                self.printCache.put(port, spec, printed[j])
+                results.extend(printed[i:j + 1])
+                i = j + 1
+            elif i < len(printed) and i not in matched:
+                results.append(printed[i])
+                i += 1
+        results.extend(printed[i:])
+        return results
 
     def diff(self, files=[], diffFormat='', force=False, satisfying=None,
-             text=False, _raw=0, **p4options):
+             text=False, hunks=False, _raw=0, **p4options):
         """Display diff of client files with depot files.
         
         "files" is a list of files or file wildcards to diff.
@@ -1525,6 +3940,10 @@ class P4:
                'r'     Opened files that are the same as the revision in
                        the depot.
         "text" (-t) forces diffs of non-text files.
+        "hunks" specifies to add a 'hunks' key to each dict: the list of
+            the hunks of the diff, each one a dict with 'oldStart',
+            'oldLines', 'newStart', 'newLines', 'added' and 'removed'
+            keys.
 
         Returns a list of dicts representing each file diff'd. If
         "satifying" is specified each dict will simply include a
@@ -1556,14 +3975,35 @@ class P4:
             diff_parse_cb = lambda output: \
                 [{'localFile': line[:-1]} for line in output.splitlines(True)]
         else:
-            diff_parse_cb = _parseDiffOutput
+            diff_parse_cb = lambda output: _parseDiffOutput(output, hunks)
 
         return self._run_and_process(argv,
                                      diff_parse_cb,
                                      raw=_raw,
                                      **p4options)
 
-    def diff2(self, file1, file2, diffFormat='', quiet=True, text=0,
+    def iter_diff(self, files=[], diffFormat='', force=False, text=False,
+                  hunks=False, **p4options):
+        """Generate the diffs of client files with depot files as p4
+        writes them.
+
+        Takes the same arguments as .diff() (except "satisfying") and
+        generates the same dicts, each one as soon as its diff has been
+        read, so that large diffs are parsed in bounded memory.
+        """
+        if diffFormat not in ('', 'n', 'c', 's', 'u'):
+            raise P4LibError("Incorrect diff format flag: '%s'" % diffFormat)
+
+        optv = _argumentGenerator({'-d%s': diffFormat,
+                                   '-f': force,
+                                   '-t': text})
+        argv = ['diff'] + optv + _normalizeFiles(files)
+
+        lines = self._p4stream(argv, **p4options)
+        return _process_stream(lines,
+                               lambda lines: _diff_parse_lines(lines, hunks))
+
+    def diff2(self, file1, file2, diffFormat='', quiet=True, text=False,
               **p4options):
         """Compare two depot files.
         
@@ -1574,6 +4014,7 @@ class P4:
             'u' (unified).
         "quiet" (-q) suppresses some meta information and all
             information if the files do not differ.
+        "text" (-t) forces the diff of non-text files.
 
         Returns a dict representing the diff. Keys are: 'depotFile1',
         'rev1', 'type1', 'depotFile2', 'rev2', 'type2',
@@ -1593,44 +4034,220 @@ class P4:
 
         # There is *no* way to properly and reliably parse out multiple
         # file output without using -s or -G. Use the latter.
-        if p4options:
-            d = self.optd
-            d.update(p4options)
-            p4optv = makeOptv(**d)
-        else:
-            p4optv = self._optv
-        argv = [self.p4, '-G'] + p4optv + ['diff2'] + optv + [file1, file2]
-        cmd = _joinArgv(argv)
-        i, o, e = os.popen3(cmd)
-        diff = {}
-        infoRe = re.compile("^==== (?P<depotFile1>.+?)#(?P<rev1>\d+) "
-                            "\((?P<type1>[\w+]+)\) - "
-                            "(?P<depotFile2>.+?)#(?P<rev2>\d+) "
-                            "\((?P<type2>[\w+]+)\) "
-                            "==== (?P<summary>\w+)$")
+        argv = ['diff2'] + optv + [file1, file2]
+        output, error, retval = self._p4run(argv, marshalled=True,
+                                            **p4options)
+
+        return self._parse(argv, _diff2_parse_nodes,
+                           _marshalOutputNodes(output))
+
+    def diff2_many(self, pairs, diffFormat='', quiet=True, text=False,
+                   maxWorkers=None, **p4options):
+        """Compare many pairs of depot files.
+
+        "pairs" is a list of (file1, file2) tuples to diff.
+        "diffFormat", "quiet" and "text" are as for .diff2().
+        "maxWorkers" is the number of 'p4 diff2' processes that may run
+            at the same time. Defaults to the 'maxWorkers' of this
+            instance.
+
+        Returns the list of the .diff2() dicts of the pairs, in the
+        order of "pairs".
+        """
+        if diffFormat not in ('', 'n', 'c', 's', 'u'):
+            raise P4LibError("Incorrect diff format flag: '%s'" % diffFormat)
+        if maxWorkers is None:
+            maxWorkers = self.maxWorkers
+        if not isinstance(maxWorkers, int) or maxWorkers < 1:
+            raise P4LibError("Incorrect 'maxWorkers' value. It must be a "
+                             "positive integer: '%s'" % maxWorkers)
+
+        diff_pair = lambda pair: self.diff2(pair[0], pair[1], diffFormat,
+                                            quiet, text, **p4options)
+        pairs = list(pairs)
+        if maxWorkers > 1 and len(pairs) > 1:
+            pool = ThreadPool(min(maxWorkers, len(pairs)))
+            try:
+                return pool.map(diff_pair, pairs)
+            finally:
+                pool.close()
+                pool.join()
+        return [diff_pair(pair) for pair in pairs]
+
+    def annotate(self, files, changeNumbers=False, followIntegrations=False,
+                 allLines=False, _raw=False, **p4options):
+        """Get the revision each line of files comes from.
+
+        "files" is a list of files or file wildcards to annotate.
+        "changeNumbers" (-c) gives the change numbers of the lines
+            instead of their revisions.
+        "followIntegrations" (-i) follows the branches the files come
+            from.
+        "allLines" (-a) includes the lines which are no longer in the
+            files.
+
+        Returns a list of dicts, one per file. Keys are: 'depotFile',
+        'rev', 'change', 'action', 'type' and 'lines': a list of
+        (<lower>, <upper>, <text>) tuples, one per line. With "allLines"
+        <lower> is the revision (or change) adding the line and <upper>
+        the last one including it. Otherwise both are the revision (or
+        change) adding the line.
+
+        Servers without 'p4 annotate' are handled by replaying the diffs
+        between the revisions of each file (with "changeNumbers" only).
+
+        With an 'annotateCache', the results of file revisions are taken
+        from the cache or added to it (without "followIntegrations" and
+        "allLines"). A revision whose previous one is cached only takes
+        the 'p4 diff2' between both.
+
+        If '_raw' is true then the return value is simply a dictionary
+        with the unprocessed results of calling p4:
+            {'stdout': <stdout>, 'stderr': <stderr>, 'retval': <retval>}
+        """
+        if not files:
+            raise P4LibError("Missing/wrong number of arguments.")
+
+        if self.annotateCache is not None and not _raw \
+           and not followIntegrations and not allLines:
+            return [self._cached_annotate(hit, changeNumbers, p4options)
+                    for hit in self.files(files, **p4options)
+                    if 'delete' not in hit['action']]
+
+        return self._annotate_files(files, changeNumbers, followIntegrations,
+                                    allLines, _raw, p4options)
+
+    def _annotate_files(self, files, changeNumbers, followIntegrations,
+                        allLines, _raw, p4options):
+        """Return the annotate() results of 'files', without the
+        'annotateCache'."""
+        optv = _argumentGenerator({'-a': allLines,
+                                   '-c': changeNumbers,
+                                   '-i': followIntegrations})
+        argv = ['annotate'] + optv + _normalizeFiles(files)
+
         try:
-            while 1:
-                node = marshal.load(o)
-                if node['code'] == 'info'\
-                   and node['data'] == '(... files differ ...)':
-                    if 'notes' not in diff:
-                        diff['notes'].append(node['data'])
-                    else:
-                        diff['notes'] = [node['data']]
-                elif node['code'] == 'info':
-                    match = infoRe.match(node['data'])
-                    d = match.groupdict()
-                    d['rev1'] = int(d['rev1'])
-                    d['rev2'] = int(d['rev2'])
-                    diff.update(match.groupdict())
-                elif node['code'] == 'text':
-                    if 'text' not in diff or diff['text'] is None:
-                        diff['text'] = node['data']
-                    else:
-                        diff['text'] += node['data']
-        except EOFError:
-            pass
-        return diff
+            return self._run_and_process(argv,
+                                         _annotate_parse_cb,
+                                         raw=_raw,
+                                         process_nodes=_annotate_parse_nodes,
+                                         **p4options)
+        except P4LibError as ex:
+            if 'Unknown command' not in str(ex) or _raw:
+                raise
+        if followIntegrations or allLines:
+            raise P4LibError("The server has no 'annotate' command: "
+                             "'followIntegrations' and 'allLines' are not "
+                             "supported.")
+        return [self._annotate_locally(hit, changeNumbers, p4options)
+                for hit in self.files(files, **p4options)
+                if 'delete' not in hit['action']]
+
+    def _cached_annotate(self, hit, changeNumbers, p4options):
+        """Return the annotate() result of the file revision 'hit' (a
+        files() dict) from the 'annotateCache', adding it if needed."""
+        port = self._port(p4options)
+        depotFile, rev = hit['depotFile'], hit['rev']
+        spec = '%s#%d' % (depotFile, rev)
+        result = dict((key, hit[key]) for key in ('depotFile', 'rev',
+                                                  'action', 'change',
+                                                  'type'))
+
+        entry = self.annotateCache.get(port, depotFile, rev, changeNumbers)
+        if entry is None and rev > 1:
+            previous = self.annotateCache.get(port, depotFile, rev - 1,
+                                              changeNumbers)
+            if previous is not None:
+                # Not 'quiet': 'p4 diff2 -q' gives no diff text.
+                diff = self.diff2('%s#%d' % (depotFile, rev - 1), spec,
+                                  quiet=False, **p4options)
+                runs = previous['runs']
+                if 'text' in diff:
+                    runs = _annotateRuns(runs, _diffHunks(diff['text']),
+                                         changeNumbers and hit['change']
+                                         or rev)
+                entry = dict(result, runs=runs)
+                self.annotateCache.put(port, depotFile, rev, changeNumbers,
+                                       entry)
+
+        if entry is None:
+            annotated = self._annotate_files(spec, changeNumbers, False,
+                                             False, False, p4options)[0]
+            runs = []
+            for lower, upper, text in annotated['lines']:
+                if runs and runs[-1][1] == lower:
+                    runs[-1][0] += 1
+                else:
+                    runs.append([1, lower])
+            self.annotateCache.put(port, depotFile, rev, changeNumbers,
+                                   dict(result, runs=runs))
+            return annotated
+
+        lines = _splitLines(self.print_(spec, **p4options)[0].get('text',
+                                                                  ''))
+        if sum(count for count, origin in entry['runs']) != len(lines):
+            raise P4LibError("Cached annotation of '%s' does not match "
+                             "its content." % spec)
+        result['lines'] = []
+        index = 0
+        for count, origin in entry['runs']:
+            result['lines'].extend((origin, origin, text)
+                                   for text in lines[index:index + count])
+            index += count
+        return result
+
+    def _annotate_locally(self, hit, changeNumbers, p4options):
+        """Return the annotate() dict of the file revision 'hit' (a
+        files() dict) made from the diffs between its revisions.
+
+        The diffs are run from the revision adding the file (after its
+        last deletion) with diff2_many() and applied to runs of lines
+        (see _annotateRuns()).
+        """
+        depotFile = hit['depotFile']
+        spec = '%s#%d' % (depotFile, hit['rev'])
+        revs = self.filelog(spec, **p4options)[0]['revs']
+        revs.sort(key=lambda rev: rev['rev'])
+        start = 0
+        for i, rev in enumerate(revs):
+            if 'binary' in rev['type']:
+                raise P4LibError("Cannot annotate binary file '%s#%d'."
+                                 % (depotFile, rev['rev']))
+            if 'delete' in rev['action'] or rev['action'] == 'purge':
+                start = i + 1
+        revs = revs[start:]
+        origins = dict((rev['rev'], changeNumbers and rev['change']
+                        or rev['rev'])
+                       for rev in revs)
+
+        first = '%s#%d' % (depotFile, revs[0]['rev'])
+        printed = self.print_([first, spec] if first != spec else [spec],
+                              **p4options)
+        runs = [[len(_splitLines(printed[0].get('text', ''))),
+                 origins[revs[0]['rev']]]]
+        pairs = [('%s#%d' % (depotFile, a['rev']),
+                  '%s#%d' % (depotFile, b['rev']))
+                 for a, b in zip(revs, revs[1:])]
+        # Not 'quiet': 'p4 diff2 -q' gives no diff text.
+        diffs = self.diff2_many(pairs, quiet=False, **p4options)
+        for rev, diff in zip(revs[1:], diffs):
+            if 'text' in diff:
+                runs = _annotateRuns(runs, _diffHunks(diff['text']),
+                                     origins[rev['rev']])
+
+        lines = _splitLines(printed[-1].get('text', ''))
+        if sum(count for count, origin in runs) != len(lines):
+            raise P4LibError("Internal error applying the diffs of '%s'."
+                             % spec)
+        annotated = []
+        for count, origin in runs:
+            annotated.extend([origin] * count)
+        result = dict((key, hit[key]) for key in ('depotFile', 'rev',
+                                                  'action', 'change',
+                                                  'type'))
+        result['lines'] = [(origin, origin, text)
+                           for origin, text in zip(annotated, lines)]
+        return result
 
     def revert(self, files=[], change=None, unchangedOnly=False, _raw=0,
                **p4options):
@@ -2421,13 +5038,21 @@ class P4:
                                      raw=_raw,
                                      **p4options)
 
-    def fstat(self, files, _raw=0, **p4options):
+    def fstat(self, files, fields=None, filterExpression=None, _raw=0,
+              **p4options):
         """List files in the depot.
         
         "files" is a list of files or file wildcards to list. Defaults
             to the whole client view.
+        "fields" (-T) is a list of the names of the fields to return,
+            e.g. ['depotFile', 'headRev', 'haveRev']. The server only
+            sends these ones. Defaults to all the fields below.
+        "filterExpression" (-F) limits the results to the files
+            matching the given expression, e.g. 'haveRev ^action' for
+            the files synced but not opened. See 'p4 help fstat'.
 
-        Returns a dict containing the following keys:
+        Returns a list of dicts, one per file, containing the following
+        keys (or only the "fields" ones):
 
                 clientFile      -- local path (host or Perforce syntax)
                 depotFile       -- name in depot
@@ -2459,53 +5084,22 @@ class P4:
         results:
             {'stdout': <stdout>, 'stderr': <stderr>, 'retval': <retval>}
         """
-        _baseStat = {'clientFile': '',
-                     'depotFile': '',
-                     'path': '',
-                     'headAction': '',
-                     'headChange': 0,
-                     'headRev': 0,
-                     'headType': '',
-                     'headTime': 0,
-                     'haveRev': 0,
-                     'action': '',
-                     'actionOwner': '',
-                     'change': '',
-                     'unresolved': '',
-                     'ourLock': 0,
-                     }
-
-        def match_file_block(stat):
-            matches = fileRe.findall(stat)
-            if not matches:
-                return None
-
-            matches = dict(matches)
-
-            hit = copy.copy(_baseStat)
-            hit.update(matches)
-
-            if 'ourLock' in matches:
-                hit['ourLock'] = 1
-
-            int_keys = ('headChange', 'headRev', 'headTime', 'haveRev')
-            hit = _values_to_int(hit, int_keys)
-
-            return hit
-
         if not files:
             raise P4LibError("Missing/wrong number of arguments.")
 
-        argv = ['fstat', '-C', '-P'] + _normalizeFiles(files)
-        output, error, retval = self._p4run(argv, **p4options)
+        argv = _fstat_argv(fields, filterExpression)
+        record = self._record(FstatRecord)
+        if self.useMarshal and not _raw:
+            parse_nodes = lambda nodes: _fstat_parse_nodes(nodes, fields,
+                                                           record)
+            return self._batch_run_nodes(argv, _normalizeFiles(files),
+                                         parse_nodes, p4options)
 
-        parsed = ''.join(output)
-        parsed = re.split(r'(\r\n|\n){2}', parsed)
-        
-        fileRe = re.compile("...\s(.*?)\s(.*)")
-        
-        all_stats = (match_file_block(stat) for stat in parsed)
-        hits = [hit for hit in all_stats if hit]
+        results = self._batch_run(argv, _normalizeFiles(files), p4options)
+        output, error, retval = (results["stdout"], results["stderr"],
+                                 results["retval"])
+
+        hits = self._parse(argv, _fstat_parse_cb, output, fields, record)
 
         if _raw:
             return hits, {'stdout': ''.join(output),
@@ -2513,3 +5107,35 @@ class P4:
                           'retval': retval}
         else:
             return hits
+
+    def iter_fstat(self, files, fields=None, filterExpression=None,
+                   **p4options):
+        """Generate the fstat information of files as p4 writes it.
+
+        Takes the same arguments as .fstat() and generates the same
+        dicts, each one as soon as it has been read. With "fields", this
+        is the leanest way to check many files, e.g. for the out of date
+        ones:
+            for hit in p4.iter_fstat('//depot/...',
+                                     fields=['depotFile', 'headRev',
+                                             'haveRev'],
+                                     filterExpression='haveRev'):
+                if hit['haveRev'] != hit['headRev']:
+        """
+        if not files:
+            raise P4LibError("Missing/wrong number of arguments.")
+
+        argv = _fstat_argv(fields, filterExpression)
+        lines = self._batch_stream(argv, _normalizeFiles(files), p4options,
+                                   self.useMarshal)
+        record = self._record(FstatRecord)
+
+        if self.useMarshal:
+            return _process_stream(lines, lambda nodes:
+                                   _fstat_parse_nodes(nodes, fields, record))
+        if fields:
+            return _process_stream(lines, lambda lines:
+                                   _fstat_parse_field_lines(lines, fields,
+                                                            record))
+        return _process_stream(lines, lambda lines:
+                               _fstat_parse_lines(lines, record))
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# License: MIT License (http://www.opensource.org/licenses/mit-license.php)
+
+"""
+    An asyncio interface to 'p4' (the Perforce client command line app).
+
+    Usage:
+        import asyncio
+        import p4lib_async
+
+        async def main():
+            p4 = p4lib_async.AsyncP4(<p4options>, maxConcurrency=16)
+            changes, opened = await asyncio.gather(p4.changes(maximum=10),
+                                                   p4.opened())
+
+    AsyncP4 mirrors the p4lib.P4 API for the following commands, each one
+    being a coroutine: changes, describe, files, filelog, fstat, have,
+    opened, print (as print_), sync, where. The commands are run with
+    asyncio subprocesses, so one event loop can have many of them in
+    flight without a thread per command, and their output goes through
+    the same parsers as p4lib.P4.
+
+    This module requires Python 3.5 or later.
+"""
+
+import asyncio
+import locale
+import subprocess
+
+import p4lib
+from p4lib import P4LibError, makeOptv, _argumentGenerator, _normalizeFiles
+
+
+#---- internal support stuff
+
+def _decodeOutput(data):
+    # The same decoding as the universal newlines mode used by p4lib._run.
+    text = data.decode(locale.getpreferredencoding(False), 'replace')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+async def _run(argv, cwd=None, marshalled=False):
+    """Run the given arg vector, 'argv', in a subprocess and return the
+    results: (<stdout>, <stderr>, <return value>).
+
+    "cwd" is the working directory of the process. Defaults to the
+        current directory.
+    "marshalled" specifies to return stdout as bytes (for 'p4 -G').
+    """
+    p4lib.log.debug("Running '%s'..." % p4lib._joinArgv(argv))
+    proc = await asyncio.create_subprocess_exec(
+        *argv,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        env=p4lib._subprocess_environment(cwd))
+    output, error = await proc.communicate()
+
+    if not marshalled:
+        output = _decodeOutput(output)
+    error = _decodeOutput(error)
+    retval = proc.returncode
+
+    if retval:
+        raise P4LibError("Error running '%s': error='%s' retval='%s'"
+                         % (argv, error, retval))
+    return output, error, retval
+
+
+#---- public stuff
+
+class AsyncP4:
+    """An asyncio proxy to the Perforce client app 'p4'."""
+    def __init__(self, p4='p4', maxConcurrency=8, **options):
+        """Create an asyncio 'p4' proxy object.
+
+        "p4" is the Perforce client to execute commands with. Defaults
+            to 'p4'.
+        "maxConcurrency" is the maximum number of 'p4' processes run at
+            the same time by this instance. Commands awaiting a free slot
+            are queued.
+        Other keyword arguments are the p4 options accepted by p4lib.P4.
+        """
+        if not isinstance(maxConcurrency, int) or maxConcurrency < 1:
+            raise P4LibError("Incorrect 'maxConcurrency' value. It must be "
+                             "a positive integer: '%s'" % maxConcurrency)
+        self.p4 = p4
+        self.maxConcurrency = maxConcurrency
+        self.optd = options
+        self._optv = makeOptv(**self.optd)
+        # Created on first use so that it belongs to the running loop.
+        self._semaphore = None
+
+    # Shares the handling of the per-command p4 options with P4.
+    _p4optv = p4lib.P4._p4optv
+
+    async def _p4run(self, argv, marshalled=False, **p4options):
+        """Run the given p4 command once a concurrency slot is free.
+
+        See p4lib.P4._p4run().
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.maxConcurrency)
+        p4optv, cwd = self._p4optv(p4options)
+        if marshalled:
+            p4optv = ['-G'] + p4optv
+        argv = [self.p4] + p4optv + argv
+        async with self._semaphore:
+            return await _run(argv, cwd=cwd, marshalled=marshalled)
+
+    async def _run_and_process(self, argv, process_callback, raw,
+                               **p4options):
+        output, error, retval = await self._p4run(argv, **p4options)
+
+        if raw:
+            return {'stdout': output, 'stderr': error, 'retval': retval}
+
+        return process_callback(output)
+
+    async def _batch_run(self, argv, files, p4options):
+        """Run 'argv' on 'files' by sets of 10 files, all of them
+        concurrently (within the 'maxConcurrency' limit).
+
+        See p4lib.P4._batch_run().
+        """
+        SET_SIZE = 10
+
+        if files:
+            outputs = await asyncio.gather(*[
+                self._p4run(argv + files[i:i + SET_SIZE], **p4options)
+                for i in range(0, len(files), SET_SIZE)])
+        else:
+            outputs = [await self._p4run(argv, **p4options)]
+
+        return {"stdout": ''.join(stdout for stdout, _, _ in outputs),
+                "stderr": ''.join(stderr for _, stderr, _ in outputs),
+                "retval": sum(retval or 0 for _, _, retval in outputs)}
+
+    async def opened(self, files=[], allClients=False, change=None,
+                     _raw=False, **p4options):
+        """Get a list of files opened in a pending changelist.
+
+        See p4lib.P4.opened().
+        """
+        optv = _argumentGenerator({'-a': allClients, '-c': change})
+
+        argv = ['opened'] + optv
+        results = await self._batch_run(argv, _normalizeFiles(files),
+                                        p4options)
+
+        if _raw:
+            return results
+
+        return p4lib._opened_parse_cb(results["stdout"])
+
+    async def where(self, files=[], _raw=0, **p4options):
+        """Show how filenames map through the client view.
+
+        See p4lib.P4.where().
+        """
+        argv = ['where']
+        if files:
+            argv += _normalizeFiles(files)
+
+        return await self._run_and_process(argv,
+                                           p4lib._where_result_cb,
+                                           raw=_raw,
+                                           **p4options)
+
+    async def have(self, files=[], _raw=0, **p4options):
+        """Get list of file revisions last synced.
+
+        See p4lib.P4.have().
+        """
+        argv = ['have']
+        results = await self._batch_run(argv, _normalizeFiles(files),
+                                        p4options)
+
+        if _raw:
+            return results
+
+        return p4lib._have_result_cb(results["stdout"])
+
+    async def describe(self, change, diffFormat='', shortForm=False,
+                       _raw=False, **p4options):
+        """Get a description of the given changelist.
+
+        See p4lib.P4.describe().
+        """
+        if diffFormat not in ('', 'n', 'c', 's', 'u'):
+            raise P4LibError("Incorrect diff format flag: '%s'" % diffFormat)
+
+        optv = _argumentGenerator({'-d%s': diffFormat, '-s': shortForm})
+        argv = ['describe'] + optv + [str(change)]
+
+        return await self._run_and_process(
+            argv,
+            lambda output: p4lib._describe_result_cb(output, shortForm),
+            raw=_raw,
+            **p4options)
+
+    async def changes(self, files=[], followIntegrations=False,
+                      longOutput=False, maximum=None, status=None,
+                      _raw=False, **p4options):
+        """Return a list of pending and submitted changelists.
+
+        See p4lib.P4.changes().
+        """
+        argv = p4lib._changes_argv(files, followIntegrations, longOutput,
+                                   maximum, status)
+
+        return await self._run_and_process(
+            argv,
+            lambda output: p4lib._changes_parse_cb(output, longOutput),
+            raw=_raw,
+            **p4options)
+
+    async def sync(self, files=[], force=False, dryrun=False, _raw=0,
+                   **p4options):
+        """Synchronize the client with its view of the depot.
+
+        See p4lib.P4.sync().
+        """
+        optv = _argumentGenerator({'-f': force, '-n': dryrun})
+
+        argv = ['sync'] + optv
+        results = await self._batch_run(argv, _normalizeFiles(files),
+                                        p4options)
+
+        if _raw:
+            return results
+
+        return p4lib._sync_parse_cb(results["stdout"])
+
+    async def files(self, files, _raw=0, **p4options):
+        """List files in the depot.
+
+        See p4lib.P4.files().
+        """
+        if not files:
+            raise P4LibError("Missing/wrong number of arguments.")
+
+        argv = ['files'] + _normalizeFiles(files)
+
+        return await self._run_and_process(argv,
+                                           p4lib._files_parse_cb,
+                                           raw=_raw,
+                                           **p4options)
+
+    async def filelog(self, files, followIntegrations=False,
+                      longOutput=False, maxRevs=None, _raw=0, **p4options):
+        """List revision histories of files.
+
+        See p4lib.P4.filelog().
+        """
+        argv = p4lib._filelog_argv(files, followIntegrations, longOutput,
+                                   maxRevs)
+
+        return await self._run_and_process(
+            argv,
+            lambda output: p4lib._filelog_parse_cb(output, longOutput),
+            raw=_raw,
+            **p4options)
+
+    async def fstat(self, files, fields=None, filterExpression=None,
+                    _raw=0, **p4options):
+        """List files in the depot.
+
+        See p4lib.P4.fstat(). With '_raw', only the unprocessed results
+        are returned, as for the other commands.
+        """
+        if not files:
+            raise P4LibError("Missing/wrong number of arguments.")
+
+        argv = p4lib._fstat_argv(fields, filterExpression)
+        results = await self._batch_run(argv, _normalizeFiles(files),
+                                        p4options)
+
+        if _raw:
+            return results
+
+        return p4lib._fstat_parse_cb(results["stdout"], fields)
+
+    async def print_(self, files, localFile=None, quiet=False, **p4options):
+        """Retrieve depot file contents.
+
+        See p4lib.P4.print_().
+        """
+        if not files:
+            raise P4LibError("Missing/wrong number of arguments.")
+
+        optv = _argumentGenerator({'-o': localFile, '-q': quiet})
+        argv = ['print'] + optv + _normalizeFiles(files)
+
+        output, error, retval = await self._p4run(argv, marshalled=True,
+                                                  **p4options)
+
+        return p4lib._print_parse_nodes(p4lib._marshalOutputNodes(output))
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# License: MIT License (http://www.opensource.org/licenses/mit-license.php)
+
+"""
+    Columnar results of 'p4' commands, for statistics over many changes,
+    file revisions or files.
+
+    Usage:
+        import p4lib
+        import p4lib_columns
+
+        p4 = p4lib.P4(<p4options>)
+        changes = p4lib_columns.changes(p4, '//depot/main/...')
+        mine = changes.filter(user='bertha')
+        perUser = changes.groupBy('user')       # {user: change count}
+        times = changes.numpy('time')           # with NumPy installed
+
+    changes(), filelog() and fstat() fill a Columns from the results of
+    p4lib.P4.iter_changes(), .iter_filelog() and .iter_fstat() as they
+    are parsed, one row per change, file revision or file. Numbers are
+    kept in 'array' arrays of integers and the strings which repeat
+    (users, clients, actions, file types...) as integer codes, so that a
+    column of a million rows takes a few megabytes and converts to a
+    NumPy array in a single copy of its memory.
+
+    NumPy is optional: only Columns.numpy() needs it.
+"""
+
+import array
+import time
+
+from p4lib import P4LibError
+
+
+#---- internal support stuff
+
+# The kinds of columns.
+_INT = 'int'    # integers, in an array
+_CODE = 'code'  # strings, as integer codes in an array
+_TEXT = 'text'  # strings, in a list
+
+# The array type code of the integer columns.
+_TYPECODE = 'l'
+
+
+class _DateSeconds:
+    """The seconds since the epoch of the p4 dates ('2002/05/08') at
+    local midnight, as p4 gives times, with the few dates of a result
+    converted once."""
+    def __init__(self):
+        self._seconds = {}
+
+    def __call__(self, date):
+        try:
+            return self._seconds[date]
+        except KeyError:
+            seconds = int(time.mktime(time.strptime(date, '%Y/%m/%d')))
+            self._seconds[date] = seconds
+            return seconds
+
+
+def _int(value):
+    # fstat gives '' or 'default' for the missing numbers.
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+#---- public stuff
+
+class Columns:
+    """The columns of a p4 result, one value per row in each column.
+
+    The integer columns are 'array' arrays. The strings of the code
+    columns are the integers of an array too, which values() and code()
+    translate. The text columns are lists of strings.
+    """
+    def __init__(self, schema, _codes=None):
+        """Create empty columns.
+
+        "schema" is the list of the (<name>, <kind>) of the columns,
+            <kind> being 'int', 'code' or 'text'.
+        """
+        self.names = tuple(name for name, kind in schema)
+        self.kinds = dict(schema)
+        self._columns = dict((name, [] if kind == _TEXT
+                              else array.array(_TYPECODE))
+                             for name, kind in schema)
+        # The strings of each code column and their codes.
+        if _codes is None:
+            _codes = dict((name, ([], {})) for name, kind in schema
+                          if kind == _CODE)
+        self._codes = _codes
+
+    def append(self, row):
+        """Add a row, given as the sequence of its values in the order
+        of the columns."""
+        for name, value in zip(self.names, row):
+            kind = self.kinds[name]
+            if kind == _CODE:
+                strings, codes = self._codes[name]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(strings)
+                    strings.append(value)
+                value = code
+            elif kind == _INT:
+                value = _int(value)
+            self._columns[name].append(value)
+
+    def __len__(self):
+        return len(self._columns[self.names[0]])
+
+    def __getitem__(self, name):
+        """Return the column 'name': an array, or a list of strings."""
+        try:
+            return self._columns[name]
+        except KeyError:
+            raise P4LibError("Unknown column: '%s'" % name)
+
+    def code(self, name, value):
+        """Return the code of the string 'value' in the code column
+        'name', or None if it is not in the column."""
+        return self._codeTable(name)[1].get(value)
+
+    def values(self, name):
+        """Return the values of the column 'name' as a list, the ones of a
+        code column being the strings."""
+        column = self[name]
+        if self.kinds[name] == _CODE:
+            strings = self._codeTable(name)[0]
+            return [strings[code] for code in column]
+        return list(column)
+
+    def row(self, index):
+        """Return the row 'index' as a dict."""
+        row = {}
+        for name in self.names:
+            value = self._columns[name][index]
+            if self.kinds[name] == _CODE:
+                value = self._codes[name][0][value]
+            row[name] = value
+        return row
+
+    def take(self, indices):
+        """Return new columns with the given rows, in that order."""
+        taken = Columns([(name, self.kinds[name]) for name in self.names],
+                        self._codes)
+        for name in self.names:
+            column = self._columns[name]
+            taken._columns[name].extend(column[i] for i in indices)
+        return taken
+
+    def filter(self, **conditions):
+        """Return new columns with the rows matching all the given
+        conditions, e.g. changes.filter(user='bertha', time=lambda t:
+        t >= start).
+
+        Each keyword argument is a column name, and its value is the
+        value to match, a list, tuple or set of values, or a function
+        returning whether a value matches. A function is only called
+        once per string of a code column.
+        """
+        tests = []
+        for name, condition in conditions.items():
+            column = self[name]
+            if self.kinds[name] == _CODE:
+                strings = self._codeTable(name)[0]
+                if callable(condition):
+                    match = condition
+                elif isinstance(condition, (list, tuple, set, frozenset)):
+                    match = lambda value, condition=condition: \
+                        value in condition
+                else:
+                    match = lambda value, condition=condition: \
+                        value == condition
+                codes = set(code for code, value in enumerate(strings)
+                            if match(value))
+                tests.append((column, codes.__contains__))
+            elif callable(condition):
+                tests.append((column, condition))
+            elif isinstance(condition, (list, tuple, set, frozenset)):
+                tests.append((column, set(condition).__contains__))
+            else:
+                tests.append((column, lambda value, condition=condition:
+                              value == condition))
+
+        indices = range(len(self))
+        for column, test in tests:
+            indices = [i for i in indices if test(column[i])]
+        return self.take(indices)
+
+    def groupBy(self, name, column=None, aggregate=len):
+        """Return a dict of the 'aggregate' of the values of each group
+        of rows with the same value in the column 'name'.
+
+        "column" is the column of the values to aggregate. Defaults to
+            none, the values being the row indices.
+        "aggregate" is the function making the result of a group from
+            the list of its values, e.g. sum or max. Defaults to len, so
+            that groupBy('user') counts the rows of each user.
+
+        The keys of a code column are its strings, and so are the values
+        of a code "column".
+        """
+        keys = self[name]
+        if column is None:
+            values = range(len(self))
+        elif self.kinds[column] == _CODE:
+            values = self.values(column)
+        else:
+            values = self[column]
+
+        groups = {}
+        for key, value in zip(keys, values):
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = []
+            group.append(value)
+
+        if self.kinds[name] == _CODE:
+            strings = self._codeTable(name)[0]
+            return dict((strings[key], aggregate(group))
+                        for key, group in groups.items())
+        return dict((key, aggregate(group)) for key, group in groups.items())
+
+    def numpy(self, name):
+        """Return the column 'name' as a NumPy array: the codes for a
+        code column, an array of objects for a text column.
+
+        Raises a P4LibError if NumPy is not installed.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise P4LibError("NumPy is not installed.")
+        column = self[name]
+        if self.kinds[name] == _TEXT:
+            return numpy.array(column, dtype=object)
+        return numpy.array(column, dtype=numpy.dtype(_TYPECODE))
+
+    def _codeTable(self, name):
+        self[name]
+        if self.kinds[name] != _CODE:
+            raise P4LibError("Not a code column: '%s'" % name)
+        return self._codes[name]
+
+
+_changesSchema = [('change', _INT),
+                  ('time', _INT),
+                  ('user', _CODE),
+                  ('client', _CODE),
+                  ('description', _TEXT)]
+
+
+def changes(p4, files=[], followIntegrations=False, longOutput=False,
+            maximum=None, status=None, **p4options):
+    """Return the changes of p4lib.P4.changes() as Columns: 'change',
+    'time' (of the day of the change), 'user', 'client' (codes) and
+    'description' (text).
+
+    Takes the arguments of p4lib.P4.changes() after the P4 'p4'.
+    """
+    columns = Columns(_changesSchema)
+    seconds = _DateSeconds()
+    for change in p4.iter_changes(files, followIntegrations, longOutput,
+                                  maximum, status, **p4options):
+        columns.append((change['change'], seconds(change['date']),
+                        change['user'], change['client'],
+                        change['description']))
+    return columns
+
+
+_filelogSchema = [('depotFile', _CODE),
+                  ('rev', _INT),
+                  ('change', _INT),
+                  ('action', _CODE),
+                  ('time', _INT),
+                  ('user', _CODE),
+                  ('client', _CODE),
+                  ('type', _CODE)]
+
+
+def filelog(p4, files, followIntegrations=False, maxRevs=None,
+            **p4options):
+    """Return the file revisions of p4lib.P4.filelog() as Columns, one row
+    per revision: 'depotFile' (code), 'rev', 'change', 'action' (code),
+    'time' (of the day of the revision), 'user', 'client' and 'type'
+    (codes).
+
+    Takes the arguments of p4lib.P4.filelog() after the P4 'p4'.
+    """
+    columns = Columns(_filelogSchema)
+    seconds = _DateSeconds()
+    for hit in p4.iter_filelog(files, followIntegrations, maxRevs=maxRevs,
+                               **p4options):
+        depotFile = hit['depotFile']
+        for rev in hit['revs']:
+            columns.append((depotFile, rev['rev'], rev['change'],
+                            rev['action'], seconds(rev['date']),
+                            rev['user'], rev['client'], rev['type']))
+    return columns
+
+
+_fstatSchema = [('depotFile', _TEXT),
+                ('headAction', _CODE),
+                ('headType', _CODE),
+                ('headRev', _INT),
+                ('headChange', _INT),
+                ('headTime', _INT),
+                ('haveRev', _INT),
+                ('action', _CODE)]
+
+
+def fstat(p4, files, filterExpression=None, **p4options):
+    """Return the files of p4lib.P4.fstat() as Columns: 'depotFile'
+    (text), 'headAction', 'headType' (codes), 'headRev', 'headChange',
+    'headTime', 'haveRev' and 'action' (code, '' if not opened). The
+    missing numbers are 0.
+
+    Takes the arguments of p4lib.P4.fstat() after the P4 'p4'. Only these
+    fields are asked to the server.
+    """
+    fields = [name for name, kind in _fstatSchema]
+    columns = Columns(_fstatSchema)
+    for hit in p4.iter_fstat(files, fields=fields,
+                             filterExpression=filterExpression,
+                             **p4options):
+        columns.append([hit[name] for name in fields])
+    return columns
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# License: MIT License (http://www.opensource.org/licenses/mit-license.php)
+
+"""
+    A local SQLite mirror of the submitted changes of a Perforce server:
+    their user, client, time and description, and the files each one
+    submitted.
+
+    Usage:
+        import p4lib
+        import p4lib_mirror
+
+        p4 = p4lib.P4(<p4options>)
+        mirror = p4lib_mirror.Mirror('changes.db')
+        mirror.sync(p4)                 # only fetches the new changes
+        changes = mirror.changes('//depot/main/...', user='bertha',
+                                 since='2024/01/01', until='2024/04/01')
+        desc = mirror.describe(changes[0]['change'])
+
+    Mirror.sync() lists the changes submitted after the last one it
+    mirrored with 'p4 changes <files>@<next>,@<newest>' and describes them
+    with 'p4 -G describe -s', many changes per process, the oldest first.
+    Each batch is committed with the new last change, so an interrupted
+    sync keeps what it fetched and the next one goes on from there.
+
+    The queries of changes(), describe() and users() only read the
+    SQLite database, whose indexes on users, times and depot paths answer
+    them in milliseconds where 'p4' would read the server again.
+
+    Changes which are deleted or obliterated on the server after they
+    were mirrored stay in the mirror.
+"""
+
+import sqlite3
+import time
+from multiprocessing.pool import ThreadPool
+
+import p4lib
+from p4lib import P4LibError, _normalizeFiles
+
+
+#---- internal support stuff
+
+# The version of the database schema, in the 'meta' table.
+_SCHEMA_VERSION = '1'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS changes (
+    change INTEGER PRIMARY KEY,
+    time INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    client TEXT NOT NULL,
+    description TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS changes_user ON changes (user, time);
+CREATE INDEX IF NOT EXISTS changes_time ON changes (time);
+CREATE TABLE IF NOT EXISTS files (
+    change INTEGER NOT NULL,
+    depotFile TEXT NOT NULL,
+    rev INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    type TEXT NOT NULL,
+    PRIMARY KEY (change, depotFile));
+CREATE INDEX IF NOT EXISTS files_depotFile ON files (depotFile, change);
+CREATE TABLE IF NOT EXISTS users (
+    user TEXT PRIMARY KEY,
+    changes INTEGER NOT NULL,
+    firstTime INTEGER NOT NULL,
+    lastTime INTEGER NOT NULL);
+"""
+
+
+def _seconds(value):
+    """Return the seconds since the epoch of 'value': seconds already,
+    or a local p4 date such as '2024/01/01' or '2024/01/01 12:30:00'."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    for dateFormat in ('%Y/%m/%d', '%Y/%m/%d %H:%M:%S'):
+        try:
+            return int(time.mktime(time.strptime(value, dateFormat)))
+        except ValueError:
+            pass
+    raise P4LibError("Incorrect date: '%s'. It must be seconds since the "
+                     "epoch or 'YYYY/MM/DD[ HH:MM:SS]'." % value)
+
+
+def _pathCondition(path):
+    """Return the SQL condition on 'files.depotFile' matching the depot
+    path 'path', and its parameters.
+
+    A path ending with '...' matches the files under it with a range
+    of the index on the depot paths. Other wildcards are not supported.
+    """
+    prefix = path[:-3] if path.endswith('...') else path
+    for special in ('...', '*', '%%', '@', '#'):
+        if special in prefix:
+            raise P4LibError("Unsupported mirror query path: '%s'. Only "
+                             "files and paths ending with '...' can be "
+                             "queried." % path)
+    if prefix == path:
+        return 'depotFile = ?', [path]
+    if not prefix:
+        return '1', []
+    # The first string after all the ones starting with 'prefix'.
+    end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return 'depotFile >= ? AND depotFile < ?', [prefix, end]
+
+
+def _describe(p4, changes, p4options):
+    """Return the 'p4 -G describe -s' dicts of the change numbers
+    'changes', run in a single process."""
+    argv = ['describe', '-s'] + [str(change) for change in changes]
+    output, error, retval = p4._p4run(argv, marshalled=True, **p4options)
+    return list(p4lib._marshalOutputNodes(output))
+
+
+def _nodeFiles(node):
+    """Generate the (depotFile, rev, action, type) of the files of the
+    'p4 -G describe' dict 'node'."""
+    i = 0
+    while 'depotFile%d' % i in node:
+        yield (node['depotFile%d' % i], int(node['rev%d' % i]),
+               node['action%d' % i], node.get('type%d' % i, ''))
+        i += 1
+
+
+_changeColumns = 'change, time, user, client, description'
+
+
+def _changeDict(row):
+    return dict(zip(('change', 'time', 'user', 'client', 'description'),
+                    row))
+
+
+#---- public stuff
+
+class Mirror:
+    """A local SQLite mirror of the submitted changes of one server, for
+    the files of one set of depot paths.
+
+    The database is only written by sync(), which fetches the changes
+    submitted since the last one, and read by the query methods.
+    """
+    def __init__(self, path):
+        """Open the mirror database 'path', created if needed. ':memory:'
+        is a mirror in memory.
+        """
+        self.path = path
+        self._db = sqlite3.connect(path)
+        # p4lib gives native strings, on Python 2 as well.
+        self._db.text_factory = str
+        with self._db:
+            self._db.executescript(_SCHEMA)
+            self._db.execute("INSERT OR IGNORE INTO meta VALUES "
+                             "('schema', ?)", (_SCHEMA_VERSION,))
+        schema = self._meta('schema')
+        if schema != _SCHEMA_VERSION:
+            raise P4LibError("Unsupported mirror schema version '%s' in "
+                             "'%s'." % (schema, path))
+
+    def close(self):
+        """Close the database."""
+        self._db.close()
+
+    def _meta(self, name, default=None):
+        row = self._db.execute("SELECT value FROM meta WHERE name = ?",
+                               (name,)).fetchone()
+        if row is None:
+            return default
+        return row[0]
+
+    def _setMeta(self, name, value):
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                         (name, str(value)))
+
+    def lastChange(self):
+        """Return the number of the last change the mirror is up to date
+        with, 0 if it was never synced."""
+        return int(self._meta('lastChange', 0))
+
+    def sync(self, p4, files=['//...'], batchSize=50, maximum=None,
+             **p4options):
+        """Add the changes submitted since the last sync to the mirror and
+        return their number.
+
+        "p4" is the p4lib.P4 to fetch them with. Its 'maxWorkers'
+            'p4 describe' processes run at the same time.
+        "files" is the list of the depot paths whose changes are
+            mirrored. Defaults to the whole depot. It must be the same
+            at every sync of a mirror.
+        "batchSize" is the number of changes described by each 'p4
+            describe' process.
+        "maximum" limits the sync to the given number of the oldest
+            changes to fetch, e.g. to fill the mirror of a large depot in
+            several steps. Defaults to all of them.
+
+        The changes are listed up to the newest change at the start of
+        the sync, so that the next one starts right after it.
+        """
+        files = _normalizeFiles(files)
+        if not files:
+            raise P4LibError("Missing/wrong number of arguments.")
+        for path in files:
+            if '@' in path or '#' in path:
+                raise P4LibError("Mirrored paths cannot have revisions: "
+                                 "'%s'" % path)
+        if not isinstance(batchSize, int) or batchSize < 1:
+            raise P4LibError("Incorrect 'batchSize' value. It must be a "
+                             "positive integer: '%s'" % batchSize)
+
+        # The same server and paths at every sync, or changes would be
+        # missing.
+        for name, value in (('port', p4._port(p4options)),
+                            ('files', '\n'.join(files))):
+            mirrored = self._meta(name)
+            if mirrored is None:
+                with self._db:
+                    self._setMeta(name, value)
+            elif mirrored != value:
+                raise P4LibError("The mirror '%s' is the one of %s '%s', "
+                                 "not '%s'." % (self.path, name, mirrored,
+                                                value))
+
+        low = self.lastChange() + 1
+        newest = p4.changes(maximum=1, status='submitted', **p4options)
+        if not newest or newest[0]['change'] < low:
+            return 0
+        high = newest[0]['change']
+
+        changes = sorted(change['change'] for change in p4.changes(
+            ['%s@%d,@%d' % (path, low, high) for path in files],
+            status='submitted', **p4options))
+        if maximum is not None and len(changes) > maximum:
+            changes = changes[:maximum]
+            high = changes[-1] if changes else low - 1
+
+        batches = [changes[i:i + batchSize]
+                   for i in range(0, len(changes), batchSize)]
+        describe = lambda batch: _describe(p4, batch, p4options)
+        pool = None
+        if p4.maxWorkers > 1 and len(batches) > 1:
+            pool = ThreadPool(min(p4.maxWorkers, len(batches)))
+            results = pool.imap(describe, batches)
+        else:
+            results = (describe(batch) for batch in batches)
+        try:
+            for batch, nodes in zip(batches, results):
+                with self._db:
+                    self._add(nodes)
+                    self._setMeta('lastChange', batch[-1])
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        with self._db:
+            self._setMeta('lastChange', high)
+        return len(changes)
+
+    def _add(self, nodes):
+        """Insert the changes of the 'p4 -G describe' dicts 'nodes'."""
+        db = self._db
+        for node in nodes:
+            change, seconds = int(node['change']), int(node['time'])
+            db.execute("INSERT INTO changes VALUES (?, ?, ?, ?, ?)",
+                       (change, seconds, node['user'], node['client'],
+                        node['desc']))
+            db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                           ((change,) + f for f in _nodeFiles(node)))
+            db.execute("INSERT OR IGNORE INTO users VALUES (?, 0, ?, ?)",
+                       (node['user'], seconds, seconds))
+            db.execute("UPDATE users SET changes = changes + 1, "
+                       "firstTime = min(firstTime, ?), "
+                       "lastTime = max(lastTime, ?) WHERE user = ?",
+                       (seconds, seconds, node['user']))
+
+    def changes(self, files=[], user=None, client=None, since=None,
+                until=None, maximum=None):
+        """Return the mirrored changes matching all the given conditions,
+        the most recent first.
+
+        "files" is a list of depot files or paths ending with '...' to
+            limit the results to the changes of these files. Defaults to
+            all the changes.
+        "user" and "client" limit the results to the changes of this
+            user or client.
+        "since" and "until" limit the results to the changes submitted
+            from "since" and before "until", given as seconds since the
+            epoch or as local dates such as '2024/01/01'.
+        "maximum" limits the results to the given number of changes.
+
+        Returns a list of dicts with the keys 'change', 'time' (seconds
+        since the epoch), 'user', 'client' and 'description' (the full
+        description).
+        """
+        conditions, parameters = [], []
+        paths = _normalizeFiles(files)
+        if paths:
+            pathConditions = []
+            for path in paths:
+                condition, pathParameters = _pathCondition(path)
+                pathConditions.append('(%s)' % condition)
+                parameters += pathParameters
+            conditions.append("change IN (SELECT change FROM files WHERE "
+                              "%s)" % ' OR '.join(pathConditions))
+        for condition, value in (('user = ?', user),
+                                 ('client = ?', client),
+                                 ('time >= ?', _seconds(since)),
+                                 ('time < ?', _seconds(until))):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        sql = "SELECT %s FROM changes" % _changeColumns
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY change DESC"
+        if maximum is not None:
+            if not isinstance(maximum, int):
+                raise P4LibError("Incorrect 'maximum' value. It must be an "
+                                 "integer: '%s' (type '%s')"
+                                 % (maximum, type(maximum)))
+            sql += " LIMIT %d" % maximum
+        return [_changeDict(row)
+                for row in self._db.execute(sql, parameters)]
+
+    def describe(self, change):
+        """Return the mirrored change 'change' as a dict with the keys of
+        changes() and 'files', the list of the dicts of its files with
+        the keys 'depotFile', 'rev', 'action' and 'type'. Returns None if
+        the change is not in the mirror.
+        """
+        row = self._db.execute("SELECT %s FROM changes WHERE change = ?"
+                               % _changeColumns, (int(change),)).fetchone()
+        if row is None:
+            return None
+        desc = _changeDict(row)
+        desc['files'] = [
+            dict(zip(('depotFile', 'rev', 'action', 'type'), f))
+            for f in self._db.execute("SELECT depotFile, rev, action, type "
+                                      "FROM files WHERE change = ? "
+                                      "ORDER BY depotFile", (desc['change'],))]
+        return desc
+
+    def users(self):
+        """Return a dict of the mirrored users, each one with a dict of its
+        number of 'changes' and the 'firstTime' and 'lastTime' it
+        submitted one (seconds since the epoch)."""
+        return dict((user, {'changes': changes, 'firstTime': firstTime,
+                            'lastTime': lastTime})
+                    for user, changes, firstTime, lastTime
+                    in self._db.execute("SELECT * FROM users"))
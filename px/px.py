@@ -26,6 +26,12 @@ pxOptionsDoc = """\
                         pretty-printed
         --self-test     run px's self test suite and exit
 
+    px Environment:
+        PX_CACHE_DIR    directory in which 'px annotate', 'px backout' and
+                        'px genpatch' keep file revisions, their
+                        annotations and submitted change descriptions
+                        between runs
+
 """
 
 __revision__ = "$Id: px.py 2225 2008-01-23 18:17:55Z trentm $"
@@ -42,6 +48,16 @@ import types
 import glob
 import marshal
 import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # The backport of os.scandir() for Python 2.
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 import p4lib
 
@@ -314,37 +330,68 @@ class _ListCmd(cmd.Cmd):
 
 class _FindError(Exception): pass
 
-def _addOrSkipFiles((files, filesToSkip, dirsToSkip), dirName, filesInDir):
-    """Add all files in the current directory to "files" unless should skip.
-    os.path.walk() callback used by _findFiles()
+def _skipRe(patterns):
+    """Return one regex matching the file names matched by any of the
+    given regex 'patterns' (with re.match()), or None."""
+    if not patterns:
+        return None
+    return re.compile('|'.join(['(?:%s)' % p for p in patterns]))
+
+def _listDir(dirName):
+    """Return the (<files>, <subdirectories>) paths in 'dirName'.
+
+    Symbolic links to directories are neither: like os.path.walk(),
+    they are not followed.
     """
-    # Handle skipping.
-    toDel = []
-    for i in range(len(filesInDir)):
-        file = os.path.join(dirName, filesInDir[i])
-        if os.path.isdir(file):
-            for pattern in dirsToSkip:
-                if re.match(pattern, os.path.basename(file)):
-                    toDel.append(i)
-                    break
-        elif os.path.isfile(file):
-            for pattern in filesToSkip:
-                if re.match(pattern, os.path.basename(file)):
-                    toDel.append(i)
-                    break
-    toDel.reverse() # delete list elems backwards for proper indexing
-    for i in toDel:
-        del filesInDir[i]
-    
-    # Add remaining files (not dirs).
-    for file in filesInDir:
-        file = os.path.join(dirName, file)
-        if os.path.isdir(file):
-            continue
-        files.append(file)
-
-def _findFiles(filespec, filesToSkip=[], dirsToSkip=[]):
-    """Return a list of local files described by the given filespec.
+    files = []
+    dirs = []
+    try:
+        if scandir is not None:
+            for entry in scandir(dirName):
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        dirs.append(entry.path)
+                else:
+                    files.append(entry.path)
+        else:
+            for name in os.listdir(dirName):
+                path = os.path.join(dirName, name)
+                if os.path.isdir(path):
+                    if not os.path.islink(path):
+                        dirs.append(path)
+                else:
+                    files.append(path)
+    except OSError, ex:
+        log.info("cannot list '%s': %s" % (dirName, ex))
+    return files, dirs
+
+def _walkFiles(startDir, skipFileRe=None, skipDirRe=None, workers=8):
+    """Generate the paths of the files under 'startDir' as they are found.
+
+    The directories are listed level by level, up to 'workers' at a time,
+    so that only the directories of the next level are kept in memory.
+    """
+    pool = ThreadPool(workers)
+    try:
+        level = [startDir]
+        while level:
+            nextLevel = []
+            for files, dirs in pool.imap(_listDir, level):
+                for file in files:
+                    if skipFileRe is None \
+                       or not skipFileRe.match(os.path.basename(file)):
+                        yield file
+                for dir in dirs:
+                    if skipDirRe is None \
+                       or not skipDirRe.match(os.path.basename(dir)):
+                        nextLevel.append(dir)
+            level = nextLevel
+    finally:
+        pool.close()
+        pool.join()
+
+def _iterFiles(filespec, filesToSkip=[], dirsToSkip=[]):
+    """Generate the local files described by the given filespec.
     
     A 'filespec' may include normal file glob syntax *OR* trailing a
     trailing '...' after a directory separator to indicate everything
@@ -357,7 +404,13 @@ def _findFiles(filespec, filesToSkip=[], dirsToSkip=[]):
 
     A list of file and dir regex patterns to explicitly skip can be
     specified. By default no files are skipped.
+
+    The files are generated as they are found rather than once the
+    whole tree has been walked. A _FindError is raised on the first
+    iteration for an invalid 'filespec'.
     """
+    skipFileRe = _skipRe(filesToSkip)
+    skipDirRe = _skipRe(dirsToSkip)
     if filespec[-3:] == '...':
         # This indicates to recursively process the dir.
         startDir = os.path.dirname(filespec) or os.curdir
@@ -369,20 +422,36 @@ def _findFiles(filespec, filesToSkip=[], dirsToSkip=[]):
                              % filespec)
         if not os.path.isdir(startDir):
             raise _FindError("'%s' directory does not exist." % startDir)
-        files = []
-        os.path.walk(startDir, _addOrSkipFiles,
-                     (files, filesToSkip, dirsToSkip))
-        return files
+        for file in _walkFiles(startDir, skipFileRe, skipDirRe):
+            yield file
     else:
-        allFiles = glob.glob(filespec)
-        files = []
-        for file in allFiles:
-            dirName, fileName = os.path.split(file)
-            if not dirName:
-                dirName = os.curdir
-            _addOrSkipFiles((files, filesToSkip, dirsToSkip), dirName,
-                            [fileName])
-        return files 
+        for file in glob.glob(filespec):
+            if os.path.isdir(file):
+                continue
+            if skipFileRe is None \
+               or not skipFileRe.match(os.path.basename(file)):
+                yield file
+
+def _prefetch(pool, function, items, ahead):
+    """Generate 'function(item)' for each of 'items', in order, with up
+    to 'ahead' of the next results being computed in the thread pool
+    'pool' meanwhile.
+
+    Unlike pool.imap(), the results are not computed further ahead than
+    that, so that at most 'ahead + 1' of them are in memory.
+    """
+    pending = []
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) > ahead:
+            yield pending.pop(0).get()
+    for result in pending:
+        yield result.get()
+
+def _batches(items, size):
+    """Generate the successive lists of 'size' of the given items."""
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
 
 
 
@@ -404,7 +473,7 @@ class PxShell(_ListCmd):
         px changes -d ...       See 'px help changes'.
         px diff -sn --skip ...  See 'px help diff'.
         px diff -c <change> ... See 'px help diff'.
-        px genpatch [<change>]  See 'px help genpatch'.
+        px genpatch ...         See 'px help genpatch'.
     """
     name = 'px'
     def __init__(self, optv):
@@ -429,6 +498,22 @@ class PxShell(_ListCmd):
             log.warn("dropping '-s' option, px cannot yet handle it")
         _ListCmd.__init__(self)
 
+    def _getP4(self):
+        """Return a p4lib.P4 driving p4 with the px options.
+
+        File revisions printed, submitted changes described and file
+        revisions annotated with it are kept in $PX_CACHE_DIR/print,
+        $PX_CACHE_DIR/describe and $PX_CACHE_DIR/annotate if
+        $PX_CACHE_DIR is set.
+        """
+        optd = p4lib.parseOptv(self.__p4optv)
+        cacheDir = os.environ.get('PX_CACHE_DIR')
+        if cacheDir:
+            optd['printCache'] = os.path.join(cacheDir, 'print')
+            optd['describeCache'] = os.path.join(cacheDir, 'describe')
+            optd['annotateCache'] = os.path.join(cacheDir, 'annotate')
+        return p4lib.P4(**optd)
+
     def _p4run(self, argv):
         """Run 'p4' with the given arguments and using px extensions.
 
@@ -620,7 +705,7 @@ class PxShell(_ListCmd):
         Limit diffing to files opened in the given pending change.  See
         'px help diff'.
 
-    px genpatch [<change>]
+    px genpatch [-o <patchfile>] [<change>]
         Generate a patch (usable by the GNU 'patch' program) from a
         pending or submitted chagelist.  See 'px help genpatch'.
 """)
@@ -673,7 +758,7 @@ class PxShell(_ListCmd):
             p4argv.remove('-s')
 
         # Check that the file specification maps to exactly one file.
-        p4 = p4lib.P4( **p4lib.parseOptv(self.__p4optv) )
+        p4 = self._getP4()
         files = p4.files(file+suff)
         if not files:
             sys.stderr.write("px annotate: error: '%s' - no such file\n"\
@@ -726,49 +811,17 @@ class PxShell(_ListCmd):
             if not rev2user.has_key(revnum):
                 rev2user[revnum] = rev['user']
 
-        # We are going to start at the base revision (all lines are from
-        # that base) and work through each patch, updating the line
-        # revisions as we go.
-        revs = filelog['revs']
-        revs.sort(lambda a,b: cmp(a['rev'], b['rev']))
-        file_1 = p4.print_( '%s#%s' % (file, str(revs[0]['rev'])) )[0]
-        lines_1 = file_1['text'].split('\n')
-        linedata = [{'rev':revs[0]['rev']} for i in lines_1]
-
-        # Properly handle the diff chunk headers (e.g. 10,11c10,13 and
-        # 37c39,87) for each revision change. We are just concerned with
-        # line numbers here, not that actual text.
-        headerRe = re.compile('^(\d+),?(\d*)([acd])(\d+),?(\d*)')
-        for rev in revs[1:]:
-            revnum = rev['rev']
-            diff = p4.diff2(file+'#'+str(revnum-1), file+'#'+str(revnum))
-            if not diff.has_key('text'):
-                continue
-            difflines = diff['text'].split('\n')
-            # Apply the diffs in reverse order to maintain correctness
-            # of line numbers for each range as we apply it.
-            difflines.reverse()
-            for line in difflines:
-                match = headerRe.search(line)
-                if match:
-                    la, lb, op, ra, rb = match.groups()
-                    if not lb: lb = la
-                    if not rb: rb = ra
-                    la=int(la); lb=int(lb); ra=int(ra); rb=int(rb)
-                    if op == 'a': la += 1
-                    if op == 'd': ra += 1
-                    linedata[la-1:lb] = [{'rev':revnum} for i in range(rb-ra+1)]
-
-        # Get the text of the selected revision and fill in other data.
-        file_head = p4.print_(file+suff)[0]
-        text = file_head['text'].split('\n')
-        if len(linedata) != len(text):
-            raise PxError("internal error applying diffs to '%s'" % file)
-        for i in range(len(linedata)):
-            linedata[i]['text'] = text[i]
-            revnum = linedata[i]['rev']
-            linedata[i]['change'] = rev2change[revnum]
-            linedata[i]['user'] = rev2user[revnum]
+        # Get the revision each line of the selected revision comes
+        # from and fill in other data. Servers without 'p4 annotate' are
+        # handled by p4lib, which replays the diffs between revisions.
+        file_head = p4.annotate('%s#%s' % (files[0]['depotFile'],
+                                           files[0]['rev']))[0]
+        linedata = []
+        for revnum, upper, text in file_head['lines']:
+            linedata.append({'rev': revnum,
+                             'text': text.rstrip('\n'),
+                             'change': rev2change[revnum],
+                             'user': rev2user[revnum]})
 
         # Print the data. Note that the interpolated information at the
         # beginning of the line is a multiple of 8 bytes (currently 24)
@@ -852,18 +905,6 @@ class PxShell(_ListCmd):
         The '-c' option can be used to limit diff'ing to files in the
         given changelist. '-c' cannot be used with any of the '-s' options.
         """
-        #TODO:
-        #   - A better algorithm. 'px diff -sn' can take a REALLY long
-        #     time because it lists every file under the client root
-        #     (even if the number of depot files in the client view is
-        #     small). A better way to do this would to do the 'p4 have'
-        #     first and then spit out each found local file that is not
-        #     in that list as they are found. This would show a stream
-        #     of results rather than a long delay and then all the
-        #     results. Memory consumption could be much reduced. This
-        #     would require adding a call back handler to _findFiles.
-        #   - Eventually move to my findlib if I get that done.
-
         # Process options.
         try:
             optlist, files = getopt.getopt(argv[1:], 'd:fs:tc:', ['skip'])
@@ -929,29 +970,23 @@ class PxShell(_ListCmd):
             else:
                 filesToSkip = []
                 dirsToSkip = []
-            localfiles = []
+
+            # Load the client files first so that each new local file is
+            # printed as soon as it is found, without keeping the list of
+            # local files.
+            p4files = set()
+            for f in p4.iter_have(files):
+                p4files.add(f['localFile'])
+            log.debug("%d p4 files" % len(p4files))
+
             for lfs in localfilespecs:
                 try:
-                    localfiles += _findFiles(lfs, filesToSkip, dirsToSkip)
+                    for f in _iterFiles(lfs, filesToSkip, dirsToSkip):
+                        if f not in p4files:
+                            sys.stdout.write(f + '\n')
+                            sys.stdout.flush()
                 except _FindError, ex:
                     log.info(ex)  # Ignore 'dir does not exist' errors.
-            log.debug("local files: %s" % pprint.pformat(localfiles))
-
-            p4files = [f['localFile'] for f in p4.have(files)]
-            log.debug("p4 files: %s" % pprint.pformat(p4files))
-
-            # Pull out the new files.
-            p4filemap = {}
-            for f in p4files:
-                p4filemap[f] = 1
-            newFiles = []
-            for f in localfiles:
-                if not p4filemap.has_key(f):
-                    newFiles.append(f)
-
-            for f in newFiles:
-                sys.stdout.write(f + '\n')
-                sys.stdout.flush()
         else:
             if change is not None:
                 p4 = p4lib.P4( **p4lib.parseOptv(self.__p4optv) )
@@ -997,8 +1032,11 @@ class PxShell(_ListCmd):
             return 1
 
         # Get the change description.
-        p4 = p4lib.P4( **p4lib.parseOptv(self.__p4optv) )
-        desc = p4.describe(cnum, shortForm=1)
+        p4 = self._getP4()
+        if p4.change_status(cnum) != 'submitted':
+            sys.stderr.write("Change %d is not a submitted change.\n" % cnum)
+            return 1
+        desc = p4.describe(cnum, shortForm=True)
         #pprint.pprint(desc)
 
         # Abort if any of the files is question are currently opened.
@@ -1117,12 +1155,14 @@ class PxShell(_ListCmd):
         """
     genpatch -- generate a patch from a pending or submitted changelist
 
-    px genpatch [<changelist#>]
+    px genpatch [-o <patchfile>] [<changelist#>]
 
         Generate a patch (i.e. can later be used as input for the
         'patch' program) for a given changelist number. If no change
         number is given then a patch for the 'default' changelist is
-        generated. The patch is printed on stdout.
+        generated. The patch is printed on stdout, or written to the
+        given file with '-o'. It is written as the diffs come from
+        Perforce, so that a large change is never held in memory.
 
         Files opened for 'add', 'delete' or 'branch' are inlined such
         that application with 'patch' will create or delete the intended
@@ -1141,6 +1181,16 @@ class PxShell(_ListCmd):
         #     take.
 
         # Process options.
+        try:
+            optlist, args = getopt.getopt(argv[1:], 'o:')
+        except getopt.GetoptError, ex:
+            sys.stderr.write("px genpatch: error: %s\n" % ex)
+            sys.stderr.write("Try 'px help genpatch'.\n")
+            return 1
+        patchFile = None
+        for opt, optarg in optlist:
+            if opt == '-o':
+                patchFile = optarg
         diffFormat = 'u'
         if diffFormat == 'u':
             prefixes = ('---', '+++')
@@ -1148,10 +1198,10 @@ class PxShell(_ListCmd):
             prefixes = ('***', '---')
 
         # Process args.
-        if not argv[1:]:
+        if not args:
             change = 'default'
-        elif len(argv[1:]) == 1:
-            change = argv[1]
+        elif len(args) == 1:
+            change = args[0]
             try:
                 change = int(change)
             except ValueError:  
@@ -1163,28 +1213,25 @@ class PxShell(_ListCmd):
                                      % change)
                     return 1
         else:
-            sys.stderr.write("Usage: genpatch [<changelist#>]\n")
+            sys.stderr.write("Usage: genpatch [-o <patchfile>] "\
+                             "[<changelist#>]\n")
             sys.stderr.write("Missing/wrong number of arguments.\n")
             return 1
 
         # Validate the given change number.
-        p4 = p4lib.P4( **p4lib.parseOptv(self.__p4optv) )
-        submitted = [c['change'] for c in p4.changes(status='submitted')]
-        pending = [c['change'] for c in p4.changes(status='pending')]
-        if change in submitted:
-            status = 'submitted'
-        elif change in pending+['default']:
-            status = 'pending'
-        else:
+        p4 = self._getP4()
+        status = p4.change_status(change)
+        if status not in ('submitted', 'pending'):
             sys.stderr.write("Change %s unknown." % change)
             return 1
 
-        # Get list of files to include in patch.
+        # Get list of files to include in patch. Their diffs are generated
+        # as p4 writes them.
         if status == 'submitted':
-            d = p4.describe(change, diffFormat='u')
+            d = p4.describe(change, shortForm=True)
             desc = d['description']
             files = d['files']
-            diffs = d['diff']
+            diffs = p4.iter_describe_diff(change, diffFormat='u')
         elif status == 'pending':
             files = p4.opened(change=change)
             if change == 'default':
@@ -1192,14 +1239,48 @@ class PxShell(_ListCmd):
             else:
                 desc = p4.change(change=change)['description']
             if files:
-                diffs = p4.diff([f['depotFile'] for f in files],
-                                diffFormat='u')
+                diffs = p4.iter_diff([f['depotFile'] for f in files],
+                                     diffFormat='u')
             else:
                 diffs = []
 
-        # Make a single string from 'diffs' with appropriate delimiters
-        # for the "patch" program.
-        diffstr = ''
+        if patchFile is None:
+            out = sys.stdout
+        else:
+            out = open(patchFile, 'w')
+        try:
+            self._writePatch(out, p4, status, desc, files, diffs, prefixes)
+        finally:
+            if patchFile is not None:
+                out.close()
+
+    # The number of added files whose type, local path or content are
+    # fetched by one p4 command, and the number of these batches fetched
+    # in advance while writing a patch.
+    _genpatchBatchSize = 100
+    _genpatchAhead = 4
+
+    def _writePatch(self, out, p4, status, desc, files, diffs, prefixes):
+        """Write the 'px genpatch' patch of the given change to the file
+        object 'out' as it is made.
+
+        The diffs are written one at a time, then the added files. Their
+        types and contents are fetched by batches, a few batches ahead of
+        the writing.
+        """
+        # ViM-specific hack to have it colorize patches as diffs.
+        out.write("diff\n" + p4lib.makeForm(description=desc, files=files))
+
+        # Write 'diffs' with appropriate delimiters for the "patch"
+        # program. Like p4lib.makeForm() would, with the 'Differences'
+        # section header before the first one.
+        state = {'started': False}
+        def write(text):
+            if not state['started']:
+                out.write("Differences:\n\n")
+                state['started'] = True
+            out.write(text)
+
         timestamp = time.asctime()
         for diff in diffs:
             # Perforce std header, e.g.:
@@ -1207,14 +1288,14 @@ class PxShell(_ListCmd):
             # or
             #   ==== //depot/foo.doc#42 - c:\trentm\foo.doc ==== (binary)
             if diff.has_key('localFile'):
-                diffstr += "==== %(depotFile)s#%(rev)s - %(localFile)s ===="\
-                           % diff
+                chunk = "==== %(depotFile)s#%(rev)s - %(localFile)s ===="\
+                        % diff
                 if diff['binary']:
-                    diffstr += " (binary)"
-                diffstr += "\n"
+                    chunk += " (binary)"
+                chunk += "\n"
             else:
-                diffstr += "==== %(depotFile)s#%(rev)s (%(type)s) ====\n"\
-                           % diff
+                chunk = "==== %(depotFile)s#%(rev)s (%(type)s) ====\n"\
+                        % diff
             # Patch header, e.g. for unified diffs:
             #   Index: apps/px/test/ToDo.txt
             #   --- apps/px/test/ToDo.txt.~1~   Fri May 31 21:17:17 2002
@@ -1226,62 +1307,111 @@ class PxShell(_ListCmd):
             fname = diff['depotFile'][len('//depot/'):]
 
             if diff.has_key('text'):
-                diffstr += "Index: %s\n" % fname
-                diffstr += "%s %s.~1~\t%s\n" % (prefixes[0], fname, timestamp)
-                diffstr += "%s %s\t%s\n" % (prefixes[1], fname, timestamp)
+                chunk += "Index: %s\n" % fname
+                chunk += "%s %s.~1~\t%s\n" % (prefixes[0], fname, timestamp)
+                chunk += "%s %s\t%s\n" % (prefixes[1], fname, timestamp)
                 # The diff text.
-                diffstr += ''.join(diff['text'])
-                if diffstr[-1] != '\n':
-                    diffstr += "\n\\ No newline at end of file\n"
+                chunk += diff['text']
+                if chunk[-1] != '\n':
+                    chunk += "\n\\ No newline at end of file\n"
+            write(chunk)
 
         # Inline added files into the diff.
         addedfiles = [f for f in files if f['action'] in ('add', 'branch')]
-        for f in addedfiles:
-            # May have to get file type from 'p4 files'.
-            if status == 'submitted':
-                f['type'] = p4.files(f['depotFile'])[0]['type']
+        if status == 'submitted':
+            fetch = lambda batch: self._fetchSubmittedFiles(p4, batch)
+        else:
+            fetch = lambda batch: self._fetchPendingFiles(p4, batch)
+        pool = ThreadPool(self._genpatchAhead)
+        try:
+            for batch in _prefetch(pool, fetch,
+                                   _batches(addedfiles,
+                                            self._genpatchBatchSize),
+                                   self._genpatchAhead):
+                for f, lines in batch:
+                    write(self._inlinedFile(f, lines, prefixes, timestamp))
+        finally:
+            pool.close()
+            pool.join()
+
+        if state['started']: # std patch terminator
+            out.write("End of Patch.\n\n")
+        else:
+            out.write("Differences:\t\n\n")
+
+    def _fetchSubmittedFiles(self, p4, files):
+        """Return the (<file>, <lines>) to inline for the given files,
+        added or branched in a submitted change, with one 'p4 files' and
+        one 'p4 print'."""
+        specs = ["%s#%s" % (f['depotFile'], f['rev']) for f in files]
+        types = dict((hit['depotFile'], hit['type'])
+                     for hit in p4.files(specs))
+        textFiles = []
+        for f in files:
+            f['type'] = types[f['depotFile']]
             # Skip file if it is binary.
             if f['type'].startswith('binary'):
                 log.warn("Cannot inline '%s' because it is binary."\
                          % f['depotFile'])
                 continue
-            # Get the file contents.
-            if status == "pending":
-                # Read the file contents from disk.
-                localFile = p4.where(f['depotFile'])[0]['localFile']
-                if not os.path.exists(localFile):
-                    continue
-                lines = open(localFile, 'r').readlines()
-            else:
-                # Get the file contents via 'p4 print'.
-                fnameRev = "%s#%s" % (f['depotFile'], f['rev'])
-                lines = p4.print_(fnameRev)[0]['text'].split('\n')
-                if not lines[-1]: lines = lines[:-1] # drop empty last line
-                lines = [line+'\n' for line in lines]
-            # Inline the file.
-            diffstr += "\n==== %(depotFile)s#%(rev)s (%(type)s) ====\n" % f
-            if len(lines) < 2:
-                ln = ""
-            else:
-                ln = "," + str(len(lines))
-            fname = f['depotFile'][len('//depot/'):]
-            diffstr += "Index: %s\n" % fname
-            diffstr += "%s %s.~1~\t%s\n" % (prefixes[0], fname, timestamp)
-            diffstr += "%s %s\t%s\n" % (prefixes[1], fname, timestamp)
-            diffstr += "@@ -0,0 +1%s @@\n" % ln
-            diffstr += '+' + '+'.join(lines)
-            if diffstr[-1] != '\n':
-                diffstr += "\n\\ No newline at end of file\n"
-                
-        if diffstr: # std patch terminator
-            diffstr += "End of Patch."
-
-        patch = p4lib.makeForm(description=desc, files=files,
-                               differences=diffstr)
-        if patch: # ViM-specific hack to have it colorize patches as diffs.
-            patch = "diff\n" + patch
-
-        sys.stdout.write(patch)
+            textFiles.append(f)
+        if not textFiles:
+            return []
+
+        # Get the file contents via 'p4 print'.
+        texts = dict((hit['depotFile'], hit['text'])
+                     for hit in p4.print_(["%s#%s" % (f['depotFile'],
+                                                      f['rev'])
+                                           for f in textFiles]))
+        results = []
+        for f in textFiles:
+            lines = texts[f['depotFile']].split('\n')
+            if not lines[-1]: lines = lines[:-1] # drop empty last line
+            results.append((f, [line+'\n' for line in lines]))
+        return results
+
+    def _fetchPendingFiles(self, p4, files):
+        """Return the (<file>, <lines>) to inline for the given files,
+        opened for add or branch, with one 'p4 where'."""
+        textFiles = []
+        for f in files:
+            # Skip file if it is binary.
+            if f['type'].startswith('binary'):
+                log.warn("Cannot inline '%s' because it is binary."\
+                         % f['depotFile'])
+                continue
+            textFiles.append(f)
+        if not textFiles:
+            return []
+
+        localFiles = {}
+        for hit in p4.where([f['depotFile'] for f in textFiles]):
+            localFiles.setdefault(hit['depotFile'], hit['localFile'])
+        results = []
+        for f in textFiles:
+            # Read the file contents from disk.
+            localFile = localFiles.get(f['depotFile'])
+            if localFile is None or not os.path.exists(localFile):
+                continue
+            results.append((f, open(localFile, 'r').readlines()))
+        return results
+
+    def _inlinedFile(self, f, lines, prefixes, timestamp):
+        """Return the patch creating the given added file with 'lines'."""
+        text = "\n==== %(depotFile)s#%(rev)s (%(type)s) ====\n" % f
+        if len(lines) < 2:
+            ln = ""
+        else:
+            ln = "," + str(len(lines))
+        fname = f['depotFile'][len('//depot/'):]
+        text += "Index: %s\n" % fname
+        text += "%s %s.~1~\t%s\n" % (prefixes[0], fname, timestamp)
+        text += "%s %s\t%s\n" % (prefixes[1], fname, timestamp)
+        text += "@@ -0,0 +1%s @@\n" % ln
+        text += '+' + '+'.join(lines)
+        if text[-1] != '\n':
+            text += "\n\\ No newline at end of file\n"
+        return text
 
 
 def px(argv):
@@ -58,7 +58,7 @@ talk to a Perforce repository.
 """,
       keywords=["Perforce", "p4", "px"],
 
-      py_modules=["p4lib"],
+      py_modules=["p4lib", "p4lib_async", "p4lib_columns", "p4lib_mirror"],
       scripts=scripts,
       data_files=[ (_getBinDir(), binFiles) ],
      )
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+    Measure p4lib commands end to end (process spawn, output and parsing)
+    on the synthetic depot of the fake p4 of test/fakep4.
+
+    Usage:
+        PYTHONPATH=lib python test/benchmark/bench_fakep4.py [<files>]
+
+    The depot has <files> files (100000 by default), 1000 changes and
+    up to 4 revisions per file. Each command is run with the text output
+    and with 'p4 -G' (useMarshal=True), and the best of 3 runs is
+    reported. The results are reproducible from one run to the other
+    and need no server nor network, but the fake p4 is itself written
+    in Python: compare the two columns, and p4lib versions, rather than
+    absolute times with a real server.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import p4lib
+
+
+FAKE_P4 = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, "fakep4", "fakep4.py")
+
+COMMANDS = [
+    ('have', lambda p4: p4.have()),
+    ('opened', lambda p4: p4.opened()),
+    ('files', lambda p4: p4.files('//depot/...')),
+    ('fstat', lambda p4: p4.fstat('//depot/...')),
+    ('changes', lambda p4: p4.changes()),
+    ('filelog', lambda p4: p4.filelog('//depot/dir1/...')),
+    ('sync -n', lambda p4: p4.sync('//depot/...#1', dryrun=True)),
+    ('describe', lambda p4: p4.describe(900, shortForm=True)),
+]
+
+
+def best_time(function, *args):
+    best = None
+    for _ in range(3):
+        start = time.time()
+        function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    files = int(argv[1]) if len(argv) > 1 else 100000
+
+    os.environ.update({'FAKEP4_FILES': str(files),
+                       'FAKEP4_CHANGES': '1000', 'FAKEP4_REVS': '4'})
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fakeP4 = os.path.join(tmpdir, 'p4')
+        with open(fakeP4, 'w') as script:
+            script.write('#!/bin/sh\nexec "%s" "%s" "$@"\n'
+                         % (sys.executable, os.path.normpath(FAKE_P4)))
+        os.chmod(fakeP4, 0o755)
+        text = p4lib.P4(p4=fakeP4, dir=tmpdir)
+        marshalled = p4lib.P4(p4=fakeP4, dir=tmpdir, useMarshal=True)
+
+        print("%d files, best of 3 runs" % files)
+        print("%-10s %10s %12s %12s" % ("command", "records", "text (s)",
+                                        "marshal (s)"))
+        for name, command in COMMANDS:
+            result = command(text)
+            records = len(result) if isinstance(result, list) else 1
+            print("%-10s %10d %12.3f %12.3f"
+                  % (name, records, best_time(command, text),
+                     best_time(command, marshalled)))
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+    Compare the text and 'p4 -G' parsing paths of p4lib on large outputs.
+
+    Usage:
+        PYTHONPATH=lib python test/benchmark/bench_marshal.py [<count>]
+
+    For each command, the same <count> records (100000 by default) are
+    generated both as the text output and as the marshalled output of
+    p4, then parsed with the text parser and with the decoding of the
+    marshalled dicts. The best of 3 runs is reported. No p4 process is
+    run: only the parsing is measured.
+"""
+
+import marshal
+import sys
+import time
+
+import p4lib
+
+
+def _bytes(node):
+    # p4 marshals strings as byte strings.
+    if sys.version_info.major > 2:
+        return dict((k.encode(), v.encode()) for k, v in node.items())
+    return node
+
+
+def _marshalled(nodes):
+    return b''.join(marshal.dumps(_bytes(node), 0) for node in nodes)
+
+
+def have(count):
+    text = ''.join("//depot/dir%d/file%d.c#%d - /client/dir%d/file%d.c\n"
+                   % (i % 97, i, i % 7 + 1, i % 97, i) for i in range(count))
+    nodes = ({'code': 'stat', 'depotFile': '//depot/dir%d/file%d.c'
+              % (i % 97, i), 'clientFile': '//client/dir%d/file%d.c'
+              % (i % 97, i), 'path': '/client/dir%d/file%d.c' % (i % 97, i),
+              'haveRev': str(i % 7 + 1)} for i in range(count))
+    return (text, p4lib._have_result_cb,
+            _marshalled(nodes), p4lib._have_parse_nodes)
+
+
+def opened(count):
+    text = ''.join("//depot/dir%d/file%d.c#%d - edit change %d (text)\n"
+                   % (i % 97, i, i % 7 + 1, 1000 + i % 13)
+                   for i in range(count))
+    nodes = ({'code': 'stat', 'depotFile': '//depot/dir%d/file%d.c'
+              % (i % 97, i), 'rev': str(i % 7 + 1), 'action': 'edit',
+              'change': str(1000 + i % 13), 'type': 'text', 'user': 'user',
+              'client': 'client'} for i in range(count))
+    return (text, p4lib._opened_parse_cb,
+            _marshalled(nodes), p4lib._opened_parse_nodes)
+
+
+def changes(count):
+    text = ''.join("Change %d on 2015/03/%02d by user%d@client 'change "
+                   "number %d'\n" % (count - i, i % 28 + 1, i % 5, i)
+                   for i in range(count))
+    nodes = ({'code': 'stat', 'change': str(count - i),
+              'time': str(1425168000 + i), 'user': 'user%d' % (i % 5),
+              'client': 'client', 'status': 'submitted',
+              'desc': 'change number %d\n' % i} for i in range(count))
+    return (text, p4lib._changes_parse_cb,
+            _marshalled(nodes), p4lib._changes_parse_nodes)
+
+
+def fstat(count):
+    text = ''.join("... depotFile //depot/file%d.c\n"
+                   "... clientFile /client/file%d.c\n"
+                   "... headAction edit\n"
+                   "... headType text\n"
+                   "... headTime 1425168000\n"
+                   "... headRev %d\n"
+                   "... headChange %d\n"
+                   "... haveRev %d\n\n"
+                   % (i, i, i % 7 + 1, 1000 + i, i % 7 + 1)
+                   for i in range(count))
+    nodes = ({'code': 'stat', 'depotFile': '//depot/file%d.c' % i,
+              'clientFile': '/client/file%d.c' % i, 'headAction': 'edit',
+              'headType': 'text', 'headTime': '1425168000',
+              'headRev': str(i % 7 + 1), 'headChange': str(1000 + i),
+              'haveRev': str(i % 7 + 1)} for i in range(count))
+    return (text, p4lib._fstat_parse_cb,
+            _marshalled(nodes), p4lib._fstat_parse_nodes)
+
+
+def filelog(count):
+    # Files with 3 revisions each.
+    files = count // 3
+    text = ''.join("//depot/file%d.c\n" % i +
+                   ''.join("... #%d change %d edit on 2015/03/01 by "
+                           "user@client (text) 'change %d'\n"
+                           % (r, 1000 + i + r, r) for r in (3, 2, 1))
+                   for i in range(files))
+
+    def node(i):
+        node = {'code': 'stat', 'depotFile': '//depot/file%d.c' % i}
+        for n, r in enumerate((3, 2, 1)):
+            node.update({'rev%d' % n: str(r),
+                         'change%d' % n: str(1000 + i + r),
+                         'action%d' % n: 'edit', 'type%d' % n: 'text',
+                         'time%d' % n: '1425168000',
+                         'user%d' % n: 'user', 'client%d' % n: 'client',
+                         'desc%d' % n: 'change %d\n' % r})
+        return node
+    nodes = (node(i) for i in range(files))
+    return (text, p4lib._filelog_parse_cb,
+            _marshalled(nodes), p4lib._filelog_parse_nodes)
+
+
+def best_time(function, *args):
+    best = None
+    for _ in range(3):
+        start = time.time()
+        function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 100000
+
+    print("%d records, best of 3 runs" % count)
+    print("%-10s %12s %12s %8s" % ("command", "text (s)", "marshal (s)",
+                                   "ratio"))
+    for bench in (have, opened, changes, fstat, filelog):
+        text, text_parser, output, node_parser = bench(count)
+        text_time = best_time(text_parser, text)
+        marshal_time = best_time(
+            lambda: list(node_parser(p4lib._marshalOutputNodes(output))))
+        print("%-10s %12.3f %12.3f %8.2f"
+              % (bench.__name__, text_time, marshal_time,
+                 text_time / marshal_time))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
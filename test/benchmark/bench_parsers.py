@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+"""
+    Measure the throughput and the peak memory of p4lib's output parsers
+    on synthetic outputs of increasing size.
+
+    Usage:
+        PYTHONPATH=lib python test/benchmark/bench_parsers.py [<options>]
+
+    Options:
+        -s <sizes>      comma separated numbers of lines of the outputs,
+                        1000,10000,100000,1000000 by default (10000000
+                        needs several GB of memory)
+        -p <parsers>    comma separated parsers to run, all by default:
+                        %(parsers)s
+        -b <file>       the baseline file, baseline_parsers.json next to
+                        this script by default
+        -t <tolerance>  the fraction of throughput lost, or of peak memory
+                        gained, over the baseline reported as a
+                        regression, 0.2 by default
+        --save          write the results as the new baseline
+
+    Each parser is timed on outputs of each size (best of 3 runs, 1 run
+    from 1000000 lines), then run once more under tracemalloc (Python
+    3.4+) for its peak memory. Without --save, the results are compared
+    to the baseline, if any, and the exit status is 1 if a regression is
+    found. The baseline depends on the machine, so it is kept out of the
+    repository: save one before changing a parser, then compare.
+"""
+
+import getopt
+import json
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import p4lib
+
+
+def diff(lines):
+    # 'p4 describe' diffs of 20 lines per file.
+    chunk = ("==== //depot/dir%d/file%d.c#%d (text) ====\n\n"
+             "10,11c10,11\n< old line\n< old line\n---\n> new line\n"
+             "> new line\n" + "12a13,23\n" + "> added line\n" * 11)
+    output = ''.join(chunk % (i % 97, i, i % 7 + 1)
+                     for i in range(lines // 20))
+    return output, lambda: p4lib._parseDiffOutput(output)
+
+
+def parseForm(lines):
+    # A change form with many files.
+    output = ("Change:\tnew\n\nClient:\tclient\n\nUser:\tuser\n\n"
+              "Status:\tnew\n\nDescription:\n\tbenchmark\n\nFiles:\n" +
+              ''.join("\t//depot/dir%d/file%d.c\t# edit\n" % (i % 97, i)
+                      for i in range(lines)))
+    return output, lambda: p4lib.parseForm(output)
+
+
+def makeForm(lines):
+    files = [{'depotFile': '//depot/dir%d/file%d.c' % (i % 97, i),
+              'action': 'edit'} for i in range(lines)]
+    return None, lambda: p4lib.makeForm(change='new', client='client',
+                                        description='benchmark',
+                                        files=files)
+
+
+def fstat(lines):
+    # Blocks of 9 fields and a blank line.
+    block = ("... depotFile //depot/dir%d/file%d.c\n"
+             "... clientFile /client/dir%d/file%d.c\n"
+             "... isMapped \n"
+             "... headAction edit\n"
+             "... headType text\n"
+             "... headTime 1425168000\n"
+             "... headRev %d\n"
+             "... headChange %d\n"
+             "... haveRev %d\n\n")
+    output = ''.join(block % (i % 97, i, i % 97, i, i % 7 + 1, 1000 + i,
+                              i % 7 + 1) for i in range(lines // 10))
+    return output, lambda: p4lib._fstat_parse_cb(output)
+
+
+def fstat_fields(lines):
+    # 'fstat -T depotFile,headRev,haveRev': blocks of 3 fields and a blank
+    # line.
+    output = ''.join("... depotFile //depot/dir%d/file%d.c\n"
+                     "... headRev %d\n"
+                     "... haveRev %d\n\n"
+                     % (i % 97, i, i % 7 + 1, i % 5 + 1)
+                     for i in range(lines // 4))
+    fields = ['depotFile', 'headRev', 'haveRev']
+    return output, lambda: p4lib._fstat_parse_cb(output, fields)
+
+
+def filelog(lines):
+    # Files with 3 revisions each.
+    output = ''.join("//depot/file%d.c\n" % i +
+                     ''.join("... #%d change %d edit on 2015/03/01 by "
+                             "user@client (text) 'change %d'\n"
+                             % (r, 1000 + i + r, r) for r in (3, 2, 1))
+                     for i in range(lines // 4))
+    return output, lambda: p4lib._filelog_parse_cb(output)
+
+
+def changes(lines):
+    output = ''.join("Change %d on 2015/03/%02d by user%d@client 'change "
+                     "number %d'\n" % (lines - i, i % 28 + 1, i % 5, i)
+                     for i in range(lines))
+    return output, lambda: p4lib._changes_parse_cb(output)
+
+
+def changes_long(lines):
+    # Changes of 5 lines: header, blank, 2 description lines, blank.
+    output = ''.join("Change %d on 2015/03/%02d by user%d@client\n\n"
+                     "\tchange number %d\n\twith a second line\n\n"
+                     % (lines - i, i % 28 + 1, i % 5, i)
+                     for i in range(lines // 5))
+    return output, lambda: p4lib._changes_parse_cb(output, True)
+
+
+def opened(lines):
+    output = ''.join("//depot/dir%d/file%d.c#%d - edit change %d (text)\n"
+                     % (i % 97, i, i % 7 + 1, 1000 + i % 13)
+                     for i in range(lines))
+    return output, lambda: p4lib._opened_parse_cb(output)
+
+
+def have(lines):
+    output = ''.join("//depot/dir%d/file%d.c#%d - /client/dir%d/file%d.c\n"
+                     % (i % 97, i, i % 7 + 1, i % 97, i)
+                     for i in range(lines))
+    return output, lambda: p4lib._have_result_cb(output)
+
+
+def sync(lines):
+    output = ''.join("//depot/dir%d/file%d.c#%d - updating "
+                     "/client/dir%d/file%d.c\n"
+                     % (i % 97, i, i % 7 + 1, i % 97, i)
+                     for i in range(lines))
+    return output, lambda: p4lib._sync_parse_cb(output)
+
+
+PARSERS = [diff, parseForm, makeForm, fstat, fstat_fields, filelog, changes,
+           changes_long, opened, have, sync]
+
+__doc__ %= {'parsers': ','.join(parser.__name__ for parser in PARSERS)}
+
+
+def best_time(function, runs):
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def peak_memory(function):
+    """Return the peak memory allocated by 'function', in bytes, or None
+    without tracemalloc."""
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(parser, lines):
+    output, function = parser(lines)
+    elapsed = best_time(function, lines < 1000000 and 3 or 1)
+    return {'lines': lines,
+            'lines_per_second': lines / max(elapsed, 1e-9),
+            'megabytes_per_second': (output is not None and
+                                     len(output) / max(elapsed, 1e-9) / 1e6
+                                     or None),
+            'peak_memory': peak_memory(function)}
+
+
+def regressions(results, baseline, tolerance):
+    """Return the descriptions of the results worse than the baseline."""
+    found = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result['lines_per_second'] < \
+           base['lines_per_second'] * (1 - tolerance):
+            found.append("%s: %.0f lines/s, baseline %.0f lines/s"
+                         % (key, result['lines_per_second'],
+                            base['lines_per_second']))
+        if result['peak_memory'] and base.get('peak_memory') and \
+           result['peak_memory'] > base['peak_memory'] * (1 + tolerance):
+            found.append("%s: peak memory %d bytes, baseline %d bytes"
+                         % (key, result['peak_memory'],
+                            base['peak_memory']))
+    return found
+
+
+def main(argv):
+    try:
+        optlist, args = getopt.getopt(argv[1:], 's:p:b:t:h',
+                                      ['save', 'help'])
+    except getopt.GetoptError as ex:
+        sys.stderr.write("bench_parsers: error: %s\n" % ex)
+        return 2
+    sizes = [1000, 10000, 100000, 1000000]
+    parsers = PARSERS
+    baselineFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'baseline_parsers.json')
+    tolerance = 0.2
+    save = False
+    for opt, optarg in optlist:
+        if opt in ('-h', '--help'):
+            sys.stdout.write(__doc__)
+            return 0
+        elif opt == '-s':
+            sizes = [int(size) for size in optarg.split(',')]
+        elif opt == '-p':
+            names = optarg.split(',')
+            parsers = [parser for parser in PARSERS
+                       if parser.__name__ in names]
+        elif opt == '-b':
+            baselineFile = optarg
+        elif opt == '-t':
+            tolerance = float(optarg)
+        elif opt == '--save':
+            save = True
+
+    print("%-13s %9s %14s %10s %14s" % ("parser", "lines", "lines/s",
+                                        "MB/s", "peak memory"))
+    results = {}
+    for parser in parsers:
+        for lines in sizes:
+            result = measure(parser, lines)
+            results['%s/%d' % (parser.__name__, lines)] = result
+            print("%-13s %9d %14.0f %10s %14s"
+                  % (parser.__name__, lines, result['lines_per_second'],
+                     result['megabytes_per_second'] is not None
+                     and '%.1f' % result['megabytes_per_second'] or '-',
+                     result['peak_memory'] is not None
+                     and '%d' % result['peak_memory'] or '-'))
+
+    if save:
+        baseline = {}
+        if os.path.exists(baselineFile):
+            with open(baselineFile) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(baselineFile, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print("Baseline saved to %s" % baselineFile)
+        return 0
+
+    if not os.path.exists(baselineFile):
+        print("No baseline to compare with: run with --save first.")
+        return 0
+    with open(baselineFile) as f:
+        found = regressions(results, json.load(f), tolerance)
+    for regression in found:
+        print("REGRESSION %s" % regression)
+    if not found:
+        print("No regression over %s" % baselineFile)
+    return found and 1 or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
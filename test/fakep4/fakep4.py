@@ -0,0 +1,826 @@
+#!/usr/bin/env python
+
+"""
+    A fake 'p4' command line client, for tests that need to run real
+    processes without a Perforce server.
+
+    Usage:
+        python fakep4.py [<p4 options>] <command> [<args>]
+
+    Like 'p4', the working directory is given by the '-d' option, then
+    $PWD, then the real working directory. As a sanity check on the
+    caller, a $PWD which is not the real working directory is an error
+    (a real 'p4' would silently map files from the wrong directory).
+
+    Supported commands, with the text output or the '-G' marshalled
+    dicts of 'p4':
+        annotate [-c -i -q] file[revRange] ...
+        change -o [change]
+        changes [-i -l -m max -s status] [file[revRange] ...]
+        describe [-d<flag> -s] change ...
+        diff2 [-d<flag> -q -t] file1 file2
+        files file[revRange] ...
+        filelog [-i -l -m max] file ...
+        fstat [-C -P -T fields -F filter] file ...
+        have [file ...]
+        opened [-a -c change] [file ...]
+        print [-o localFile -q] file ...
+        sync [-f -n] [file[revRange] ...]
+        where [file ...]
+
+    The depot is computed rather than stored, so that it can be made as
+    large as needed, and is the same on every run. It is configured by
+    the environment:
+        FAKEP4_FILES    number of files (1000 by default), 100 per
+                        directory: //depot/dir<n>/file<m>.txt
+        FAKEP4_CHANGES  number of submitted changes (100 by default),
+                        rounded down to a multiple of FAKEP4_REVS
+        FAKEP4_REVS     maximum number of revisions of a file (4 by
+                        default)
+        FAKEP4_OPENED   every FAKEP4_OPENED'th file is opened for edit in
+                        the default change of the client (50 by default,
+                        0 for none)
+    Each change adds or edits the files of a slice of the depot, and
+    each revision of a file changes one line of its text. The client
+    maps //depot/... to its root, the working directory, and has the
+    head revision of every file. 'sync' reports what it would do but
+    never writes to the workspace nor changes what the client has.
+
+    'where' maps any file, in the depot or not.
+"""
+
+import os
+import re
+import sys
+import time
+import getopt
+import difflib
+import marshal
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+
+class FakeP4Error(Exception):
+    pass
+
+
+class Options:
+    def __init__(self, argv):
+        optlist, self.args = getopt.getopt(argv, 'c:d:H:p:P:u:x:Gs')
+        optd = dict(optlist)
+        self.client = optd.get('-c', os.environ.get('P4CLIENT', 'client'))
+        self.user = optd.get('-u', os.environ.get('P4USER', 'user'))
+        self.port = optd.get('-p', os.environ.get('P4PORT', 'perforce:1666'))
+        self.argfile = optd.get('-x')
+        self.marshal = '-G' in optd
+        self.cwd = optd.get('-d') or self._environmentCwd()
+
+    def _environmentCwd(self):
+        cwd = os.getcwd()
+        pwd = os.environ.get('PWD')
+        if pwd and os.path.realpath(pwd) != os.path.realpath(cwd):
+            raise FakeP4Error("$PWD (%s) is not the working directory (%s)"
+                              % (pwd, cwd))
+        return pwd or cwd
+
+
+class Output:
+    """The output of a command: text lines on stdout and messages on
+    stderr, or dicts marshalled on stdout with '-G'."""
+    # The severities of p4 messages.
+    E_WARN, E_FAILED = 2, 3
+
+    def __init__(self, opts):
+        self.marshal = opts.marshal
+        if self.marshal:
+            self.stream = getattr(sys.stdout, 'buffer', sys.stdout)
+        else:
+            self.stream = sys.stdout
+        self.failed = False
+
+    def write(self, text):
+        self.stream.write(text)
+
+    def node(self, node):
+        if sys.version_info.major > 2:
+            node = dict((key.encode('utf-8'),
+                         value.encode('utf-8')
+                         if isinstance(value, str) else value)
+                        for key, value in node.items())
+        self.stream.write(marshal.dumps(node, 0))
+
+    def message(self, text, severity=E_FAILED, fails=None):
+        """Report the warning or error 'text'. Errors, and the warnings
+        that 'fails', make p4 exit with a non-zero status, except with
+        '-G' where they are dicts."""
+        if self.marshal:
+            self.node({'code': 'error', 'data': text + '\n',
+                       'severity': severity, 'generic': 17})
+            return
+        sys.stderr.write(text + '\n')
+        if fails or (fails is None and severity >= self.E_FAILED):
+            self.failed = True
+
+
+class Depot:
+    """The synthetic depot described in the module docstring.
+
+    File <i> has 'headRev(i)' revisions. Its revision <r> is submitted in
+    change '(r - 1) * slots + i % slots + 1': each change number is a
+    slot of files (the ones with the same 'i % slots') at a revision.
+    """
+    FILES_PER_DIR = 100
+    BASE_TIME = 1400000000
+
+    def __init__(self, environ):
+        self.files = int(environ.get('FAKEP4_FILES', 1000))
+        self.revs = int(environ.get('FAKEP4_REVS', 4))
+        self.slots = max(1, int(environ.get('FAKEP4_CHANGES', 100))
+                         // self.revs)
+        self.changes = self.slots * self.revs
+        self.openedEvery = int(environ.get('FAKEP4_OPENED', 50))
+
+    def depotFile(self, i):
+        return '//depot/dir%d/file%d.txt' % (i // self.FILES_PER_DIR, i)
+
+    def headRev(self, i):
+        return 1 + (i // self.slots) % self.revs
+
+    def change(self, i, rev):
+        return (rev - 1) * self.slots + i % self.slots + 1
+
+    def action(self, rev):
+        return rev == 1 and 'add' or 'edit'
+
+    def isOpened(self, i):
+        return self.openedEvery > 0 and i % self.openedEvery == 0
+
+    def lines(self, i, rev):
+        lines = ['file%d line %d\n' % (i, n)
+                 for n in xrange(10 + i % 20)]
+        for r in xrange(2, rev + 1):
+            n = (r - 2) % len(lines)
+            lines[n] = 'file%d line %d rev %d\n' % (i, n, r)
+        return lines
+
+    def changeTime(self, change):
+        return self.BASE_TIME + change * 3600
+
+    def changeUser(self, change):
+        return 'user%d' % (change % 5)
+
+    def changeClient(self, change):
+        return 'ws%d' % (change % 3)
+
+    def changeDescription(self, change):
+        return ('Change %d of the synthetic depot\nwith a second line.\n'
+                % change)
+
+    def changeFiles(self, change, first=0, last=None):
+        """Generate the (file, rev) of 'change' among the files 'first'
+        to 'last' (excluded)."""
+        if last is None:
+            last = self.files
+        rev = (change - 1) // self.slots + 1
+        slot = (change - 1) % self.slots
+        start = first + (slot - first) % self.slots
+        for i in xrange(start, last, self.slots):
+            if self.headRev(i) >= rev:
+                yield i, rev
+
+    def pathRange(self, path):
+        """Return the (first, last) files matching the depot path 'path',
+        last excluded, or None."""
+        if path in ('//...', '//depot/...'):
+            return 0, self.files
+        match = re.match(r'^//depot/dir(\d+)/\.\.\.$', path)
+        if match:
+            first = int(match.group(1)) * self.FILES_PER_DIR
+            return (min(first, self.files),
+                    min(first + self.FILES_PER_DIR, self.files))
+        match = re.match(r'^//depot/dir(\d+)/file(\d+)\.txt$', path)
+        if match:
+            i = int(match.group(2))
+            if i < self.files \
+               and i // self.FILES_PER_DIR == int(match.group(1)):
+                return i, i + 1
+        return None
+
+    def revAt(self, i, revSpec):
+        """Return the revision of file 'i' given by 'revSpec' ('#<rev>',
+        '@<change>', '#head', '#have', '#none' or ''), 0 for none or
+        None if the file has no such revision."""
+        head = self.headRev(i)
+        if revSpec in ('', '#head', '#have'):
+            return head
+        if revSpec in ('#none', '#0'):
+            return 0
+        if revSpec.startswith('#'):
+            rev = int(revSpec[1:])
+            return rev <= head and rev or None
+        change = int(revSpec[1:])
+        if change < i % self.slots + 1:
+            return None
+        return min(head, (change - 1 - i % self.slots) // self.slots + 1)
+
+
+#---- support for the commands
+
+def _localToRelative(opts, path):
+    if path.startswith('//'):
+        return path.split('/', 3)[3]
+    path = os.path.join(opts.cwd, path)
+    return os.path.relpath(path, opts.cwd).replace(os.sep, '/')
+
+
+def _localFile(opts, depotFile):
+    # Not os.path.join(), which is slow on millions of files.
+    rel = depotFile[len('//depot/'):].replace('/', os.sep)
+    return opts.cwd.rstrip(os.sep) + os.sep + rel
+
+
+def _clientFile(opts, depotFile):
+    return '//%s/%s' % (opts.client, depotFile[len('//depot/'):])
+
+
+def _splitRevSpec(spec):
+    match = re.match(r'^(?P<path>[^#@]*)(?P<rev>[#@].*)?$', spec)
+    return match.group('path'), match.group('rev') or ''
+
+
+def _depotPath(opts, path):
+    if path.startswith('//%s/' % opts.client):
+        return '//depot/' + path.split('/', 3)[3]
+    if path.startswith('//'):
+        return path
+    return '//depot/' + _localToRelative(opts, path)
+
+
+def _checkRevSpec(spec, revSpec):
+    if revSpec and not re.match(r'^(#(\d+|head|have|none)|@\d+)$',
+                                revSpec):
+        raise FakeP4Error("%s - unsupported revision specification."
+                          % spec)
+
+
+def _specRevisions(opts, depot, spec):
+    """Generate the (file, rev) of the file specification 'spec'."""
+    path, revSpec = _splitRevSpec(spec)
+    _checkRevSpec(spec, revSpec)
+    fileRange = depot.pathRange(_depotPath(opts, path or '...'))
+    if fileRange is not None:
+        for i in xrange(*fileRange):
+            rev = depot.revAt(i, revSpec)
+            if rev:
+                yield i, rev
+
+
+def _fileRevisions(opts, depot, out, specs, noFiles="no such file(s)"):
+    """Generate the (file, rev) of the file specifications 'specs',
+    reporting the ones without files like p4: a warning, which fails
+    the text output."""
+    for spec in specs:
+        found = False
+        for i, rev in _specRevisions(opts, depot, spec):
+            found = True
+            yield i, rev
+        if not found:
+            out.message("%s - %s." % (spec, noFiles), Output.E_WARN,
+                        fails=True)
+
+
+def _date(seconds, dateFormat='%Y/%m/%d'):
+    return time.strftime(dateFormat, time.localtime(seconds))
+
+
+def _shortDescription(description):
+    return description[:31]
+
+
+def _range(first, last):
+    # Line ranges of the normal diff format, 1-based.
+    if last - first == 1:
+        return '%d' % last
+    return '%d,%d' % (first + 1, last)
+
+
+def _diff(lines1, lines2, diffFormat):
+    """Return the lines of the diff from 'lines1' to 'lines2' in the
+    p4 -d<diffFormat> format, without file headers."""
+    if diffFormat == 'u':
+        return list(difflib.unified_diff(lines1, lines2))[2:]
+    if diffFormat == 'c':
+        return list(difflib.context_diff(lines1, lines2))[2:]
+
+    opcodes = [opcode for opcode
+               in difflib.SequenceMatcher(None, lines1, lines2).get_opcodes()
+               if opcode[0] != 'equal']
+    diff = []
+    if diffFormat == 's':
+        counts = {'insert': [0, 0], 'delete': [0, 0], 'replace': [0, 0, 0]}
+        for tag, i1, i2, j1, j2 in opcodes:
+            counts[tag][0] += 1
+            if tag == 'insert':
+                counts[tag][1] += j2 - j1
+            else:
+                counts[tag][1] += i2 - i1
+            if tag == 'replace':
+                counts[tag][2] += j2 - j1
+        return ['add %d chunks %d lines\n' % tuple(counts['insert']),
+                'deleted %d chunks %d lines\n' % tuple(counts['delete']),
+                'changed %d chunks %d / %d lines\n'
+                % tuple(counts['replace'])]
+    for tag, i1, i2, j1, j2 in opcodes:
+        if diffFormat == 'n':
+            if tag in ('delete', 'replace'):
+                diff.append('d%d %d\n' % (i1 + 1, i2 - i1))
+            if tag in ('insert', 'replace'):
+                diff.append('a%d %d\n' % (i2, j2 - j1))
+                diff.extend(lines2[j1:j2])
+        elif tag == 'replace':
+            diff.append('%sc%s\n' % (_range(i1, i2), _range(j1, j2)))
+            diff.extend('< ' + line for line in lines1[i1:i2])
+            diff.append('---\n')
+            diff.extend('> ' + line for line in lines2[j1:j2])
+        elif tag == 'delete':
+            diff.append('%sd%d\n' % (_range(i1, i2), j1))
+            diff.extend('< ' + line for line in lines1[i1:i2])
+        else:
+            diff.append('%da%s\n' % (i1, _range(j1, j2)))
+            diff.extend('> ' + line for line in lines2[j1:j2])
+    return diff
+
+
+def _getopt(args, shortopts, command):
+    try:
+        optlist, args = getopt.getopt(args, shortopts)
+    except getopt.GetoptError:
+        raise FakeP4Error("Usage: %s\nInvalid option." % command)
+    return dict(optlist), args
+
+
+def _requireArgs(args):
+    if not args:
+        raise FakeP4Error("Missing/wrong number of arguments.")
+
+
+#---- the commands
+
+def do_where(opts, depot, out, args):
+    for arg in args:
+        rel = _localToRelative(opts, arg)
+        localFile = os.path.join(opts.cwd, rel)
+        if out.marshal:
+            out.node({'code': 'stat', 'depotFile': '//depot/%s' % rel,
+                      'clientFile': '//%s/%s' % (opts.client, rel),
+                      'path': localFile})
+        else:
+            out.write("//depot/%s //%s/%s %s\n"
+                      % (rel, opts.client, rel, localFile))
+
+
+def do_have(opts, depot, out, args):
+    for i, rev in _fileRevisions(opts, depot, out, args or ['//depot/...'],
+                                 "file(s) not on client"):
+        depotFile = depot.depotFile(i)
+        localFile = _localFile(opts, depotFile)
+        if out.marshal:
+            out.node({'code': 'stat', 'depotFile': depotFile,
+                      'clientFile': _clientFile(opts, depotFile),
+                      'path': localFile, 'haveRev': str(depot.headRev(i))})
+        else:
+            out.write("%s#%d - %s\n" % (depotFile, depot.headRev(i),
+                                         localFile))
+
+
+def do_opened(opts, depot, out, args):
+    optd, args = _getopt(args, 'ac:', 'opened [-a -c changelist#] [file ...]')
+    if optd.get('-c', 'default') != 'default':
+        return
+    for spec in args or ['//depot/...']:
+        found = False
+        for i, rev in _specRevisions(opts, depot, spec):
+            if not depot.isOpened(i):
+                continue
+            found = True
+            depotFile = depot.depotFile(i)
+            if out.marshal:
+                out.node({'code': 'stat', 'depotFile': depotFile,
+                          'clientFile': _clientFile(opts, depotFile),
+                          'rev': str(rev), 'haveRev': str(rev),
+                          'action': 'edit', 'change': 'default',
+                          'type': 'text', 'user': opts.user,
+                          'client': opts.client})
+            else:
+                owner = ''
+                if '-a' in optd:
+                    owner = ' by %s@%s' % (opts.user, opts.client)
+                out.write("%s#%d - edit default change (text)%s\n"
+                          % (depotFile, rev, owner))
+        if not found:
+            out.message("%s - file(s) not opened on this client." % spec,
+                        Output.E_WARN)
+
+
+def _changeRanges(opts, depot, specs):
+    """Return the (first file, last file, lowest change, highest change)
+    of the file and revision range specifications of 'p4 changes'."""
+    ranges = []
+    for spec in specs:
+        match = re.match(r'^(?P<path>[^#@]*)(@(?P<low>\d+),)?'
+                         r'(?P<high>@\d+)?$', spec)
+        if match is None:
+            raise FakeP4Error("%s - unsupported revision specification."
+                              % spec)
+        fileRange = depot.pathRange(_depotPath(opts,
+                                               match.group('path') or '...'))
+        if fileRange is None:
+            continue
+        low = int(match.group('low') or 1)
+        high = int((match.group('high') or '@%d' % depot.changes)[1:])
+        ranges.append(fileRange + (low, min(high, depot.changes)))
+    return ranges
+
+
+def do_change(opts, depot, out, args):
+    optd, args = _getopt(args, 'o', 'change -o [changelist#]')
+    if '-o' not in optd or len(args) > 1 \
+       or (args and not args[0].isdigit()):
+        raise FakeP4Error("Only 'change -o [changelist#]' is supported.")
+    if not args:
+        spec = {'Change': 'new', 'Client': opts.client, 'User': opts.user,
+                'Status': 'new', 'Description': '<enter description here>'}
+    else:
+        change = int(args[0])
+        if not 1 <= change <= depot.changes:
+            out.message("Change %d unknown." % change)
+            return
+        spec = {'Change': str(change),
+                'Date': _date(depot.changeTime(change),
+                              '%Y/%m/%d %H:%M:%S'),
+                'Client': depot.changeClient(change),
+                'User': depot.changeUser(change), 'Status': 'submitted',
+                'Description': depot.changeDescription(change).rstrip('\n')}
+
+    if out.marshal:
+        spec['code'] = 'stat'
+        out.node(spec)
+        return
+    out.write("# A Perforce Change Specification.\n\n")
+    for field in ('Change', 'Date', 'Client', 'User', 'Status'):
+        if field in spec:
+            out.write("%s:\t%s\n\n" % (field, spec[field]))
+    out.write("Description:\n%s\n"
+              % ''.join('\t' + line for line
+                        in spec['Description'].splitlines(True)))
+
+
+def do_changes(opts, depot, out, args):
+    optd, args = _getopt(args, 'ilm:s:',
+                         'changes [-i -l -m max -s status] [file ...]')
+    if optd.get('-s', 'submitted') != 'submitted':
+        return
+    maximum = int(optd.get('-m', depot.changes))
+    if args:
+        ranges = _changeRanges(opts, depot, args)
+    else:
+        ranges = [(0, depot.files, 1, depot.changes)]
+
+    count = 0
+    for change in xrange(depot.changes, 0, -1):
+        if count >= maximum:
+            break
+        for first, last, low, high in ranges:
+            if low <= change <= high \
+               and any(True for _ in depot.changeFiles(change, first, last)):
+                break
+        else:
+            continue
+        count += 1
+
+        seconds = depot.changeTime(change)
+        description = depot.changeDescription(change)
+        if '-l' not in optd:
+            description = _shortDescription(description)
+        if out.marshal:
+            out.node({'code': 'stat', 'change': str(change),
+                      'time': str(seconds), 'user': depot.changeUser(change),
+                      'client': depot.changeClient(change),
+                      'status': 'submitted', 'changeType': 'public',
+                      'path': '//depot/...', 'desc': description})
+        elif '-l' in optd:
+            out.write("Change %d on %s by %s@%s\n\n%s\n"
+                      % (change, _date(seconds), depot.changeUser(change),
+                         depot.changeClient(change),
+                         ''.join('\t' + line for line
+                                 in description.splitlines(True))))
+        else:
+            out.write("Change %d on %s by %s@%s '%s'\n"
+                      % (change, _date(seconds), depot.changeUser(change),
+                         depot.changeClient(change),
+                         description.replace('\n', ' ')))
+
+
+def do_describe(opts, depot, out, args):
+    optd, args = _getopt(args, 'd:s',
+                         'describe [-d<flag> -s] changelist# ...')
+    if not args or not all(arg.isdigit() for arg in args):
+        raise FakeP4Error("Missing/wrong number of arguments.")
+    for arg in args:
+        _describe(optd, depot, out, int(arg))
+
+
+def _describe(optd, depot, out, change):
+    if not 1 <= change <= depot.changes:
+        out.message("Change %d unknown." % change)
+        return
+
+    seconds = depot.changeTime(change)
+    files = list(depot.changeFiles(change))
+    if out.marshal:
+        node = {'code': 'stat', 'change': str(change), 'time': str(seconds),
+                'user': depot.changeUser(change),
+                'client': depot.changeClient(change),
+                'status': 'submitted', 'changeType': 'public',
+                'desc': depot.changeDescription(change)}
+        for n, (i, rev) in enumerate(files):
+            node['depotFile%d' % n] = depot.depotFile(i)
+            node['rev%d' % n] = str(rev)
+            node['action%d' % n] = depot.action(rev)
+            node['type%d' % n] = 'text'
+        out.node(node)
+        return
+
+    out.write("Change %d by %s@%s on %s\n\n"
+              % (change, depot.changeUser(change),
+                 depot.changeClient(change),
+                 _date(seconds, '%Y/%m/%d %H:%M:%S')))
+    for line in depot.changeDescription(change).splitlines(True):
+        out.write('\t' + line)
+    out.write("\nAffected files ...\n\n")
+    for i, rev in files:
+        out.write("... %s#%d %s\n" % (depot.depotFile(i), rev,
+                                     depot.action(rev)))
+    out.write("\n")
+    if '-s' in optd:
+        return
+    out.write("Differences ...\n\n")
+    for i, rev in files:
+        out.write("==== %s#%d (text) ====\n\n" % (depot.depotFile(i), rev))
+        if rev > 1:
+            out.write(''.join(_diff(depot.lines(i, rev - 1),
+                                    depot.lines(i, rev),
+                                    optd.get('-d', ''))))
+        out.write("\n")
+
+
+def _fileRecord(depot, i, rev):
+    change = depot.change(i, rev)
+    return {'depotFile': depot.depotFile(i), 'rev': str(rev),
+            'change': str(change), 'action': depot.action(rev),
+            'type': 'text', 'time': str(depot.changeTime(change))}
+
+
+def do_annotate(opts, depot, out, args):
+    # There are no integrations in the depot: -i changes nothing.
+    optd, args = _getopt(args, 'ciq', 'annotate [-c -i -q] file ...')
+    _requireArgs(args)
+    for i, rev in _fileRevisions(opts, depot, out, args):
+        lines = depot.lines(i, rev)
+        origins = [1] * len(lines)
+        for r in xrange(2, rev + 1):
+            origins[(r - 2) % len(lines)] = r
+        if '-c' in optd:
+            origins = [depot.change(i, r) for r in origins]
+        record = _fileRecord(depot, i, rev)
+        if out.marshal:
+            record['code'] = 'stat'
+            out.node(record)
+            for origin, line in zip(origins, lines):
+                out.node({'code': 'stat', 'lower': str(origin),
+                          'upper': str(origin), 'data': line})
+            continue
+        if '-q' not in optd:
+            out.write("%(depotFile)s#%(rev)s - %(action)s change "
+                      "%(change)s (%(type)s)\n" % record)
+        for origin, line in zip(origins, lines):
+            out.write("%d: %s" % (origin, line))
+
+
+def do_files(opts, depot, out, args):
+    _requireArgs(args)
+    for i, rev in _fileRevisions(opts, depot, out, args):
+        record = _fileRecord(depot, i, rev)
+        if out.marshal:
+            record['code'] = 'stat'
+            out.node(record)
+        else:
+            out.write("%(depotFile)s#%(rev)s - %(action)s change "
+                      "%(change)s (%(type)s)\n" % record)
+
+
+def do_filelog(opts, depot, out, args):
+    optd, args = _getopt(args, 'ilm:', 'filelog [-i -l -m max] file ...')
+    _requireArgs(args)
+    maximum = int(optd.get('-m', depot.revs))
+    for i, head in _fileRevisions(opts, depot, out, args):
+        depotFile = depot.depotFile(i)
+        node = {'code': 'stat', 'depotFile': depotFile}
+        if not out.marshal:
+            out.write(depotFile + '\n')
+        for n, rev in enumerate(xrange(head, max(0, head - maximum), -1)):
+            change = depot.change(i, rev)
+            description = depot.changeDescription(change)
+            if '-l' not in optd:
+                description = _shortDescription(description)
+            if out.marshal:
+                node.update({'rev%d' % n: str(rev),
+                             'change%d' % n: str(change),
+                             'action%d' % n: depot.action(rev),
+                             'type%d' % n: 'text',
+                             'time%d' % n: str(depot.changeTime(change)),
+                             'user%d' % n: depot.changeUser(change),
+                             'client%d' % n: depot.changeClient(change),
+                             'desc%d' % n: description})
+                continue
+            out.write("... #%d change %d %s on %s by %s@%s (text)"
+                      % (rev, change, depot.action(rev),
+                         _date(depot.changeTime(change)),
+                         depot.changeUser(change),
+                         depot.changeClient(change)))
+            if '-l' in optd:
+                out.write("\n\n%s\n"
+                          % ''.join('\t' + line for line
+                                    in description.splitlines(True)))
+            else:
+                out.write(" '%s'\n" % description.replace('\n', ' '))
+        if out.marshal:
+            out.node(node)
+
+
+def _fstatFilter(expression):
+    # Only a list of 'field=value', 'field' and '^field' terms, all of
+    # which must match.
+    terms = []
+    for term in expression.split():
+        negated = term.startswith('^')
+        field, _, value = term.lstrip('^').partition('=')
+        terms.append((negated, field, value))
+
+    def matches(fields):
+        for negated, field, value in terms:
+            found = field in fields and (not value or fields[field] == value)
+            if found == negated:
+                return False
+        return True
+    return matches
+
+
+def do_fstat(opts, depot, out, args):
+    optd, args = _getopt(args, 'CPT:F:',
+                         'fstat [-C -P -T fields -F filter] file ...')
+    _requireArgs(args)
+    wanted = optd.get('-T') and optd['-T'].split(',')
+    matches = _fstatFilter(optd.get('-F', ''))
+    for i, rev in _fileRevisions(opts, depot, out, args):
+        depotFile = depot.depotFile(i)
+        change = depot.change(i, rev)
+        fields = [('depotFile', depotFile),
+                  ('clientFile', _clientFile(opts, depotFile)),
+                  ('path', _localFile(opts, depotFile)),
+                  ('headAction', depot.action(rev)),
+                  ('headType', 'text'),
+                  ('headTime', str(depot.changeTime(change))),
+                  ('headRev', str(rev)),
+                  ('headChange', str(change)),
+                  ('headModTime', str(depot.changeTime(change))),
+                  ('haveRev', str(depot.headRev(i)))]
+        if depot.isOpened(i):
+            fields += [('action', 'edit'), ('change', 'default'),
+                       ('type', 'text'), ('actionOwner', opts.user)]
+        if not matches(dict(fields)):
+            continue
+        if wanted:
+            fields = [field for field in fields if field[0] in wanted]
+            if not fields:
+                continue
+        if out.marshal:
+            node = dict(fields)
+            node['code'] = 'stat'
+            out.node(node)
+        else:
+            out.write(''.join("... %s %s\n" % field for field in fields)
+                      + "\n")
+
+
+def do_print(opts, depot, out, args):
+    optd, args = _getopt(args, 'o:q', 'print [-o localFile -q] file ...')
+    _requireArgs(args)
+    for i, rev in _fileRevisions(opts, depot, out, args):
+        record = _fileRecord(depot, i, rev)
+        text = ''.join(depot.lines(i, rev))
+        if '-o' in optd:
+            with open(optd['-o'], 'w') as localFile:
+                localFile.write(text)
+        if out.marshal:
+            record.update({'code': 'stat', 'fileSize': str(len(text))})
+            out.node(record)
+            if '-o' not in optd:
+                out.node({'code': 'text', 'data': text})
+                out.node({'code': 'text', 'data': ''})
+            continue
+        if '-q' not in optd:
+            out.write("%(depotFile)s#%(rev)s - %(action)s change "
+                      "%(change)s (%(type)s)\n" % record)
+        if '-o' not in optd:
+            out.write(text)
+
+
+def do_sync(opts, depot, out, args):
+    optd, args = _getopt(args, 'fn', 'sync [-f -n] [file[revRange] ...]')
+    for spec in args or ['//depot/...']:
+        upToDate = True
+        for i, rev in _specRevisions(opts, depot, spec):
+            have = depot.headRev(i)
+            if '-f' in optd:
+                action, comment = 'refreshed', 'refreshing'
+            elif rev == have:
+                continue
+            else:
+                action, comment = 'updated', 'updating'
+            upToDate = False
+            depotFile = depot.depotFile(i)
+            localFile = _localFile(opts, depotFile)
+            if out.marshal:
+                out.node({'code': 'stat', 'depotFile': depotFile,
+                          'clientFile': localFile, 'rev': str(rev),
+                          'action': action,
+                          'fileSize': str(len(''.join(depot.lines(i, rev))))})
+            else:
+                out.write("%s#%d - %s %s\n" % (depotFile, rev, comment,
+                                               localFile))
+        if upToDate:
+            out.message("%s - file(s) up-to-date." % spec, Output.E_WARN)
+
+
+def do_diff2(opts, depot, out, args):
+    optd, args = _getopt(args, 'd:qt', 'diff2 [-d<flag> -q -t] file1 file2')
+    if len(args) != 2:
+        raise FakeP4Error("Missing/wrong number of arguments.")
+    files = []
+    for spec in args:
+        revisions = list(_fileRevisions(opts, depot, out, [spec]))
+        if len(revisions) > 1:
+            raise FakeP4Error("%s - only single files are supported."
+                              % spec)
+        files.append(revisions and revisions[0] or None)
+    if None in files:
+        return
+
+    (i1, rev1), (i2, rev2) = files
+    lines1, lines2 = depot.lines(i1, rev1), depot.lines(i2, rev2)
+    status = lines1 == lines2 and 'identical' or 'content'
+    if '-q' in optd and status == 'identical':
+        return
+    diff = ''
+    if '-q' not in optd:
+        diff = ''.join(_diff(lines1, lines2, optd.get('-d', '')))
+    if out.marshal:
+        out.node({'code': 'stat', 'status': status,
+                  'depotFile': depot.depotFile(i1), 'rev': str(rev1),
+                  'type': 'text', 'depotFile2': depot.depotFile(i2),
+                  'rev2': str(rev2), 'type2': 'text'})
+        if diff:
+            out.node({'code': 'text', 'data': diff})
+    else:
+        out.write("==== %s#%d (text) - %s#%d (text) ==== %s\n%s"
+                  % (depot.depotFile(i1), rev1, depot.depotFile(i2), rev2,
+                     status, diff))
+
+
+def main(argv):
+    try:
+        opts = Options(argv[1:])
+        if not opts.args:
+            raise FakeP4Error("missing command")
+        command, args = opts.args[0], opts.args[1:]
+        if opts.argfile:
+            with open(opts.argfile) as argfile:
+                args += [line.rstrip('\n') for line in argfile]
+        try:
+            handler = globals()['do_' + command]
+        except KeyError:
+            raise FakeP4Error("Unknown command.  Try 'p4 help' for info.")
+        out = Output(opts)
+        handler(opts, Depot(os.environ), out, args)
+    except (FakeP4Error, getopt.GetoptError) as ex:
+        sys.stderr.write("%s\n" % ex)
+        return 1
+    return out.failed and 1 or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
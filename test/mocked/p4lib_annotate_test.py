@@ -0,0 +1,207 @@
+import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import (change_stdout, marshal_output, test_options,
+                        test_raw_result)
+
+
+ANNOTATE_OUTPUT = """//depot/file.txt#3 - edit change 42 (text)
+1: first line
+3: second: line
+1: third line
+"""
+
+ANNOTATE_ALL_OUTPUT = """//depot/file.txt#3 - edit change 42 (text)
+1-3: first line
+1-2: removed line
+3-3: added line
+"""
+
+ANNOTATE_NODES = [{'code': 'stat', 'depotFile': '//depot/file.txt',
+                   'rev': '3', 'change': '42', 'action': 'edit',
+                   'type': 'text'},
+                  {'code': 'stat', 'lower': '1', 'upper': '1',
+                   'data': 'first line\n'},
+                  {'code': 'stat', 'lower': '3', 'upper': '3',
+                   'data': 'second: line\n'},
+                  {'code': 'stat', 'lower': '1', 'upper': '1',
+                   'data': 'third line\n'}]
+
+FILES_OUTPUT = "//depot/file.txt#3 - edit change 42 (text)\n"
+
+FILELOG_OUTPUT = """//depot/file.txt
+... #3 change 42 edit on 2002/05/09 by bertha@home (text) 'third'
+... #2 change 30 edit on 2002/05/08 by bertha@home (text) 'second'
+... #1 change 12 add on 2002/05/07 by bertha@home (text) 'first'
+"""
+
+REVISIONS = {1: 'first line\nsecond line\nthird line\n',
+             2: 'first line\nthird line\n',
+             3: 'zeroth line\nfirst line\nsecond: line\nthird line\n'}
+
+DIFFS = {2: '2d1\n< second line\n',
+         3: '0a1\n> zeroth line\n1a3\n> second: line\n'}
+
+
+class AnnotateTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=("", "", 0))
+
+    def test_annotate(self):
+        change_stdout(ANNOTATE_OUTPUT)
+
+        p4 = p4lib.P4()
+        result = p4.annotate("//depot/file.txt")
+
+        p4lib._run.assert_called_with(['p4', 'annotate', '//depot/file.txt'])
+        self.assertEqual([{'depotFile': '//depot/file.txt', 'rev': 3,
+                           'change': 42, 'action': 'edit', 'type': 'text',
+                           'lines': [(1, 1, 'first line\n'),
+                                     (3, 3, 'second: line\n'),
+                                     (1, 1, 'third line\n')]}], result)
+
+    def test_all_lines(self):
+        change_stdout(ANNOTATE_ALL_OUTPUT)
+
+        p4 = p4lib.P4()
+        result = p4.annotate("//depot/file.txt", changeNumbers=True,
+                             followIntegrations=True, allLines=True)
+
+        p4lib._run.assert_called_with(['p4', 'annotate', '-a', '-c', '-i',
+                                       '//depot/file.txt'])
+        self.assertEqual([(1, 3, 'first line\n'), (1, 2, 'removed line\n'),
+                          (3, 3, 'added line\n')], result[0]['lines'])
+
+    def test_form_feed_inside_a_line(self):
+        change_stdout("//depot/file.txt#3 - edit change 42 (text)\n"
+                      "1: first\fline\n"
+                      "3: second line\n")
+
+        p4 = p4lib.P4()
+        result = p4.annotate("//depot/file.txt")
+
+        self.assertEqual([(1, 1, 'first\fline\n'),
+                          (3, 3, 'second line\n')], result[0]['lines'])
+
+    def test_marshalled_output(self):
+        change_stdout(marshal_output(ANNOTATE_NODES))
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.annotate("//depot/file.txt")
+
+        p4lib._run.assert_called_with(['p4', '-G', 'annotate',
+                                       '//depot/file.txt'], marshalled=True)
+        self.assertEqual(p4lib._annotate_parse_cb(ANNOTATE_OUTPUT), result)
+
+    def test_missing_files(self):
+        p4 = p4lib.P4()
+        self.assertRaises(p4lib.P4LibError, p4.annotate, [])
+
+    def test_raw_result(self):
+        test_raw_result(self, ANNOTATE_OUTPUT, "annotate",
+                        files="//depot/file.txt")
+
+    def test_with_options(self):
+        test_options(self, "annotate", files="//depot/file.txt",
+                     expected=["annotate", "//depot/file.txt"])
+
+
+class LocalAnnotateTestCase(unittest.TestCase):
+    """Servers without 'p4 annotate'."""
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', side_effect=self.run_p4)
+        self.revisions = REVISIONS
+
+    def run_p4(self, argv, marshalled=False):
+        command = [arg for arg in argv[1:] if arg != '-G'][0]
+        if command == 'annotate':
+            raise p4lib.P4LibError("Error running '%s': error='Unknown "
+                                   "command.  Try 'p4 help' for info.\n' "
+                                   "retval='1'" % argv)
+        if command == 'files':
+            return FILES_OUTPUT, "", 0
+        if command == 'filelog':
+            return FILELOG_OUTPUT, "", 0
+        if command == 'print':
+            nodes = []
+            for spec in argv[3:]:
+                rev = int(spec.split('#')[1])
+                nodes += [{'code': 'stat', 'depotFile': '//depot/file.txt',
+                           'rev': str(rev), 'change': '1', 'action': 'edit',
+                           'type': 'text'},
+                          {'code': 'text', 'data': self.revisions[rev]},
+                          {'code': 'text', 'data': ''}]
+            return marshal_output(nodes), "", 0
+        if command == 'diff2':
+            self.assertNotIn('-q', argv)
+            rev = int(argv[-1].split('#')[1])
+            return marshal_output([{'code': 'text',
+                                    'data': DIFFS[rev]}]), "", 0
+        self.fail("unexpected command: %s" % argv)
+
+    def test_replays_the_diffs(self):
+        p4 = p4lib.P4()
+        result = p4.annotate("//depot/file.txt")
+
+        self.assertEqual([{'depotFile': '//depot/file.txt', 'rev': 3,
+                           'change': 42, 'action': 'edit', 'type': 'text',
+                           'lines': [(3, 3, 'zeroth line\n'),
+                                     (1, 1, 'first line\n'),
+                                     (3, 3, 'second: line\n'),
+                                     (1, 1, 'third line\n')]}], result)
+
+    def test_form_feed_inside_a_line(self):
+        self.revisions = dict((rev, text.replace('first line',
+                                                 'first\fline'))
+                              for rev, text in REVISIONS.items())
+
+        p4 = p4lib.P4()
+        result = p4.annotate("//depot/file.txt")
+
+        self.assertEqual([(3, 3, 'zeroth line\n'),
+                          (1, 1, 'first\fline\n'),
+                          (3, 3, 'second: line\n'),
+                          (1, 1, 'third line\n')], result[0]['lines'])
+
+    def test_change_numbers(self):
+        p4 = p4lib.P4()
+        result = p4.annotate("//depot/file.txt", changeNumbers=True)
+
+        self.assertEqual([42, 12, 42, 12],
+                         [lower for lower, upper, text
+                          in result[0]['lines']])
+
+    def test_unsupported_options(self):
+        p4 = p4lib.P4()
+        self.assertRaises(p4lib.P4LibError, p4.annotate,
+                          "//depot/file.txt", allLines=True)
+
+
+class AnnotateRunsTestCase(unittest.TestCase):
+    def runs(self, runs, diff, origin):
+        return p4lib._annotateRuns(runs, p4lib._diffHunks(diff), origin)
+
+    def test_change_splits_a_run(self):
+        self.assertEqual([[1, 1], [2, 2], [2, 1]],
+                         self.runs([[4, 1]], '2c2,3\n< a\n---\n> b\n> c\n',
+                                   2))
+
+    def test_added_lines_merge_with_runs_of_the_same_origin(self):
+        self.assertEqual([[5, 2]],
+                         self.runs([[2, 2], [1, 1], [1, 2]],
+                                   '3c3,4\n< a\n---\n> b\n> c\n', 2))
+
+    def test_deletions_and_additions(self):
+        self.assertEqual([[1, 3], [3, 1], [1, 3], [1, 1]],
+                         self.runs([[6, 1]],
+                                   '0a1\n> a\n3,4d3\n< b\n< c\n'
+                                   '5a5\n> d\n', 3))
+
+    def test_form_feed_inside_a_line(self):
+        # Only '\n' ends the added line: 'd2 1' is not an RCS command.
+        self.assertEqual([[1, 1], [1, 2], [2, 1]],
+                         self.runs([[3, 1]], 'a1 1\nx\fd2 1\n', 2))
+
+    def test_hunks_beyond_the_end(self):
+        self.assertRaises(p4lib.P4LibError, self.runs, [[2, 1]],
+                          '5d4\n< a\n', 2)
@@ -0,0 +1,136 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import real_run, fake_p4_executable, marshal_output
+
+
+FILE = '//depot/dir0/file30.txt'
+
+
+class AnnotateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_entries_are_kept_per_server_and_numbering(self):
+        cache = p4lib.AnnotateCache(self.tmpdir)
+        entry = {'depotFile': FILE, 'rev': 2, 'runs': [[3, 1], [1, 2]]}
+        cache.put('perforce:1666', FILE, 2, False, entry)
+
+        self.assertEqual(entry, cache.get('perforce:1666', FILE, 2, False))
+        self.assertEqual(None, cache.get('perforce:1666', FILE, 2, True))
+        self.assertEqual(None, cache.get('other:1666', FILE, 2, False))
+        self.assertEqual({'hits': 1, 'misses': 2, 'stores': 1,
+                          'evictions': 0}, cache.stats())
+
+    def test_corrupted_entries_are_misses(self):
+        cache = p4lib.AnnotateCache(self.tmpdir)
+        cache.put('perforce:1666', FILE, 2, False, {'runs': []})
+        directory = os.path.join(self.tmpdir, 'annotate')
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(b'garbage')
+
+        self.assertEqual(None, cache.get('perforce:1666', FILE, 2, False))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = p4lib.AnnotateCache(self.tmpdir, maxSize=2000)
+        for rev in range(1, 101):
+            cache.put('perforce:1666', FILE, rev, False,
+                      {'runs': [[rev, r] for r in range(rev % 10)]})
+
+        self.assertTrue(cache.stats()['evictions'] > 0)
+        self.assertTrue(cache.get('perforce:1666', FILE, 100, False))
+
+
+class CachedAnnotationTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', side_effect=self.run_p4)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_p4(self, argv, marshalled=False):
+        if 'files' in argv:
+            return "%s#2 - edit change 5 (text)\n" % FILE, "", 0
+        if 'print' in argv:
+            return marshal_output([{'code': 'stat', 'depotFile': FILE,
+                                    'rev': '2', 'change': '5',
+                                    'action': 'edit', 'type': 'text'},
+                                   {'code': 'text', 'data': 'a\fb\nc\n'},
+                                   {'code': 'text', 'data': ''}]), "", 0
+        self.fail("unexpected command: %s" % argv)
+
+    def test_form_feed_inside_a_line(self):
+        p4 = p4lib.P4(port='perforce:1666', annotateCache=self.tmpdir)
+        p4.annotateCache.put('perforce:1666', FILE, 2, False,
+                             {'runs': [[1, 1], [1, 2]]})
+
+        result = p4.annotate(FILE)
+
+        self.assertEqual([(1, 1, 'a\fb\n'), (2, 2, 'c\n')],
+                         result[0]['lines'])
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "needs a /bin/sh script")
+class AnnotateWithCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = real_run
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+        self.p4path = fake_p4_executable(self.tmpdir, files=300, changes=40,
+                                         revs=4)
+        self.cacheDir = os.path.join(self.tmpdir, 'cache')
+        self.uncached = p4lib.P4(p4=self.p4path, dir=self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def p4(self):
+        return p4lib.P4(p4=self.p4path, dir=self.tmpdir, instrument=True,
+                        annotateCache=self.cacheDir)
+
+    def runs(self, p4):
+        return dict((command, stats['runs'])
+                    for command, stats in p4.stats().items())
+
+    def test_cached_revisions_are_not_annotated_again(self):
+        p4 = self.p4()
+        first = p4.annotate(FILE + '#3')
+        self.assertEqual(1, self.runs(p4)['annotate'])
+
+        p4 = self.p4()
+        second = p4.annotate(FILE + '#3')
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.uncached.annotate(FILE + '#3'), second)
+        self.assertEqual({'files': 1, 'print': 1}, self.runs(p4))
+        self.assertEqual(1, p4.annotateCache.stats()['hits'])
+
+    def test_next_revision_only_takes_a_diff(self):
+        for changeNumbers in (False, True):
+            p4 = self.p4()
+            p4.annotate(FILE + '#3', changeNumbers=changeNumbers)
+
+            p4 = self.p4()
+            result = p4.annotate(FILE, changeNumbers=changeNumbers)
+
+            self.assertEqual(4, result[0]['rev'])
+            self.assertEqual(self.uncached.annotate(
+                FILE, changeNumbers=changeNumbers), result)
+            self.assertEqual({'files': 1, 'diff2': 1, 'print': 1},
+                             self.runs(p4))
+
+    def test_other_options_are_not_cached(self):
+        p4 = self.p4()
+        p4.annotate(FILE, followIntegrations=True)
+        p4.annotate(FILE, followIntegrations=True)
+
+        self.assertEqual(2, self.runs(p4)['annotate'])
+        self.assertEqual(0, p4.annotateCache.stats()['stores'])
@@ -0,0 +1,157 @@
+import marshal
+import sys
+import unittest
+
+if sys.version_info < (3, 8):
+    raise unittest.SkipTest("AsyncP4 tests need Python 3.8 (AsyncMock)")
+
+import asyncio
+from unittest.mock import AsyncMock
+import p4lib
+import p4lib_async
+
+
+CHANGES_OUTPUT = """Change 2 on 2002/05/08 by bertha@bertha-home 'second change'
+Change 1 on 2002/05/07 by bertha@bertha-home 'first change'
+"""
+
+HAVE_OUTPUT = "//depot/file.cpp#4 - /client/file.cpp\n"
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class AsyncP4TestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib_async._run = AsyncMock(return_value=("", "", 0))
+
+    def change_stdout(self, stdout):
+        p4lib_async._run.return_value = (stdout, "", 0)
+
+    def test_rejects_invalid_max_concurrency(self):
+        self.assertRaises(p4lib.P4LibError, p4lib_async.AsyncP4,
+                          maxConcurrency=0)
+
+    def test_changes(self):
+        self.change_stdout(CHANGES_OUTPUT)
+
+        p4 = p4lib_async.AsyncP4()
+        result = run(p4.changes(maximum=2))
+
+        p4lib_async._run.assert_awaited_with(['p4', 'changes', '-m', '2'],
+                                             cwd=None, marshalled=False)
+        self.assertEqual(2, len(result))
+        self.assertEqual(2, result[0]['change'])
+        self.assertEqual('second change', result[0]['description'])
+
+    def test_have(self):
+        self.change_stdout(HAVE_OUTPUT)
+
+        p4 = p4lib_async.AsyncP4()
+        result = run(p4.have("file.cpp"))
+
+        p4lib_async._run.assert_awaited_with(['p4', 'have', 'file.cpp'],
+                                             cwd=None, marshalled=False)
+        self.assertEqual([{'depotFile': '//depot/file.cpp', 'rev': 4,
+                           'localFile': '/client/file.cpp'}], result)
+
+    def test_uses_p4_options(self):
+        p4 = p4lib_async.AsyncP4(client='client')
+        run(p4.opened(user='other'))
+
+        argv = p4lib_async._run.await_args[0][0]
+        self.assertEqual('p4', argv[0])
+        self.assertEqual(['opened'], argv[-1:])
+        self.assertEqual({'-c': 'client', '-u': 'other'},
+                         dict(zip(argv[1:-1:2], argv[2:-1:2])))
+        self.assertEqual({'client': 'client'}, p4.optd)
+
+    def test_raw_result(self):
+        self.change_stdout(HAVE_OUTPUT)
+
+        p4 = p4lib_async.AsyncP4()
+        result = run(p4.where("file.cpp", _raw=True))
+
+        self.assertEqual({'stdout': HAVE_OUTPUT, 'stderr': '', 'retval': 0},
+                         result)
+
+    def test_fstat_fields_and_filter(self):
+        self.change_stdout("... depotFile //depot/file.cpp\n"
+                           "... headRev 4\n\n")
+
+        p4 = p4lib_async.AsyncP4()
+        result = run(p4.fstat("file.cpp", fields=['depotFile', 'headRev'],
+                              filterExpression='haveRev ^action'))
+
+        p4lib_async._run.assert_awaited_with(
+            ['p4', 'fstat', '-C', '-P', '-T', 'depotFile,headRev',
+             '-F', 'haveRev ^action', 'file.cpp'],
+            cwd=None, marshalled=False)
+        self.assertEqual([{'depotFile': '//depot/file.cpp', 'headRev': 4}],
+                         result)
+
+    def test_fstat_raw_result(self):
+        self.change_stdout("... depotFile //depot/file.cpp\n\n")
+
+        p4 = p4lib_async.AsyncP4()
+        result = run(p4.fstat("file.cpp", _raw=True))
+
+        self.assertEqual({'stdout': "... depotFile //depot/file.cpp\n\n",
+                          'stderr': '', 'retval': 0}, result)
+
+    def test_opened_files_are_run_by_sets(self):
+        p4 = p4lib_async.AsyncP4()
+        files = ["//depot/file%d.cpp" % i for i in range(25)]
+        run(p4.opened(files))
+
+        self.assertEqual(3, p4lib_async._run.await_count)
+        p4lib_async._run.assert_any_await(['p4', 'opened'] + files[20:],
+                                          cwd=None, marshalled=False)
+
+    def test_concurrency_is_limited(self):
+        state = {'running': 0, 'max': 0}
+
+        async def slow_run(argv, cwd=None, marshalled=False):
+            state['running'] += 1
+            state['max'] = max(state['max'], state['running'])
+            await asyncio.sleep(0.01)
+            state['running'] -= 1
+            return HAVE_OUTPUT, "", 0
+        p4lib_async._run.side_effect = slow_run
+
+        async def many_queries(p4):
+            return await asyncio.gather(*[p4.have("file%d" % i)
+                                          for i in range(20)])
+
+        p4 = p4lib_async.AsyncP4(maxConcurrency=3)
+        results = run(many_queries(p4))
+
+        self.assertEqual(20, len(results))
+        self.assertEqual(3, state['max'])
+
+    def test_print_decodes_marshalled_output(self):
+        nodes = [{b'code': b'stat', b'depotFile': b'//depot/file.txt',
+                  b'rev': b'3', b'change': b'42', b'action': b'edit',
+                  b'type': b'text'},
+                 {b'code': b'text', b'data': b'hello\n'},
+                 {b'code': b'text', b'data': b'world\n'},
+                 {b'code': b'text', b'data': b''}]
+        output = b''.join(marshal.dumps(node, 0) for node in nodes)
+        self.change_stdout(output)
+
+        p4 = p4lib_async.AsyncP4()
+        result = run(p4.print_("//depot/file.txt"))
+
+        p4lib_async._run.assert_awaited_with(
+            ['p4', '-G', 'print', '//depot/file.txt'],
+            cwd=None, marshalled=True)
+        self.assertEqual([{'depotFile': '//depot/file.txt', 'rev': 3,
+                           'change': 42, 'action': 'edit', 'type': 'text',
+                           'text': 'hello\nworld\n'}], result)
+
+    def test_errors_are_raised(self):
+        p4lib_async._run.side_effect = p4lib.P4LibError("error")
+
+        p4 = p4lib_async.AsyncP4()
+        self.assertRaises(p4lib.P4LibError, run, p4.have())
@@ -0,0 +1,163 @@
+import threading
+import time
+import unittest
+import p4lib
+from mock23 import Mock
+
+
+OPENED_OUTPUT = "//depot/file%d.cpp#1 - edit default change (text)\n"
+
+
+def opened_output(count):
+    return ''.join(OPENED_OUTPUT % i for i in range(count))
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=("", "", 0))
+        self.files = ["//depot/file%d.cpp" % i for i in range(25)]
+
+    def test_rejects_unknown_batch_mode(self):
+        self.assertRaises(p4lib.P4LibError, p4lib.P4, batchMode='other')
+
+    def test_chunks_mode_spawns_a_single_process(self):
+        p4 = p4lib.P4()
+        p4.opened(self.files)
+
+        self.assertEqual(1, p4lib._run.call_count)
+        p4lib._run.assert_called_with(['p4', 'opened'] + self.files)
+        self.assertEqual(1, p4.batchStats['spawns'])
+        self.assertEqual(25, p4.batchStats['files'])
+        self.assertEqual(1, p4.batchStats['runs'])
+
+    def test_workers_share_chunks_of_ten_files(self):
+        p4 = p4lib.P4(maxWorkers=2)
+        p4.opened(self.files)
+
+        self.assertEqual(3, p4lib._run.call_count)
+        self.assertEqual(sorted([['p4', 'opened'] + self.files[i:i + 10]
+                                 for i in (0, 10, 20)]),
+                         sorted(call[0][0]
+                                for call in p4lib._run.call_args_list))
+        self.assertEqual(3, p4.batchStats['spawns'])
+
+    def test_argfile_mode_spawns_a_single_process(self):
+        argfiles = []
+
+        def run(argv):
+            self.assertEqual(['p4', '-x'], argv[:2])
+            self.assertEqual(['opened', '-a'], argv[3:])
+            with open(argv[2]) as argfile:
+                argfiles.append(argfile.read())
+            return opened_output(25), "", 0
+        p4lib._run.side_effect = run
+
+        p4 = p4lib.P4(batchMode='argfile')
+        result = p4.opened(self.files, allClients=True)
+
+        self.assertEqual(1, p4lib._run.call_count)
+        self.assertEqual([''.join(f + '\n' for f in self.files)], argfiles)
+        self.assertEqual(25, len(result))
+        self.assertEqual("//depot/file24.cpp", result[24]['depotFile'])
+        self.assertEqual(1, p4.batchStats['spawns'])
+
+    def test_argfile_mode_uses_p4_options(self):
+        p4 = p4lib.P4(batchMode='argfile', user='other')
+        p4.sync(self.files)
+
+        argv = p4lib._run.call_args[0][0]
+        self.assertEqual(['p4', '-u', 'other', '-x'], argv[:4])
+        self.assertEqual(['sync'], argv[5:])
+
+    def test_argfile_mode_without_files_runs_command(self):
+        p4 = p4lib.P4(batchMode='argfile')
+        p4.opened()
+
+        p4lib._run.assert_called_with(['p4', 'opened'])
+
+    def test_argfile_is_removed(self):
+        p4 = p4lib.P4(batchMode='argfile')
+        p4.resolve(self.files)
+
+        argfile = p4lib._run.call_args[0][0][2]
+        self.assertFalse(p4lib.os.path.exists(argfile))
+
+    def test_raw_result(self):
+        p4lib._run.return_value = (opened_output(25), "", 0)
+
+        p4 = p4lib.P4(batchMode='argfile')
+        raw_result = p4.opened(self.files, _raw=True)
+
+        self.assertEqual(opened_output(25), raw_result['stdout'])
+        self.assertEqual(0, raw_result['retval'])
+
+
+class ParallelBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=("", "", 0))
+        self.files = ["//depot/file%d.cpp" % i for i in range(50)]
+
+    def run_in_reverse_order(self, argv):
+        # The first chunks are the slowest ones to check that the
+        # outputs are merged back in order.
+        files = [a for a in argv if a.startswith("//")]
+        index = int(files[0][len("//depot/file"):-len(".cpp")])
+        time.sleep((50 - index) / 5000.0)
+        with self.lock:
+            self.threads.add(threading.current_thread())
+        return ''.join(OPENED_OUTPUT % int(f[len("//depot/file"):-4])
+                       for f in files), "", 0
+
+    def test_rejects_invalid_max_workers(self):
+        self.assertRaises(p4lib.P4LibError, p4lib.P4, maxWorkers=0)
+        self.assertRaises(p4lib.P4LibError, p4lib.P4, maxWorkers="2")
+
+    def test_chunks_run_in_worker_threads_in_order(self):
+        self.lock = threading.Lock()
+        self.threads = set()
+        p4lib._run.side_effect = self.run_in_reverse_order
+
+        p4 = p4lib.P4(maxWorkers=4)
+        result = p4.opened(self.files)
+
+        self.assertEqual(5, p4lib._run.call_count)
+        self.assertTrue(len(self.threads) > 1)
+        self.assertEqual(self.files, [f['depotFile'] for f in result])
+
+    def test_argfile_mode_uses_one_argfile_per_worker(self):
+        argfiles = []
+
+        def run(argv):
+            with open(argv[2]) as argfile:
+                argfiles.append(argfile.read().split())
+            return "", "", 0
+        p4lib._run.side_effect = run
+
+        p4 = p4lib.P4(batchMode='argfile', maxWorkers=3)
+        p4.sync(self.files)
+
+        self.assertEqual(3, p4lib._run.call_count)
+        self.assertEqual(3, p4.batchStats['spawns'])
+        self.assertEqual(sorted(self.files),
+                         sorted(f for files in argfiles for f in files))
+
+    def test_have_is_batched(self):
+        p4 = p4lib.P4(maxWorkers=2)
+        p4.have(self.files)
+
+        self.assertEqual(5, p4lib._run.call_count)
+        p4lib._run.assert_any_call(['p4', 'have'] + self.files[:10])
+
+    def test_fstat_is_batched(self):
+        p4 = p4lib.P4(maxWorkers=2)
+        p4.fstat(self.files)
+
+        self.assertEqual(5, p4lib._run.call_count)
+        p4lib._run.assert_any_call(['p4', 'fstat', '-C', '-P'] +
+                                   self.files[40:])
+
+    def test_errors_in_workers_are_raised(self):
+        p4lib._run.side_effect = p4lib.P4LibError("error")
+
+        p4 = p4lib.P4(maxWorkers=2)
+        self.assertRaises(p4lib.P4LibError, p4.opened, self.files)
@@ -0,0 +1,190 @@
+import time
+import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import change_stdout
+
+
+WHERE_OUTPUT = "//depot/foo.txt //client/foo.txt /client/foo.txt\n"
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=("", "", 0))
+
+    def test_is_disabled_by_default(self):
+        p4 = p4lib.P4()
+        p4.where("foo.txt")
+        p4.where("foo.txt")
+
+        self.assertIsNone(p4.cache)
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_repeated_command_is_run_once(self):
+        change_stdout(WHERE_OUTPUT)
+
+        p4 = p4lib.P4(cache=True)
+        first = p4.where("foo.txt")
+        second = p4.where("foo.txt")
+
+        self.assertEqual(1, p4lib._run.call_count)
+        self.assertEqual(first, second)
+        stats = p4.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['entries'])
+        self.assertEqual({'where': {'hits': 1, 'misses': 1}},
+                         stats['commands'])
+
+    def test_results_are_not_shared(self):
+        change_stdout(WHERE_OUTPUT)
+
+        p4 = p4lib.P4(cache=True)
+        p4.where("foo.txt")[0]['localFile'] = 'changed'
+
+        self.assertEqual('/client/foo.txt',
+                         p4.where("foo.txt")[0]['localFile'])
+
+    def test_key_includes_arguments_and_p4_options(self):
+        p4 = p4lib.P4(cache=True)
+        p4.where("foo.txt")
+        p4.where("bar.txt")
+        p4.where("foo.txt", client='other')
+        p4.where("foo.txt", _raw=True)
+
+        self.assertEqual(3, p4lib._run.call_count)
+
+    def test_argfile_batch_mode_is_cached_by_files(self):
+        files = ["//depot/file%d.cpp" % i for i in range(25)]
+
+        p4 = p4lib.P4(cache=True, batchMode='argfile')
+        p4.have(files)
+        p4.have(files)
+        p4.have(files[1:])
+
+        self.assertEqual(2, p4lib._run.call_count)
+        self.assertEqual(1, p4.cache.stats()['hits'])
+
+    def test_uncached_commands_are_always_run(self):
+        p4 = p4lib.P4(cache=True)
+        p4.files("//depot/...")
+        p4.files("//depot/...")
+
+        self.assertEqual(2, p4lib._run.call_count)
+        self.assertEqual(0, p4.cache.stats()['misses'])
+
+    def test_entries_expire(self):
+        p4 = p4lib.P4(cache=p4lib.ResultCache(ttls={'have': 0.05}))
+        p4.have()
+        p4.have()
+        time.sleep(0.06)
+        p4.have()
+
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_zero_ttl_disables_a_command(self):
+        p4 = p4lib.P4(cache=p4lib.ResultCache(ttls={'have': 0}))
+        p4.have()
+        p4.have()
+
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        p4 = p4lib.P4(cache=p4lib.ResultCache(maxEntries=2))
+        p4.where("a")
+        p4.where("b")
+        p4.where("a")
+        p4.where("c")  # evicts "b"
+        p4.where("a")
+        p4.where("b")
+
+        self.assertEqual(4, p4lib._run.call_count)
+        self.assertEqual(2, p4.cache.stats()['evictions'])
+
+    def test_edit_invalidates_opened_only(self):
+        p4 = p4lib.P4(cache=True)
+        p4.opened()
+        p4.where("foo.txt")
+        p4.edit("foo.txt")
+        p4.opened()
+        p4.where("foo.txt")
+
+        self.assertEqual(4, p4lib._run.call_count)
+        self.assertEqual(1, p4.cache.stats()['invalidations'])
+
+    def test_dry_run_sync_does_not_invalidate(self):
+        p4 = p4lib.P4(cache=True)
+        p4.have()
+        p4.sync(dryrun=True)
+        p4.have()
+        p4.sync()
+        p4.have()
+
+        self.assertEqual(4, p4lib._run.call_count)
+        p4lib._run.assert_called_with(['p4', 'have'])
+
+    def test_client_form_is_cached_until_modified(self):
+        change_stdout("Client: client\n\nHost: host\n")
+
+        p4 = p4lib.P4(cache=True)
+        p4.client(name='client')
+        p4.client(name='client')
+        self.assertEqual(1, p4lib._run.call_count)
+
+        change_stdout("Client client deleted.\n")
+        p4.client(name='client', delete=True)
+        p4.client(name='client', delete=True)
+        self.assertEqual(3, p4lib._run.call_count)
+
+        change_stdout("Client: client\n\nHost: host\n")
+        p4.client(name='client')
+        self.assertEqual(4, p4lib._run.call_count)
+
+    def test_errors_are_not_cached(self):
+        p4lib._run.side_effect = p4lib.P4LibError("error")
+
+        p4 = p4lib.P4(cache=True)
+        self.assertRaises(p4lib.P4LibError, p4.have)
+        self.assertRaises(p4lib.P4LibError, p4.have)
+
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_output_of_command_running_during_invalidation_is_dropped(self):
+        cache = p4lib.ResultCache()
+        p4 = p4lib.P4(cache=cache)
+
+        def run(argv):
+            cache.invalidate(['edit', 'foo.txt'])
+            return "", "", 0
+        p4lib._run.side_effect = run
+        p4.opened()
+        p4lib._run.side_effect = None
+        p4.opened()
+
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_cache_can_be_shared(self):
+        cache = p4lib.ResultCache()
+        p4lib.P4(cache=cache).changes()
+        p4lib.P4(cache=cache).changes()
+
+        self.assertEqual(1, p4lib._run.call_count)
+
+    def test_iter_sync_invalidates(self):
+        p4lib._stream = Mock(spec='p4lib._stream',
+                             side_effect=lambda argv: (line for line in []))
+
+        p4 = p4lib.P4(cache=True)
+        p4.have()
+        list(p4.iter_sync())
+        p4.have()
+
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_clear(self):
+        p4 = p4lib.P4(cache=True)
+        p4.where("foo.txt")
+        p4.cache.clear()
+        p4.where("foo.txt")
+
+        self.assertEqual(2, p4lib._run.call_count)
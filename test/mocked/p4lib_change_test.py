@@ -1,7 +1,7 @@
 import unittest
 import p4lib
 from mock23 import Mock
-from test_utils import change_stdout, change_stdout_list
+from test_utils import change_stdout, change_stdout_list, marshal_output
 from test_utils import test_options, test_raw_result
 
 
@@ -201,3 +201,65 @@ class ChangeTestCase(unittest.TestCase):
         change_stdout(CHANGE_DELETED)
         test_options(self, "change", change=1234, delete=True,
                      expected=["change", "-d", "1234"])
+
+
+class ChangeStatusTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=("", "", 0))
+
+    def test_pending_change(self):
+        change_stdout(CHANGE_INFORMATION)
+
+        p4 = p4lib.P4()
+
+        self.assertEqual("pending", p4.change_status(1234))
+        p4lib._run.assert_called_with(['p4', 'change', '-o', '1234'])
+
+    def test_default_change_is_not_queried(self):
+        p4 = p4lib.P4()
+
+        self.assertEqual("pending", p4.change_status("Default"))
+        self.assertFalse(p4lib._run.called)
+
+    def test_submitted_changes_are_queried_once(self):
+        change_stdout(CHANGE_INFORMATION.replace("pending", "submitted"))
+
+        p4 = p4lib.P4()
+
+        self.assertEqual("submitted", p4.change_status(1234))
+        self.assertEqual("submitted", p4.change_status("1234"))
+        self.assertEqual(1, p4lib._run.call_count)
+        self.assertEqual("submitted", p4.change_status(1234,
+                                                       port="other:1666"))
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_marshalled_output(self):
+        change_stdout(marshal_output([{'code': 'stat', 'Change': '1234',
+                                       'Status': 'pending'}]))
+
+        p4 = p4lib.P4(useMarshal=True)
+
+        self.assertEqual("pending", p4.change_status(1234))
+        p4lib._run.assert_called_with(['p4', '-G', 'change', '-o', '1234'],
+                                      marshalled=True)
+
+    def test_unknown_change(self):
+        p4lib._run.side_effect = p4lib.P4LibError(
+            "Error running '...': error='Change 1234 unknown.\n' "
+            "retval='1'")
+
+        p4 = p4lib.P4()
+
+        self.assertEqual(None, p4.change_status(1234))
+
+    def test_other_errors_are_raised(self):
+        p4lib._run.side_effect = p4lib.P4LibError("Connect to server failed")
+
+        p4 = p4lib.P4()
+
+        self.assertRaises(p4lib.P4LibError, p4.change_status, 1234)
+
+    def test_invalid_change(self):
+        p4 = p4lib.P4()
+
+        self.assertRaises(p4lib.P4LibError, p4.change_status, "latest")
@@ -142,3 +142,59 @@ class ChangesTestCase(unittest.TestCase):
 
     def test_with_options(self):
         test_options(self, "changes", expected=["changes"])
+
+
+class PagedChangesTestCase(unittest.TestCase):
+    """iter_changes() with 'pageSize', on a depot of changes 1 to 5."""
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', side_effect=self.run_p4)
+
+    def run_p4(self, argv):
+        maximum = int(argv[argv.index('-m') + 1])
+        spec = argv[-1]
+        last = int(spec.split('@')[1]) if '@' in spec else 5
+        return ''.join("Change %d on 2002/05/08 by bertha@home 'change'\n"
+                       % change
+                       for change in range(last, 0, -1)[:maximum]), "", 0
+
+    def argvs(self):
+        return [call[0][0] for call in p4lib._run.call_args_list]
+
+    def test_pages(self):
+        p4 = p4lib.P4()
+        changes = list(p4.iter_changes("//depot/...", pageSize=2))
+
+        self.assertEqual([5, 4, 3, 2, 1], [c['change'] for c in changes])
+        self.assertEqual([['p4', 'changes', '-m', '2', '-s', 'submitted',
+                           '//depot/...'],
+                          ['p4', 'changes', '-m', '2', '-s', 'submitted',
+                           '//depot/...@3'],
+                          ['p4', 'changes', '-m', '2', '-s', 'submitted',
+                           '//depot/...@1']], self.argvs())
+
+    def test_pages_are_fetched_as_needed(self):
+        p4 = p4lib.P4()
+        changes = p4.iter_changes(pageSize=2, prefetch=True)
+
+        self.assertEqual(5, next(changes)['change'])
+        self.assertEqual(4, next(changes)['change'])
+        changes.close()
+        self.assertEqual('//...', self.argvs()[0][-1])
+        self.assertTrue(len(self.argvs()) <= 2)
+
+    def test_maximum(self):
+        p4 = p4lib.P4()
+        changes = list(p4.iter_changes(maximum=3, pageSize=2))
+
+        self.assertEqual([5, 4, 3], [c['change'] for c in changes])
+        self.assertEqual(['2', '1'], [argv[3] for argv in self.argvs()])
+
+    def test_invalid_arguments(self):
+        p4 = p4lib.P4()
+
+        self.assertRaises(p4lib.P4LibError, p4.iter_changes, pageSize=0)
+        self.assertRaises(p4lib.P4LibError, p4.iter_changes, pageSize=2,
+                          status='pending')
+        self.assertRaises(p4lib.P4LibError, p4.iter_changes,
+                          "//depot/...@2", pageSize=2)
+        self.assertFalse(p4lib._run.called)
@@ -0,0 +1,122 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import p4lib
+import p4lib_columns
+from test_utils import real_run, real_stream, fake_p4_executable
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+SCHEMA = [('change', 'int'), ('user', 'code'), ('description', 'text')]
+
+ROWS = [(3, 'bertha', 'third'),
+        (2, 'trent', 'second'),
+        (1, 'bertha', 'first')]
+
+
+class ColumnsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.columns = p4lib_columns.Columns(SCHEMA)
+        for row in ROWS:
+            self.columns.append(row)
+
+    def test_columns(self):
+        self.assertEqual(3, len(self.columns))
+        self.assertEqual([3, 2, 1], list(self.columns['change']))
+        self.assertEqual([0, 1, 0], list(self.columns['user']))
+        self.assertEqual(['bertha', 'trent', 'bertha'],
+                         self.columns.values('user'))
+        self.assertEqual(['third', 'second', 'first'],
+                         self.columns['description'])
+        self.assertEqual(1, self.columns.code('user', 'trent'))
+        self.assertEqual(None, self.columns.code('user', 'nobody'))
+        self.assertEqual({'change': 2, 'user': 'trent',
+                          'description': 'second'}, self.columns.row(1))
+
+    def test_errors(self):
+        self.assertRaises(p4lib.P4LibError, lambda: self.columns['nope'])
+        self.assertRaises(p4lib.P4LibError, self.columns.code, 'change', 3)
+
+    def test_filter(self):
+        self.assertEqual([3, 1], list(self.columns.filter(
+            user='bertha')['change']))
+        self.assertEqual([2], list(self.columns.filter(
+            user=lambda user: user.startswith('t'))['change']))
+        self.assertEqual([3], list(self.columns.filter(
+            user=['bertha', 'nobody'], change=lambda c: c > 1)['change']))
+        self.assertEqual([2, 1], list(self.columns.filter(
+            change=(1, 2))['change']))
+        self.assertEqual(0, len(self.columns.filter(user='nobody')))
+
+    def test_group_by(self):
+        self.assertEqual({'bertha': 2, 'trent': 1},
+                         self.columns.groupBy('user'))
+        self.assertEqual({'bertha': 4, 'trent': 2},
+                         self.columns.groupBy('user', 'change', sum))
+        self.assertEqual({3: ['bertha'], 2: ['trent'], 1: ['bertha']},
+                         self.columns.groupBy('change', 'user', list))
+
+    @unittest.skipIf(numpy is None, "needs NumPy")
+    def test_numpy(self):
+        self.assertEqual([3, 2, 1], self.columns.numpy('change').tolist())
+        self.assertEqual(6, self.columns.numpy('change').sum())
+
+    @unittest.skipIf(numpy is not None, "needs NumPy not to be installed")
+    def test_numpy_is_optional(self):
+        self.assertRaises(p4lib.P4LibError, self.columns.numpy, 'change')
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "needs a /bin/sh script")
+class CommandColumnsTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = real_run
+        p4lib._stream = real_stream
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+        self.p4 = p4lib.P4(p4=fake_p4_executable(self.tmpdir, files=300,
+                                                 changes=40, revs=4,
+                                                 opened=25),
+                           dir=self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_changes(self):
+        columns = p4lib_columns.changes(self.p4, maximum=10)
+        changes = self.p4.changes(maximum=10)
+
+        self.assertEqual([c['change'] for c in changes],
+                         list(columns['change']))
+        self.assertEqual([c['user'] for c in changes], columns.values('user'))
+        self.assertEqual([c['date'] for c in changes],
+                         [time.strftime('%Y/%m/%d', time.localtime(t))
+                          for t in columns['time']])
+
+    def test_filelog(self):
+        columns = p4lib_columns.filelog(self.p4, '//depot/dir0/...')
+        hits = self.p4.filelog('//depot/dir0/...')
+
+        self.assertEqual(sum(len(hit['revs']) for hit in hits), len(columns))
+        self.assertEqual(dict((hit['depotFile'], len(hit['revs']))
+                              for hit in hits),
+                         columns.groupBy('depotFile'))
+        self.assertEqual(dict((hit['depotFile'], hit['revs'][0]['rev'])
+                              for hit in hits),
+                         columns.groupBy('depotFile', 'rev', max))
+
+    def test_fstat(self):
+        columns = p4lib_columns.fstat(self.p4, '//depot/dir0/...',
+                                      filterExpression='action')
+        hits = self.p4.fstat('//depot/dir0/...', filterExpression='action')
+
+        self.assertEqual([hit['depotFile'] for hit in hits],
+                         columns['depotFile'])
+        self.assertEqual([hit['headRev'] for hit in hits],
+                         list(columns['headRev']))
+        self.assertEqual(['edit'], list(columns.groupBy('action')))
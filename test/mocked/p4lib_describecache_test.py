@@ -0,0 +1,126 @@
+import shutil
+import tempfile
+import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import change_stdout, marshal_output
+
+
+SUBMITTED_OUTPUT = """Change 1234 by someuser@someclient on 2014/11/01 10:00:00
+
+\tSome changelist description
+
+Affected files ...
+
+... //depot/file.cpp#3 edit
+
+Differences ...
+
+==== //depot/file.cpp#3 (text) ====
+
+@@ -1 +1 @@
+-old
++new
+
+"""
+
+PENDING_OUTPUT = """Change 1235 by someuser@someclient on 2014/11/02 10:00:00 *pending*
+
+\tSome pending description
+
+Affected files ...
+
+... //depot/file.cpp#3 edit
+
+"""
+
+
+def describe_node(status):
+    return {'code': 'stat', 'change': '1234', 'time': '1414836000',
+            'user': 'someuser', 'client': 'someclient', 'status': status,
+            'desc': 'Some changelist description\n',
+            'depotFile0': '//depot/file.cpp', 'rev0': '3',
+            'action0': 'edit', 'type0': 'text'}
+
+
+class DescribeCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=("", "", 0))
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_submitted_change_is_described_once(self):
+        change_stdout(SUBMITTED_OUTPUT)
+
+        p4 = p4lib.P4(describeCache=self.tmpdir)
+        first = p4.describe(1234, diffFormat='u')
+        second = p4.describe(1234, diffFormat='u')
+
+        self.assertEqual(1, p4lib._run.call_count)
+        self.assertEqual(first, second)
+        self.assertEqual('//depot/file.cpp', second['diff'][0]['depotFile'])
+        self.assertEqual({'hits': 1, 'misses': 1, 'stores': 1,
+                          'evictions': 0}, p4.describeCache.stats())
+
+    def test_cache_is_shared_between_instances(self):
+        change_stdout(SUBMITTED_OUTPUT)
+
+        first = p4lib.P4(describeCache=self.tmpdir).describe(1234)
+        second = p4lib.P4(describeCache=self.tmpdir).describe(1234)
+
+        self.assertEqual(1, p4lib._run.call_count)
+        self.assertEqual(first, second)
+
+    def test_key_includes_diff_format_form_and_port(self):
+        def run(argv):
+            if '-s' in argv:
+                return SUBMITTED_OUTPUT.split("Differences")[0], "", 0
+            return SUBMITTED_OUTPUT, "", 0
+        p4lib._run.side_effect = run
+
+        p4 = p4lib.P4(describeCache=self.tmpdir)
+        p4.describe(1234)
+        p4.describe(1234, diffFormat='u')
+        p4.describe(1234, shortForm=True)
+        p4.describe(1234, port='other:1666')
+
+        self.assertEqual(4, p4lib._run.call_count)
+
+    def test_pending_change_is_not_cached(self):
+        change_stdout(PENDING_OUTPUT)
+
+        p4 = p4lib.P4(describeCache=self.tmpdir)
+        result = p4.describe(1235)
+        p4.describe(1235)
+
+        self.assertEqual(2, p4lib._run.call_count)
+        self.assertEqual(1235, result['change'])
+        self.assertEqual('2014/11/02 10:00:00', result['date'])
+        self.assertEqual([], result['diff'])
+        self.assertEqual(0, p4.describeCache.stats()['stores'])
+
+    def test_raw_result_is_not_cached(self):
+        change_stdout(SUBMITTED_OUTPUT)
+
+        p4 = p4lib.P4(describeCache=self.tmpdir)
+        p4.describe(1234, _raw=True)
+        p4.describe(1234, _raw=True)
+
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_marshalled_short_form(self):
+        p4lib._run.return_value = (marshal_output([describe_node('pending')]),
+                                   "", 0)
+        p4 = p4lib.P4(useMarshal=True, describeCache=self.tmpdir)
+        p4.describe(1234, shortForm=True)
+        self.assertEqual(0, p4.describeCache.stats()['stores'])
+
+        p4lib._run.return_value = (
+            marshal_output([describe_node('submitted')]), "", 0)
+        first = p4.describe(1234, shortForm=True)
+        second = p4.describe(1234, shortForm=True)
+
+        self.assertEqual(2, p4lib._run.call_count)
+        self.assertEqual(first, second)
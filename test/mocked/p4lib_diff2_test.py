@@ -1,15 +1,116 @@
+import threading
+import time
 import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import change_stdout, marshal_output
 
 
-""" diff2 implementation is using popen3 and marshalling.
+DIFF2_NODES = [{'code': 'stat', 'status': 'content',
+                'depotFile': '//depot/file.txt', 'rev': '1', 'type': 'text',
+                'depotFile2': '//depot/file.txt', 'rev2': '2',
+                'type2': 'text'},
+               {'code': 'text', 'data': '1c1\n'},
+               {'code': 'text', 'data': '< hello\n---\n> world\n'}]
 
-It's complicated to mock and uses a marshalling version.
-
-Probably needs to reimplement it with the -s option (see source code)
-"""
+DIFF2_INFO_NODES = [{'code': 'info', 'level': 0,
+                     'data': '==== //depot/file.txt#1 (text) - '
+                             '//depot/file.txt#2 (text) ==== content'},
+                    {'code': 'text', 'data': '1c1\n'}]
 
 
 class Diff2TestCase(unittest.TestCase):
-    @unittest.skip("Reimplement diff2")
-    def test_no_test(self):
-        pass
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=(b"", "", 0))
+
+    def test_diff2(self):
+        change_stdout(marshal_output(DIFF2_NODES))
+
+        p4 = p4lib.P4()
+        result = p4.diff2("//depot/file.txt#1", "//depot/file.txt#2")
+
+        p4lib._run.assert_called_with(['p4', '-G', 'diff2', '-q',
+                                       '//depot/file.txt#1',
+                                       '//depot/file.txt#2'],
+                                      marshalled=True)
+        self.assertEqual({'depotFile1': '//depot/file.txt', 'rev1': 1,
+                          'type1': 'text',
+                          'depotFile2': '//depot/file.txt', 'rev2': 2,
+                          'type2': 'text', 'summary': 'content',
+                          'text': '1c1\n< hello\n---\n> world\n'}, result)
+
+    def test_diff2_info_header(self):
+        change_stdout(marshal_output(DIFF2_INFO_NODES))
+
+        p4 = p4lib.P4()
+        result = p4.diff2("//depot/file.txt#1", "//depot/file.txt#2",
+                          quiet=False, diffFormat='u')
+
+        p4lib._run.assert_called_with(['p4', '-G', 'diff2', '-du',
+                                       '//depot/file.txt#1',
+                                       '//depot/file.txt#2'],
+                                      marshalled=True)
+        self.assertEqual(1, result['rev1'])
+        self.assertEqual(2, result['rev2'])
+        self.assertEqual('content', result['summary'])
+        self.assertEqual('1c1\n', result['text'])
+
+    def test_identical_files(self):
+        p4 = p4lib.P4()
+        result = p4.diff2("//depot/file.txt#2", "//depot/file.txt#2")
+
+        self.assertEqual({}, result)
+
+    def test_wrong_diff_format(self):
+        p4 = p4lib.P4()
+        self.assertRaises(p4lib.P4LibError, p4.diff2, "file1", "file2",
+                          diffFormat='x')
+
+
+class Diff2ManyTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', side_effect=self.run_diff2)
+        self.lock = threading.Lock()
+        self.threads = set()
+        self.pairs = [("//depot/file.txt#%d" % (i - 1),
+                       "//depot/file.txt#%d" % i) for i in range(2, 22)]
+
+    def run_diff2(self, argv, marshalled=False):
+        # The first diffs are the slowest ones to check that the results
+        # are in the order of the pairs.
+        rev = int(argv[-1].split('#')[1])
+        time.sleep((22 - rev) / 5000.0)
+        with self.lock:
+            self.threads.add(threading.current_thread())
+        return marshal_output([{'code': 'text',
+                                'data': '%dc%d\n' % (rev, rev)}]), "", 0
+
+    def test_results_are_in_order(self):
+        p4 = p4lib.P4()
+        results = p4.diff2_many(self.pairs, maxWorkers=4)
+
+        self.assertEqual(20, p4lib._run.call_count)
+        self.assertTrue(len(self.threads) > 1)
+        self.assertEqual(['%dc%d\n' % (i, i) for i in range(2, 22)],
+                         [result['text'] for result in results])
+        p4lib._run.assert_any_call(['p4', '-G', 'diff2', '-q',
+                                    '//depot/file.txt#1',
+                                    '//depot/file.txt#2'], marshalled=True)
+
+    def test_defaults_to_instance_max_workers(self):
+        p4 = p4lib.P4()
+        results = p4.diff2_many(self.pairs[:3], diffFormat='u')
+
+        self.assertEqual(1, len(self.threads))
+        self.assertEqual(3, len(results))
+        self.assertEqual(['p4', '-G', 'diff2', '-du', '-q'],
+                         p4lib._run.call_args[0][0][:5])
+
+    def test_invalid_arguments(self):
+        p4 = p4lib.P4()
+
+        self.assertRaises(p4lib.P4LibError, p4.diff2_many, self.pairs,
+                          maxWorkers=0)
+        self.assertRaises(p4lib.P4LibError, p4.diff2_many, self.pairs,
+                          diffFormat='z')
+        self.assertFalse(p4lib._run.called)
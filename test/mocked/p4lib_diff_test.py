@@ -9,6 +9,57 @@ diffline_1
 diffline_2
 """
 
+DIFF_FILES_OUTPUT = """==== //depot/a.py#3 - /home/mokona/a.py ====
+@@ -1,3 +1,4 @@
+ line_1
+-line_2
++line_2bis
++line_3bis
+ line_4
+@@ -10 +11,0 @@
+-line_10
+==== //depot/b.doc#2 - /home/mokona/b.doc ==== (binary)
+(... files differ ...)
+==== //depot/c.py#1 - /home/mokona/c.py ====
+"""
+
+NORMAL_DIFF_TEXT = """2c2,3
+< line_2
+---
+> line_2bis
+> line_3bis
+10d10
+< line_10
+12a14
+> line_12bis
+"""
+
+CONTEXT_DIFF_TEXT = """***************
+*** 1,3 ****
+  line_1
+! line_2
+  line_4
+--- 1,4 ----
+  line_1
+! line_2bis
+! line_3bis
++ line_4bis
+"""
+
+RCS_DIFF_TEXT = """d2 1
+a2 2
+d5 3
+a8 4
+d3 1
+line
+"""
+
+
+def hunk(oldStart, oldLines, newStart, newLines, added, removed):
+    return {'oldStart': oldStart, 'oldLines': oldLines,
+            'newStart': newStart, 'newLines': newLines,
+            'added': added, 'removed': removed}
+
 
 class DiffTestCase(unittest.TestCase):
     def setUp(self):
@@ -105,3 +156,62 @@ class DiffTestCase(unittest.TestCase):
     def test_with_options(self):
         test_options(self, "diff", files="//depot/file.py",
                      expected=["diff", "//depot/file.py"])
+
+    def test_several_files(self):
+        change_stdout(DIFF_FILES_OUTPUT)
+
+        p4 = p4lib.P4()
+
+        result = p4.diff("//depot/...")
+
+        self.assertEqual(['//depot/a.py', '//depot/b.doc', '//depot/c.py'],
+                         [hit['depotFile'] for hit in result])
+        self.assertEqual(DIFF_FILES_OUTPUT.split('\n', 1)[1].split('====')[0],
+                         result[0]['text'])
+        self.assertEqual(["(... files differ ...)\n"], result[1]['notes'])
+        self.assertTrue(result[1]['binary'])
+        self.assertNotIn('text', result[1])
+        self.assertNotIn('text', result[2])
+
+    def test_unified_hunks(self):
+        change_stdout(DIFF_FILES_OUTPUT)
+
+        p4 = p4lib.P4()
+
+        result = p4.diff("//depot/...", diffFormat='u', hunks=True)
+
+        self.assertEqual([hunk(1, 3, 1, 4, 2, 1), hunk(10, 1, 11, 0, 0, 1)],
+                         result[0]['hunks'])
+        self.assertEqual([], result[1]['hunks'])
+
+    def test_normal_hunks(self):
+        hits = p4lib._parseDiffOutput(DIFF_OUTPUT + NORMAL_DIFF_TEXT,
+                                      hunks=True)
+
+        self.assertEqual([hunk(2, 1, 2, 2, 2, 1), hunk(10, 1, 10, 0, 0, 1),
+                          hunk(12, 0, 14, 1, 1, 0)], hits[0]['hunks'])
+
+    def test_context_hunks(self):
+        hits = p4lib._parseDiffOutput(DIFF_OUTPUT + CONTEXT_DIFF_TEXT,
+                                      hunks=True)
+
+        self.assertEqual([hunk(1, 3, 1, 4, 3, 1)], hits[0]['hunks'])
+
+    def test_rcs_hunks_skip_added_lines(self):
+        hits = p4lib._parseDiffOutput(DIFF_OUTPUT + RCS_DIFF_TEXT,
+                                      hunks=True)
+
+        self.assertEqual([hunk(2, 1, 1, 0, 0, 1), hunk(2, 0, 2, 2, 2, 0),
+                          hunk(3, 1, 3, 0, 0, 1)], hits[0]['hunks'])
+
+    def test_iter_diff(self):
+        p4lib._stream = Mock(spec='p4lib._stream', return_value=(
+            line for line in DIFF_FILES_OUTPUT.splitlines(True)))
+
+        p4 = p4lib.P4()
+
+        result = list(p4.iter_diff("//depot/...", diffFormat='u'))
+
+        p4lib._stream.assert_called_with(['p4', 'diff', '-du',
+                                          '//depot/...'])
+        self.assertEqual(p4lib._parseDiffOutput(DIFF_FILES_OUTPUT), result)
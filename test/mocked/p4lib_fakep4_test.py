@@ -0,0 +1,211 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import p4lib
+from test_utils import real_run, real_stream, fake_p4_executable
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "needs a /bin/sh script")
+class FakeP4TestCase(unittest.TestCase):
+    """Run p4lib on the synthetic depot of the fake p4, checking that the
+    text and the 'p4 -G' outputs give the same results."""
+    def setUp(self):
+        p4lib._run = real_run
+        p4lib._stream = real_stream
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+        p4 = fake_p4_executable(self.tmpdir, files=300, changes=40, revs=4,
+                                opened=25)
+        self.p4 = p4lib.P4(p4=p4, dir=self.tmpdir)
+        self.p4G = p4lib.P4(p4=p4, dir=self.tmpdir, useMarshal=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameResults(self, method, *args, **kwargs):
+        result = getattr(self.p4, method)(*args, **kwargs)
+        self.assertEqual(result, getattr(self.p4G, method)(*args, **kwargs))
+        return result
+
+    def test_have(self):
+        result = self.assertSameResults('have')
+
+        self.assertEqual(300, len(result))
+        self.assertEqual({'depotFile': '//depot/dir1/file150.txt', 'rev': 4,
+                          'localFile': os.path.join(self.tmpdir, 'dir1',
+                                                    'file150.txt')},
+                         result[150])
+
+    def test_opened(self):
+        result = self.assertSameResults('opened', '//depot/dir0/...')
+
+        self.assertEqual(['//depot/dir0/file%d.txt' % i
+                          for i in (0, 25, 50, 75)],
+                         [f['depotFile'] for f in result])
+        self.assertEqual('default', result[0]['change'])
+
+    def test_changes(self):
+        result = self.assertSameResults('changes', maximum=5)
+        self.assertEqual([40, 39, 38, 37, 36], [c['change'] for c in result])
+
+        result = self.assertSameResults('changes', '//depot/dir0/file3.txt',
+                                        longOutput=True)
+        self.assertEqual([4], [c['change'] for c in result])
+        self.assertEqual('Change 4 of the synthetic depot\n'
+                         'with a second line.\n', result[0]['description'])
+
+    def test_paged_changes(self):
+        for p4 in (self.p4, self.p4G):
+            for prefetch in (False, True):
+                self.assertEqual(p4.changes('//depot/dir0/...'),
+                                 list(p4.iter_changes('//depot/dir0/...',
+                                                      pageSize=3,
+                                                      prefetch=prefetch)))
+        self.assertEqual(self.p4.changes(maximum=7),
+                         list(self.p4.iter_changes(maximum=7, pageSize=3)))
+
+    def test_change_status(self):
+        self.assertEqual('submitted',
+                         self.assertSameResults('change_status', 40))
+        self.assertEqual(None, self.assertSameResults('change_status', 41))
+
+    def test_describe(self):
+        result = self.assertSameResults('describe', 5, shortForm=True)
+
+        self.assertEqual(5, result['change'])
+        self.assertTrue(result['files'])
+        self.assertEqual(['add'], list(set(f['action']
+                                           for f in result['files'])))
+
+        result = self.p4.describe(15, diffFormat='u')
+        self.assertEqual(len(result['files']), len(result['diff']))
+        self.assertIn('+file', result['diff'][0]['text'])
+
+    def test_iter_describe_diff(self):
+        for diffFormat in ('', 'n', 'c', 's', 'u'):
+            self.assertEqual(
+                self.p4.describe(15, diffFormat=diffFormat)['diff'],
+                list(self.p4.iter_describe_diff(15, diffFormat=diffFormat)))
+
+        hits = list(self.p4.iter_describe_diff(15, diffFormat='u',
+                                               hunks=True))
+        self.assertTrue(hits[0]['hunks'])
+        self.assertEqual(hits[0]['text'].count('\n+'),
+                         sum(h['added'] for h in hits[0]['hunks']))
+
+    def test_files(self):
+        result = self.assertSameResults('files', '//depot/dir2/...')
+
+        self.assertEqual(100, len(result))
+
+    def test_filelog(self):
+        result = self.assertSameResults('filelog', '//depot/dir0/file30.txt',
+                                        longOutput=True)
+
+        self.assertEqual([4, 3, 2, 1], [r['rev'] for r in result[0]['revs']])
+        self.assertEqual('add', result[0]['revs'][3]['action'])
+
+    def test_fstat(self):
+        result = self.assertSameResults('fstat', '//depot/dir0/file50.txt')
+
+        self.assertEqual(2, result[0]['headRev'])
+        self.assertEqual('edit', result[0]['action'])
+
+    def test_fstat_fields(self):
+        fields = ['depotFile', 'headRev', 'haveRev', 'action']
+        result = self.assertSameResults('fstat', '//depot/dir0/...',
+                                        fields=fields,
+                                        filterExpression='action')
+
+        self.assertEqual(['//depot/dir0/file%d.txt' % i
+                          for i in (0, 25, 50, 75)],
+                         [hit['depotFile'] for hit in result])
+        full = self.p4.fstat([hit['depotFile'] for hit in result])
+        self.assertEqual([dict((key, hit[key]) for key in fields)
+                          for hit in full], result)
+        self.assertEqual(result,
+                         list(self.p4.iter_fstat('//depot/dir0/...',
+                                                 fields=fields,
+                                                 filterExpression='action')))
+        self.assertEqual(result,
+                         list(self.p4G.iter_fstat('//depot/dir0/...',
+                                                  fields=fields,
+                                                  filterExpression='action')))
+
+    def test_sync(self):
+        self.assertEqual([], self.assertSameResults('sync'))
+
+        result = self.assertSameResults('sync', '//depot/dir0/...#1')
+        self.assertEqual(70, len(result))
+        self.assertTrue(result[0]['comment'].startswith('updating '))
+
+    def test_annotate(self):
+        result = self.assertSameResults('annotate', '//depot/dir0/file30.txt')
+
+        self.assertEqual(4, result[0]['rev'])
+        self.assertEqual(self.p4.print_('//depot/dir0/file30.txt')[0]['text'],
+                         ''.join(text for _, _, text in result[0]['lines']))
+        self.assertEqual([1, 2, 3, 4], sorted(set(
+            lower for lower, upper, text in result[0]['lines'])))
+
+    def test_local_annotate_matches_the_server(self):
+        for spec in ('//depot/dir0/file30.txt', '//depot/dir1/file105.txt#2'):
+            for changeNumbers in (False, True):
+                hit = self.p4.files(spec)[0]
+                self.assertEqual(
+                    self.p4.annotate(spec, changeNumbers=changeNumbers),
+                    [self.p4._annotate_locally(hit, changeNumbers, {})])
+
+    def test_print_streams_to_files(self):
+        printed = self.p4.print_('//depot/dir1/...')
+        paths = []
+
+        def target(hit):
+            paths.append(os.path.join(self.tmpdir, 'out%d' % len(paths)))
+            return paths[-1]
+
+        hits = self.p4.print_('//depot/dir1/...', output=target)
+
+        self.assertEqual(len(printed), len(paths))
+        self.assertEqual([dict(hit, text=None) for hit in printed],
+                         [dict(hit, text=None) for hit in hits])
+        for path, hit in zip(paths, printed):
+            with open(path, 'rb') as f:
+                self.assertEqual(hit['text'].encode('utf-8'), f.read())
+
+    def test_print_and_diff2(self):
+        text1 = self.p4.print_('//depot/dir0/file30.txt#1')[0]['text']
+        text2 = self.p4.print_('//depot/dir0/file30.txt#2')[0]['text']
+        self.assertEqual(len(text1.splitlines()), len(text2.splitlines()))
+
+        result = self.p4.diff2('//depot/dir0/file30.txt#1',
+                               '//depot/dir0/file30.txt#2', quiet=False)
+        self.assertEqual('content', result['summary'])
+        self.assertTrue(result['text'].startswith('1c1\n'))
+
+    def test_missing_file_is_an_error(self):
+        self.assertRaises(p4lib.P4LibError, self.p4.files, '//depot/nope')
+        self.assertEqual([], self.p4G.files('//depot/nope'))
+
+    def test_compact_records(self):
+        for p4 in (self.p4, self.p4G):
+            compact = p4lib.P4(p4=p4.p4, dir=self.tmpdir,
+                               useMarshal=p4.useMarshal, compactRecords=True)
+            for method, args in (('have', ()), ('where', ('//depot/...',)),
+                                 ('opened', ()), ('files', ('//depot/...',)),
+                                 ('changes', ()),
+                                 ('filelog', ('//depot/dir1/...',)),
+                                 ('fstat', ('//depot/dir2/...',))):
+                result = getattr(compact, method)(*args)
+                record = result[0].get('revs', [result[0]])[0]
+                self.assertTrue(isinstance(record, p4lib._Record))
+                self.assertEqual(getattr(p4, method)(*args), result)
+                if method != 'where':
+                    self.assertEqual(result, list(getattr(
+                        compact, 'iter_' + method)(*args)))
+
+    def test_iterators(self):
+        self.assertEqual(self.p4.have(), list(self.p4G.iter_have()))
+        self.assertEqual(self.p4.fstat('//depot/dir1/...'),
+                         list(self.p4.iter_fstat('//depot/dir1/...')))
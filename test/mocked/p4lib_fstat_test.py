@@ -1,7 +1,11 @@
+import os
+import shutil
+import sys
+import tempfile
 import unittest
 import p4lib
 from mock23 import Mock
-from test_utils import change_stdout
+from test_utils import change_stdout, marshal_output, real_run, real_stream
 from test_utils import test_options, test_raw_result
 
 
@@ -31,6 +35,15 @@ FSTAT_OUTPUT = """... clientFile /client/file1.cpp
 
 """
 
+FSTAT_FIELDS_OUTPUT = """... depotFile //depot/file 1.cpp
+... headRev 2
+... haveRev 1
+
+... depotFile //depot/file2.cpp
+... headRev 3
+
+"""
+
 
 class FStatTestCase(unittest.TestCase):
     def setUp(self):
@@ -93,6 +106,39 @@ class FStatTestCase(unittest.TestCase):
 
         self.assertEqual(expected2, result[1])
 
+    def test_fields_and_filter(self):
+        change_stdout(FSTAT_FIELDS_OUTPUT)
+
+        result = self.p4.fstat("//depot/...",
+                               fields=['depotFile', 'headRev', 'haveRev'],
+                               filterExpression='headRev>1')
+
+        p4lib._run.assert_called_with(['p4', 'fstat', '-C', '-P', '-T',
+                                       'depotFile,headRev,haveRev', '-F',
+                                       'headRev>1', '//depot/...'])
+        self.assertEqual([{'depotFile': '//depot/file 1.cpp', 'headRev': 2,
+                           'haveRev': 1},
+                          {'depotFile': '//depot/file2.cpp', 'headRev': 3,
+                           'haveRev': 0}], result)
+
+    def test_fields_of_marshalled_output(self):
+        change_stdout(marshal_output([{'code': 'stat',
+                                       'depotFile': '//depot/file2.cpp',
+                                       'headRev': '3', 'ourLock': ''}]))
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.fstat("//depot/...",
+                          fields=['depotFile', 'headRev', 'ourLock'])
+
+        self.assertEqual([{'depotFile': '//depot/file2.cpp', 'headRev': 3,
+                           'ourLock': 1}], result)
+
+    def test_fields_must_be_a_list(self):
+        self.assertRaises(p4lib.P4LibError, self.p4.fstat, "//depot/...",
+                          fields='headRev')
+        self.assertRaises(p4lib.P4LibError, self.p4.fstat, "//depot/...",
+                          fields=[])
+
     def test_raw_result(self):
         p4 = p4lib.P4()
 
@@ -111,3 +157,32 @@ class FStatTestCase(unittest.TestCase):
     def test_with_options(self):
         test_options(self, "fstat", files="/depot/test.txt",
                      expected=["fstat", "-C", "-P", "/depot/test.txt"])
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "needs a /bin/sh script")
+class FilterArgumentsTestCase(unittest.TestCase):
+    """The arguments reach p4 as given, spaces included."""
+    def setUp(self):
+        p4lib._run = real_run
+        p4lib._stream = real_stream
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, "p4")
+        with open(self.script, "w") as script:
+            script.write('#!/bin/sh\nprintf "%s\\n" "$@"\n')
+        os.chmod(self.script, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_filter_with_a_space(self):
+        p4 = p4lib.P4(p4=self.script)
+        hits, raw = p4.fstat("//depot/...",
+                             filterExpression='haveRev ^action', _raw=True)
+
+        self.assertEqual(['fstat', '-C', '-P', '-F', 'haveRev ^action',
+                          '//depot/...'], raw['stdout'].splitlines())
+
+    def test_streamed_arguments(self):
+        lines = p4lib._stream([self.script, '-F', 'haveRev ^action'])
+
+        self.assertEqual(['-F\n', 'haveRev ^action\n'], list(lines))
@@ -0,0 +1,287 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import (real_run, real_stream, real_writeTemporaryForm,
+                        real_removeTemporaryForm)
+
+
+HAVE_OUTPUT = "//depot/file%d.cpp#4 - /client/file%d.cpp\n"
+
+CHANGES_LONG_OUTPUT = """Change 2 on 2002/05/08 by bertha@bertha-home
+
+\tsecond change
+\ton two lines
+
+Change 1 on 2002/05/07 by bertha@bertha-home
+
+\tfirst change
+
+"""
+
+FILELOG_OUTPUT = """//depot/foo.txt
+... #2 change 12 edit on 2002/05/08 by bertha@bertha-home (text) 'fix'
+... ... copy into //depot/bar.txt#1
+... #1 change 10 add on 2002/05/07 by bertha@bertha-home (text) 'add'
+//depot/bar.txt
+... #1 change 13 branch on 2002/05/09 by bertha@bertha-home (text) 'copy'
+"""
+
+SYNC_OUTPUT = """//depot/foo.txt#2 - updating /client/foo.txt
+... //depot/foo.txt - must resolve #2 before submitting
+//depot/bar.txt#1 - added as /client/bar.txt
+"""
+
+FSTAT_OUTPUT = """... depotFile //depot/foo.txt
+... clientFile /client/foo.txt
+... headRev 2
+
+... depotFile //depot/bar.txt
+... headRev 1
+
+"""
+
+
+def have_output(count):
+    return ''.join(HAVE_OUTPUT % (i, i) for i in range(count))
+
+
+class IterTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._writeTemporaryForm = real_writeTemporaryForm
+        p4lib._removeTemporaryForm = real_removeTemporaryForm
+        self.closed = []
+        p4lib._stream = Mock(spec='p4lib._stream',
+                             side_effect=self.stream_of(""))
+
+    def stream_of(self, output):
+        def stream(argv, cwd=None):
+            try:
+                for line in output.splitlines(True):
+                    yield line
+            finally:
+                self.closed.append(argv)
+        return stream
+
+    def change_stdout(self, output):
+        p4lib._stream.side_effect = self.stream_of(output)
+
+    def test_nothing_is_run_before_iterating(self):
+        p4 = p4lib.P4()
+        records = p4.iter_have()
+
+        self.assertFalse(p4lib._stream.called)
+        self.assertEqual([], list(records))
+        p4lib._stream.assert_called_with(['p4', 'have'])
+
+    def test_iter_have(self):
+        self.change_stdout(have_output(2))
+
+        p4 = p4lib.P4()
+        records = p4.iter_have("file.cpp")
+
+        self.assertEqual({'depotFile': '//depot/file0.cpp', 'rev': 4,
+                          'localFile': '/client/file0.cpp'}, next(records))
+        self.assertEqual('//depot/file1.cpp', next(records)['depotFile'])
+        self.assertRaises(StopIteration, next, records)
+        p4lib._stream.assert_called_with(['p4', 'have', 'file.cpp'])
+
+    def test_iter_have_uses_p4_options(self):
+        p4 = p4lib.P4()
+        list(p4.iter_have(user='other'))
+
+        p4lib._stream.assert_called_with(['p4', '-u', 'other', 'have'])
+
+    def test_iter_opened_streams_all_files_at_once(self):
+        files = ["//depot/file%d.cpp" % i for i in range(25)]
+
+        p4 = p4lib.P4()
+        list(p4.iter_opened(files))
+
+        p4lib._stream.assert_called_once_with(['p4', 'opened'] + files)
+        self.assertEqual(1, p4.batchStats['spawns'])
+
+    def test_iter_opened_streams_sets_of_files_with_workers(self):
+        files = ["//depot/file%d.cpp" % i for i in range(25)]
+
+        p4 = p4lib.P4(maxWorkers=2)
+        list(p4.iter_opened(files))
+
+        self.assertEqual(3, p4lib._stream.call_count)
+        p4lib._stream.assert_called_with(['p4', 'opened'] + files[20:])
+        self.assertEqual(3, p4.batchStats['spawns'])
+
+    def test_argfile_mode_streams_a_single_process(self):
+        files = ["//depot/file%d.cpp" % i for i in range(25)]
+        argfiles = []
+
+        def stream(argv, cwd=None):
+            with open(argv[2]) as argfile:
+                argfiles.append(argfile.read())
+            for line in have_output(25).splitlines(True):
+                yield line
+        p4lib._stream.side_effect = stream
+
+        p4 = p4lib.P4(batchMode='argfile')
+        records = list(p4.iter_have(files))
+
+        self.assertEqual(1, p4lib._stream.call_count)
+        self.assertEqual([''.join(f + '\n' for f in files)], argfiles)
+        self.assertEqual(25, len(records))
+        argfile = p4lib._stream.call_args[0][0][2]
+        self.assertFalse(os.path.exists(argfile))
+
+    def test_closing_early_closes_the_stream(self):
+        self.change_stdout(have_output(100))
+
+        p4 = p4lib.P4()
+        records = p4.iter_have()
+        next(records)
+        records.close()
+
+        self.assertEqual([['p4', 'have']], self.closed)
+
+    def test_iter_changes_long_output(self):
+        self.change_stdout(CHANGES_LONG_OUTPUT)
+
+        p4 = p4lib.P4()
+        changes = list(p4.iter_changes(longOutput=True))
+
+        p4lib._stream.assert_called_with(['p4', 'changes', '-l'])
+        self.assertEqual([2, 1], [c['change'] for c in changes])
+        self.assertEqual("second change\non two lines\n",
+                         changes[0]['description'])
+        self.assertEqual(p4lib._changes_parse_cb(CHANGES_LONG_OUTPUT, True),
+                         changes)
+
+    def test_invalid_arguments_are_raised_on_call(self):
+        p4 = p4lib.P4()
+
+        self.assertRaises(p4lib.P4LibError, p4.iter_changes, maximum="2")
+        self.assertRaises(p4lib.P4LibError, p4.iter_filelog, [])
+        self.assertRaises(p4lib.P4LibError, p4.iter_files, [])
+        self.assertRaises(p4lib.P4LibError, p4.iter_fstat, [])
+        self.assertFalse(p4lib._stream.called)
+
+    def test_iter_filelog(self):
+        self.change_stdout(FILELOG_OUTPUT)
+
+        p4 = p4lib.P4()
+        records = p4.iter_filelog("//depot/...")
+
+        first = next(records)
+        self.assertEqual('//depot/foo.txt', first['depotFile'])
+        self.assertEqual([2, 1], [r['rev'] for r in first['revs']])
+        self.assertEqual(['copy into //depot/bar.txt#1'],
+                         first['revs'][0]['notes'])
+        self.assertEqual('//depot/bar.txt', next(records)['depotFile'])
+        self.assertRaises(StopIteration, next, records)
+
+    def test_iter_sync_keeps_notes(self):
+        self.change_stdout(SYNC_OUTPUT)
+
+        p4 = p4lib.P4()
+        records = list(p4.iter_sync(dryrun=True))
+
+        p4lib._stream.assert_called_with(['p4', 'sync', '-n'])
+        self.assertEqual(p4lib._sync_parse_cb(SYNC_OUTPUT), records)
+        self.assertEqual(['must resolve #2 before submitting'],
+                         records[0]['notes'])
+
+    def test_iter_files(self):
+        self.change_stdout("//depot/foo.txt#2 - edit change 12 (text)\n")
+
+        p4 = p4lib.P4()
+        records = list(p4.iter_files("//depot/..."))
+
+        p4lib._stream.assert_called_with(['p4', 'files', '//depot/...'])
+        self.assertEqual([{'depotFile': '//depot/foo.txt', 'rev': 2,
+                           'action': 'edit', 'change': 12, 'type': 'text'}],
+                         records)
+
+    def test_iter_fstat(self):
+        self.change_stdout(FSTAT_OUTPUT)
+
+        p4 = p4lib.P4()
+        records = list(p4.iter_fstat(["//depot/foo.txt", "//depot/bar.txt"]))
+
+        p4lib._stream.assert_called_with(['p4', 'fstat', '-C', '-P',
+                                          '//depot/foo.txt',
+                                          '//depot/bar.txt'])
+        self.assertEqual(p4lib._fstat_parse_cb(FSTAT_OUTPUT), records)
+        self.assertEqual(2, records[0]['headRev'])
+        self.assertEqual('//depot/bar.txt', records[1]['depotFile'])
+
+
+ENDLESS_SCRIPT = """import os
+import sys
+sys.stdout.write("%d\\n" % os.getpid())
+while True:
+    sys.stdout.write("line\\n")
+    sys.stdout.flush()
+"""
+
+FAILING_SCRIPT = """import sys
+sys.stdout.write("partial\\n")
+sys.stderr.write("failure\\n")
+sys.exit(1)
+"""
+
+MARSHAL_SCRIPT = """import marshal
+import sys
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+for i in range(3):
+    out.write(marshal.dumps({b'code': b'stat', b'rev': str(i).encode()}, 0))
+out.write(marshal.dumps({b'code': b'error', b'severity': 2,
+                         b'data': b'warning'}, 0))
+"""
+
+
+class StreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def script(self, content):
+        path = os.path.join(self.tmpdir, "script.py")
+        with open(path, "w") as script:
+            script.write(content)
+        return [sys.executable, path]
+
+    def test_closing_terminates_the_process(self):
+        lines = real_stream(self.script(ENDLESS_SCRIPT))
+        pid = int(next(lines))
+        self.assertEqual("line\n", next(lines))
+
+        lines.close()
+
+        self.assertRaises(OSError, os.kill, pid, 0)
+
+    def test_failure_is_raised_after_the_output(self):
+        lines = real_stream(self.script(FAILING_SCRIPT))
+
+        self.assertEqual("partial\n", next(lines))
+        try:
+            next(lines)
+        except p4lib.P4LibError as ex:
+            self.assertIn("failure", str(ex))
+        else:
+            self.fail("P4LibError not raised")
+
+    def test_marshalled_output_is_decoded(self):
+        nodes = real_stream(self.script(MARSHAL_SCRIPT), marshalled=True)
+
+        self.assertEqual([{'code': 'stat', 'rev': '0'},
+                          {'code': 'stat', 'rev': '1'},
+                          {'code': 'stat', 'rev': '2'}], list(nodes))
+
+    def test_run_marshalled_output_is_bytes(self):
+        output, error, retval = real_run(self.script(MARSHAL_SCRIPT),
+                                         marshalled=True)
+
+        self.assertEqual(3, len(list(p4lib._marshalOutputNodes(output))))
@@ -0,0 +1,278 @@
+import time
+import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import change_stdout, marshal_output
+
+
+def date(seconds, dateFormat='%Y/%m/%d'):
+    return time.strftime(dateFormat, time.localtime(seconds))
+
+
+class MarshalTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=(b"", "", 0))
+
+    def marshal_stdout(self, *nodes):
+        change_stdout(marshal_output(nodes))
+
+    def test_is_disabled_by_default(self):
+        p4lib._run.return_value = ("", "", 0)
+
+        p4 = p4lib.P4()
+        p4.have()
+
+        p4lib._run.assert_called_with(['p4', 'have'])
+
+    def test_have(self):
+        self.marshal_stdout({'code': 'stat', 'depotFile': '//depot/foo.txt',
+                             'clientFile': '//client/foo.txt',
+                             'path': '/client/foo.txt', 'haveRev': '4'})
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.have("foo.txt")
+
+        p4lib._run.assert_called_with(['p4', '-G', 'have', 'foo.txt'],
+                                      marshalled=True)
+        self.assertEqual([{'depotFile': '//depot/foo.txt', 'rev': 4,
+                           'localFile': '/client/foo.txt'}], result)
+
+    def test_have_is_batched(self):
+        files = ["//depot/file%d.cpp" % i for i in range(25)]
+
+        p4 = p4lib.P4(useMarshal=True, maxWorkers=2)
+        p4.have(files)
+
+        self.assertEqual(3, p4lib._run.call_count)
+        p4lib._run.assert_any_call(['p4', '-G', 'have'] + files[20:],
+                                   marshalled=True)
+
+    def test_have_is_one_process_without_workers(self):
+        files = ["//depot/file%d.cpp" % i for i in range(25)]
+
+        p4 = p4lib.P4(useMarshal=True)
+        p4.have(files)
+
+        p4lib._run.assert_called_once_with(['p4', '-G', 'have'] + files,
+                                           marshalled=True)
+
+    def test_argfile_batch_mode(self):
+        files = ["//depot/file%d.cpp" % i for i in range(25)]
+
+        p4 = p4lib.P4(useMarshal=True, batchMode='argfile', user='other')
+        p4.have(files)
+
+        argv = p4lib._run.call_args[0][0]
+        self.assertEqual(['p4', '-G', '-u', 'other', '-x'], argv[:5])
+        self.assertEqual(['have'], argv[6:])
+
+    def test_opened(self):
+        node = {'code': 'stat', 'depotFile': '//depot/foo.txt', 'rev': '1',
+                'haveRev': '1', 'action': 'edit', 'change': 'default',
+                'type': 'text', 'user': 'bertha', 'client': 'bertha-home'}
+        self.marshal_stdout(node, dict(node, change='12'))
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.opened()
+
+        self.assertEqual([{'depotFile': '//depot/foo.txt', 'rev': 1,
+                           'action': 'edit', 'change': 'default',
+                           'type': 'text'},
+                          {'depotFile': '//depot/foo.txt', 'rev': 1,
+                           'action': 'edit', 'change': 12,
+                           'type': 'text'}], result)
+
+        result = p4.opened(allClients=True)
+        self.assertEqual('bertha', result[0]['user'])
+        self.assertEqual('bertha-home', result[0]['client'])
+
+    def test_where(self):
+        self.marshal_stdout({'code': 'stat', 'depotFile': '//depot/foo/...',
+                             'clientFile': '//client/foo/...',
+                             'path': '/client/foo/...', 'unmap': ''},
+                            {'code': 'stat', 'depotFile': '//depot/bar.txt',
+                             'clientFile': '//client/bar.txt',
+                             'path': '/client/bar.txt'})
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.where()
+
+        self.assertEqual(1, result[0]['minus'])
+        self.assertEqual({'minus': 0, 'depotFile': '//depot/bar.txt',
+                          'clientFile': '//client/bar.txt',
+                          'localFile': '/client/bar.txt'}, result[1])
+
+    def test_changes(self):
+        self.marshal_stdout({'code': 'stat', 'change': '2',
+                             'time': '1020816000', 'user': 'bertha',
+                             'client': 'bertha-home', 'status': 'submitted',
+                             'desc': 'second change\non two lines\n'})
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.changes(maximum=1)
+
+        p4lib._run.assert_called_with(['p4', '-G', 'changes', '-m', '1'],
+                                      marshalled=True)
+        self.assertEqual([{'change': 2, 'date': date(1020816000),
+                           'user': 'bertha', 'client': 'bertha-home',
+                           'description': 'second change on two lines'}],
+                         result)
+
+        result = p4.changes(longOutput=True)
+        self.assertEqual('second change\non two lines\n',
+                         result[0]['description'])
+
+    def test_describe_short_form(self):
+        self.marshal_stdout({'code': 'stat', 'change': '12',
+                             'time': '1020816000', 'user': 'bertha',
+                             'client': 'bertha-home', 'status': 'submitted',
+                             'desc': 'fix\nthe bug\n',
+                             'depotFile0': '//depot/foo.txt', 'rev0': '2',
+                             'action0': 'edit', 'type0': 'text',
+                             'depotFile1': '//depot/bar.txt', 'rev1': '1',
+                             'action1': 'add', 'type1': 'text'})
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.describe(12, shortForm=True)
+
+        p4lib._run.assert_called_with(['p4', '-G', 'describe', '-s', '12'],
+                                      marshalled=True)
+        self.assertEqual({'change': 12, 'user': 'bertha',
+                          'client': 'bertha-home',
+                          'date': date(1020816000, '%Y/%m/%d %H:%M:%S'),
+                          'description': 'fixthe bug',
+                          'files': [{'depotFile': '//depot/foo.txt',
+                                     'rev': 2, 'action': 'edit'},
+                                    {'depotFile': '//depot/bar.txt',
+                                     'rev': 1, 'action': 'add'}]},
+                         result)
+
+    def test_describe_with_diffs_uses_text(self):
+        p4lib._run.return_value = ("", "", 0)
+
+        p4 = p4lib.P4(useMarshal=True)
+        p4.describe(12, _raw=True)
+
+        p4lib._run.assert_called_with(['p4', 'describe', '12'])
+
+    def test_files(self):
+        self.marshal_stdout({'code': 'stat', 'depotFile': '//depot/foo.txt',
+                             'rev': '3', 'change': '12', 'action': 'edit',
+                             'type': 'text', 'time': '1020816000'})
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.files("//depot/...")
+
+        self.assertEqual([{'depotFile': '//depot/foo.txt', 'rev': 3,
+                           'change': 12, 'action': 'edit', 'type': 'text'}],
+                         result)
+
+    def test_filelog(self):
+        self.marshal_stdout({'code': 'stat', 'depotFile': '//depot/foo.txt',
+                             'rev0': '2', 'change0': '12', 'action0': 'edit',
+                             'type0': 'text', 'time0': '1020816000',
+                             'user0': 'bertha', 'client0': 'bertha-home',
+                             'desc0': 'fix\n',
+                             'how0,0': 'copy into',
+                             'file0,0': '//depot/bar.txt',
+                             'srev0,0': '#none', 'erev0,0': '#1',
+                             'how0,1': 'edit from',
+                             'file0,1': '//depot/baz.txt',
+                             'srev0,1': '#1', 'erev0,1': '#3',
+                             'rev1': '1', 'change1': '10', 'action1': 'add',
+                             'type1': 'text', 'time1': '1020729600',
+                             'user1': 'bertha', 'client1': 'bertha-home',
+                             'desc1': 'add\n'})
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.filelog("//depot/foo.txt")
+
+        self.assertEqual(1, len(result))
+        self.assertEqual('//depot/foo.txt', result[0]['depotFile'])
+        self.assertEqual({'rev': 2, 'change': 12, 'action': 'edit',
+                          'date': date(1020816000), 'user': 'bertha',
+                          'client': 'bertha-home', 'type': 'text',
+                          'description': 'fix',
+                          'notes': ['copy into //depot/bar.txt#1',
+                                    'edit from //depot/baz.txt#2,#3']},
+                         result[0]['revs'][0])
+        self.assertEqual([], result[0]['revs'][1]['notes'])
+
+    def test_sync(self):
+        self.marshal_stdout({'code': 'stat', 'depotFile': '//depot/foo.txt',
+                             'clientFile': '/client/foo.txt', 'rev': '2',
+                             'action': 'updated', 'change': '12'},
+                            {'code': 'info', 'level': 1,
+                             'data': '//depot/foo.txt - must resolve #2 '
+                                     'before submitting'},
+                            {'code': 'stat', 'depotFile': '//depot/bar.txt',
+                             'clientFile': '/client/bar.txt', 'rev': '1',
+                             'action': 'added', 'change': '10'})
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.sync()
+
+        self.assertEqual([{'depotFile': '//depot/foo.txt', 'rev': 2,
+                           'comment': 'updating /client/foo.txt',
+                           'notes': ['must resolve #2 before submitting']},
+                          {'depotFile': '//depot/bar.txt', 'rev': 1,
+                           'comment': 'added as /client/bar.txt',
+                           'notes': []}], result)
+
+    def test_fstat(self):
+        self.marshal_stdout({'code': 'stat', 'depotFile': '//depot/foo.txt',
+                             'clientFile': '/client/foo.txt',
+                             'headRev': '3', 'haveRev': '2',
+                             'headTime': '1020816000', 'ourLock': ''})
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.fstat("//depot/foo.txt")
+
+        p4lib._run.assert_called_with(['p4', '-G', 'fstat', '-C', '-P',
+                                       '//depot/foo.txt'], marshalled=True)
+        self.assertEqual(1, len(result))
+        self.assertEqual(3, result[0]['headRev'])
+        self.assertEqual(2, result[0]['haveRev'])
+        self.assertEqual(1, result[0]['ourLock'])
+        self.assertEqual('', result[0]['headAction'])
+        self.assertNotIn('code', result[0])
+
+    def test_raw_result_is_text(self):
+        p4lib._run.return_value = ("//depot/foo.txt#4 - /client/foo.txt\n",
+                                   "", 0)
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = p4.have(_raw=True)
+
+        p4lib._run.assert_called_with(['p4', 'have'])
+        self.assertEqual("//depot/foo.txt#4 - /client/foo.txt\n",
+                         result['stdout'])
+
+    def test_errors_are_raised(self):
+        self.marshal_stdout({'code': 'error', 'severity': 3, 'generic': 1,
+                             'data': "Client 'other' unknown.\n"})
+
+        p4 = p4lib.P4(useMarshal=True)
+        self.assertRaises(p4lib.P4LibError, p4.opened)
+
+    def test_warnings_are_ignored(self):
+        self.marshal_stdout({'code': 'error', 'severity': 2, 'generic': 17,
+                             'data': "foo.txt - file(s) not on client.\n"})
+
+        p4 = p4lib.P4(useMarshal=True)
+        self.assertEqual([], p4.have("foo.txt"))
+
+    def test_iter_have(self):
+        nodes = [{'depotFile': '//depot/foo.txt', 'path': '/client/foo.txt',
+                  'haveRev': '4', 'code': 'stat'}]
+        p4lib._stream = Mock(spec='p4lib._stream',
+                             side_effect=lambda argv, marshalled: (
+                                 node for node in nodes))
+
+        p4 = p4lib.P4(useMarshal=True)
+        result = list(p4.iter_have())
+
+        p4lib._stream.assert_called_with(['p4', '-G', 'have'],
+                                         marshalled=True)
+        self.assertEqual([{'depotFile': '//depot/foo.txt', 'rev': 4,
+                           'localFile': '/client/foo.txt'}], result)
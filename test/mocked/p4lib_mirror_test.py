@@ -0,0 +1,117 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import p4lib
+import p4lib_mirror
+from test_utils import real_run, real_stream, fake_p4_executable
+
+
+# 40 changes of 10 slots of files at 4 revisions.
+DEPOT = {'files': 300, 'changes': 40, 'revs': 4}
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "needs a /bin/sh script")
+class MirrorTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = real_run
+        p4lib._stream = real_stream
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+        self.p4path = fake_p4_executable(self.tmpdir, **DEPOT)
+        self.p4 = p4lib.P4(p4=self.p4path, dir=self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'mirror.db')
+        self.mirror = p4lib_mirror.Mirror(self.path)
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.tmpdir)
+
+    def runs(self, p4):
+        return dict((command, stats['runs'])
+                    for command, stats in p4.stats().items())
+
+    def test_sync(self):
+        self.assertEqual(40, self.mirror.sync(self.p4, batchSize=15))
+
+        self.assertEqual(40, self.mirror.lastChange())
+        self.assertEqual([c['change'] for c in self.p4.changes()],
+                         [c['change'] for c in self.mirror.changes()])
+        for change in (1, 17, 40):
+            desc = self.p4.describe(change, shortForm=True)
+            mirrored = self.mirror.describe(change)
+            self.assertEqual((desc['user'], desc['client']),
+                             (mirrored['user'], mirrored['client']))
+            self.assertEqual(sorted((f['depotFile'], f['rev'], f['action'])
+                                    for f in desc['files']),
+                             [(f['depotFile'], f['rev'], f['action'])
+                              for f in mirrored['files']])
+        self.assertEqual(None, self.mirror.describe(41))
+
+    def test_parallel_sync(self):
+        p4 = p4lib.P4(p4=self.p4path, dir=self.tmpdir, maxWorkers=4)
+        mirror = p4lib_mirror.Mirror(':memory:')
+        mirror.sync(p4, batchSize=3)
+        self.mirror.sync(self.p4)
+
+        self.assertEqual(self.mirror.changes(), mirror.changes())
+        self.assertEqual(self.mirror.describe(23), mirror.describe(23))
+
+    def test_resync_only_fetches_the_delta(self):
+        self.assertEqual(25, self.mirror.sync(self.p4, maximum=25))
+        self.assertEqual(25, self.mirror.lastChange())
+        self.mirror.close()
+
+        self.mirror = p4lib_mirror.Mirror(self.path)
+        p4 = p4lib.P4(p4=self.p4path, dir=self.tmpdir, instrument=True)
+        self.assertEqual(15, self.mirror.sync(p4))
+        self.assertEqual({'changes': 2, 'describe': 1}, self.runs(p4))
+
+        p4 = p4lib.P4(p4=self.p4path, dir=self.tmpdir, instrument=True)
+        self.assertEqual(0, self.mirror.sync(p4))
+        self.assertEqual({'changes': 1}, self.runs(p4))
+        self.assertEqual(40, len(self.mirror.changes()))
+
+    def test_queries(self):
+        self.mirror.sync(self.p4)
+        start = self.p4.describe(10, shortForm=True)['date']
+        end = self.p4.describe(30, shortForm=True)['date']
+
+        expected = [c['change'] for c in self.p4.changes('//depot/dir0/...')
+                    if c['user'] == 'user1' and 10 <= c['change'] < 30]
+        self.assertTrue(expected)
+        self.assertEqual(expected, [c['change'] for c in self.mirror.changes(
+            '//depot/dir0/...', user='user1', since=start, until=end)])
+
+        self.assertEqual([c['change'] for c in self.p4.changes(
+            '//depot/dir2/file205.txt')],
+                         [c['change'] for c in self.mirror.changes(
+                             ['//depot/dir2/file205.txt'])])
+        self.assertEqual([], self.mirror.changes('//depot/dir1'))
+        self.assertEqual([40, 39], [c['change'] for c in self.mirror.changes(
+            '//depot/...', maximum=2)])
+        self.assertEqual(
+            'Change 40 of the synthetic depot\nwith a second line.\n',
+            self.mirror.changes(maximum=1)[0]['description'])
+
+    def test_users(self):
+        self.mirror.sync(self.p4)
+        users = self.mirror.users()
+
+        self.assertEqual(['user%d' % n for n in range(5)], sorted(users))
+        self.assertEqual(8, users['user1']['changes'])
+        self.assertEqual(self.mirror.changes(user='user1')[-1]['time'],
+                         users['user1']['firstTime'])
+
+    def test_errors(self):
+        self.mirror.sync(self.p4, files=['//depot/dir0/...'])
+
+        self.assertRaises(p4lib.P4LibError, self.mirror.sync, self.p4)
+        self.assertRaises(p4lib.P4LibError, self.mirror.sync, self.p4,
+                          files=['//depot/dir0/...'], port='other:1666')
+        self.assertRaises(p4lib.P4LibError, self.mirror.sync, self.p4,
+                          files=['//depot/dir0/...@2'])
+        self.assertRaises(p4lib.P4LibError, self.mirror.changes,
+                          '//depot/*/file1.txt')
+        self.assertRaises(p4lib.P4LibError, self.mirror.changes,
+                          since='last week')
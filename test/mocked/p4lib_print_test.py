@@ -1,15 +1,153 @@
+import io
+import os
+import shutil
+import tempfile
 import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import change_stdout, marshal_output
 
 
-""" print_ implementation is using popen3 and marshalling.
+PRINT_NODES = [{'code': 'stat', 'depotFile': '//depot/file.txt', 'rev': '3',
+                'change': '42', 'action': 'edit', 'type': 'text'},
+               {'code': 'text', 'data': 'hello\n'},
+               {'code': 'text', 'data': 'world\n'},
+               {'code': 'text', 'data': ''},
+               {'code': 'stat', 'depotFile': '//depot/other.txt', 'rev': '1',
+                'change': '12', 'action': 'add', 'type': 'text'},
+               {'code': 'text', 'data': 'other\n'},
+               {'code': 'text', 'data': ''}]
 
-It's complicated to mock and uses a marshalling version.
-
-Probably needs to reimplement it with the -s option (see source code)
-"""
+BINARY_NODES = [{'code': 'stat', 'depotFile': '//depot/image.png', 'rev': '2',
+                 'change': '43', 'action': 'edit', 'type': 'binary'},
+                {'code': 'binary', 'data': b'\x89PNG\xff'},
+                {'code': 'binary', 'data': b'\x00\x01'},
+                {'code': 'binary', 'data': b''}]
 
 
 class PrintTestCase(unittest.TestCase):
-    @unittest.skip("Reimplement print_")
-    def test_no_test(self):
-        pass
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=(b"", "", 0))
+
+    def test_print_files(self):
+        change_stdout(marshal_output(PRINT_NODES))
+
+        p4 = p4lib.P4()
+        result = p4.print_("//depot/...")
+
+        p4lib._run.assert_called_with(['p4', '-G', 'print', '//depot/...'],
+                                      marshalled=True)
+        self.assertEqual([{'depotFile': '//depot/file.txt', 'rev': 3,
+                           'change': 42, 'action': 'edit', 'type': 'text',
+                           'text': 'hello\nworld\n'},
+                          {'depotFile': '//depot/other.txt', 'rev': 1,
+                           'change': 12, 'action': 'add', 'type': 'text',
+                           'text': 'other\n'}], result)
+
+    def test_quiet(self):
+        change_stdout(marshal_output(PRINT_NODES[1:4]))
+
+        p4 = p4lib.P4()
+        result = p4.print_("//depot/file.txt", quiet=True)
+
+        p4lib._run.assert_called_with(['p4', '-G', 'print', '-q',
+                                       '//depot/file.txt'], marshalled=True)
+        self.assertEqual([{'text': 'hello\nworld\n'}], result)
+
+    def test_uses_p4_options(self):
+        p4 = p4lib.P4()
+        p4.print_("//depot/file.txt", user='other')
+
+        p4lib._run.assert_called_with(['p4', '-G', '-u', 'other', 'print',
+                                       '//depot/file.txt'], marshalled=True)
+
+    def test_errors_are_raised(self):
+        change_stdout(marshal_output([{'code': 'error', 'severity': 3,
+                                       'generic': 17,
+                                       'data': 'Path is not under client.\n'}]))
+
+        p4 = p4lib.P4()
+        self.assertRaises(p4lib.P4LibError, p4.print_, "/elsewhere/file")
+
+    def test_missing_files(self):
+        p4 = p4lib.P4()
+        self.assertRaises(p4lib.P4LibError, p4.print_, [])
+
+    def test_binary_content_as_bytes(self):
+        change_stdout(marshal_output(PRINT_NODES[:4] + BINARY_NODES))
+
+        p4 = p4lib.P4()
+        result = p4.print_("//depot/...", binary=True)
+
+        self.assertEqual(b'hello\nworld\n', result[0]['text'])
+        self.assertEqual(b'\x89PNG\xff\x00\x01', result[1]['text'])
+        self.assertEqual('binary', result[1]['type'])
+
+    def test_binary_files_have_no_text_by_default(self):
+        change_stdout(marshal_output(BINARY_NODES))
+
+        p4 = p4lib.P4()
+        result = p4.print_("//depot/image.png")
+
+        self.assertNotIn('text', result[0])
+
+
+class PrintOutputTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._stream = Mock(spec='p4lib._stream',
+                             side_effect=self.stream_of(PRINT_NODES))
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def stream_of(self, nodes):
+        def stream(argv, marshalled=False):
+            for node in nodes:
+                yield node
+        return stream
+
+    def read(self, name):
+        with open(os.path.join(self.tmpdir, name), 'rb') as f:
+            return f.read()
+
+    def test_streams_to_a_file_object(self):
+        output = io.BytesIO()
+
+        p4 = p4lib.P4()
+        result = p4.print_("//depot/...", output=output)
+
+        p4lib._stream.assert_called_with(['p4', '-G', 'print',
+                                          '//depot/...'], marshalled=True)
+        self.assertEqual(b'hello\nworld\nother\n', output.getvalue())
+        self.assertFalse(output.closed)
+        self.assertEqual(['//depot/file.txt', '//depot/other.txt'],
+                         [hit['depotFile'] for hit in result])
+        self.assertNotIn('text', result[0])
+
+    def test_streams_to_a_path(self):
+        path = os.path.join(self.tmpdir, 'all.txt')
+
+        p4 = p4lib.P4()
+        p4.print_("//depot/...", output=path)
+
+        self.assertEqual(b'hello\nworld\nother\n', self.read('all.txt'))
+
+    def test_streams_each_file_to_its_own_path(self):
+        p4lib._stream.side_effect = self.stream_of(PRINT_NODES +
+                                                   BINARY_NODES)
+
+        def target(hit):
+            if hit['depotFile'] == '//depot/other.txt':
+                return None
+            return os.path.join(self.tmpdir,
+                                hit['depotFile'].rsplit('/', 1)[1])
+
+        p4 = p4lib.P4()
+        result = p4.print_("//depot/...", output=target)
+
+        self.assertEqual(3, len(result))
+        self.assertEqual(['file.txt', 'image.png'],
+                         sorted(os.listdir(self.tmpdir)))
+        self.assertEqual(b'hello\nworld\n', self.read('file.txt'))
+        self.assertEqual(b'\x89PNG\xff\x00\x01', self.read('image.png'))
@@ -0,0 +1,182 @@
+import os
+import shutil
+import tempfile
+import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import marshal_output
+
+
+def print_nodes(depotFile, rev, text):
+    return [{'code': 'stat', 'depotFile': depotFile, 'rev': str(rev),
+             'change': '42', 'action': 'edit', 'type': 'text'},
+            {'code': 'text', 'data': text},
+            {'code': 'text', 'data': ''}]
+
+
+FOO_OUTPUT = marshal_output(print_nodes('//depot/foo.c', 3, 'foo\n'))
+
+FOO_HIT = {'depotFile': '//depot/foo.c', 'rev': 3, 'change': 42,
+           'action': 'edit', 'type': 'text', 'text': 'foo\n'}
+
+
+class PrintCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=(FOO_OUTPUT, "", 0))
+        self.tmpdir = tempfile.mkdtemp()
+        # The cache is only used with a known server.
+        self.port = os.environ.get('P4PORT')
+        os.environ['P4PORT'] = 'perforce:1666'
+
+    def tearDown(self):
+        if self.port is None:
+            os.environ.pop('P4PORT', None)
+        else:
+            os.environ['P4PORT'] = self.port
+        shutil.rmtree(self.tmpdir)
+
+    def test_pinned_revision_is_printed_once(self):
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        first = p4.print_("//depot/foo.c#3")
+        second = p4.print_("//depot/foo.c#3")
+
+        self.assertEqual(1, p4lib._run.call_count)
+        p4lib._run.assert_called_with(['p4', '-G', 'print', '//depot/foo.c#3'],
+                                      marshalled=True)
+        self.assertEqual([FOO_HIT], first)
+        self.assertEqual(first, second)
+        self.assertEqual({'hits': 1, 'misses': 1, 'stores': 1,
+                          'evictions': 0}, p4.printCache.stats())
+
+    def test_cache_is_shared_between_instances(self):
+        p4lib.P4(printCache=self.tmpdir).print_("//depot/foo.c#3")
+        result = p4lib.P4(printCache=self.tmpdir).print_("//depot/foo.c#3")
+
+        self.assertEqual(1, p4lib._run.call_count)
+        self.assertEqual([FOO_HIT], result)
+
+    def test_unpinned_files_are_always_printed(self):
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        for spec in ("//depot/foo.c", "//depot/foo.c#head", "foo.c#3",
+                     "//depot/...#3", ["//depot/foo.c#3", "//depot/bar.c"],
+                     "//depot/foo.c@42"):
+            p4.print_(spec)
+
+        self.assertEqual(6, p4lib._run.call_count)
+        self.assertEqual(0, p4.printCache.stats()['stores'])
+
+    def test_unknown_server_is_not_cached(self):
+        del os.environ['P4PORT']
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        p4.print_("//depot/foo.c#3")
+        p4.print_("//depot/foo.c#3")
+
+        self.assertEqual(2, p4lib._run.call_count)
+        self.assertEqual(0, p4.printCache.stats()['stores'])
+
+    def test_files_printed_under_another_name_are_returned(self):
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        p4.print_("//depot/foo.c#3")
+        p4lib._run.return_value = (marshal_output(
+            print_nodes('//depot/bar.c', 1, 'bar\n') +
+            print_nodes('//depot/baz.c', 1, 'baz\n')), "", 0)
+        result = p4.print_(["//depot/Bar.c#1", "//depot/foo.c#3",
+                            "//depot/baz.c#1"])
+
+        self.assertEqual(['//depot/bar.c', '//depot/foo.c', '//depot/baz.c'],
+                         [hit['depotFile'] for hit in result])
+        self.assertEqual(None, p4.printCache.get('perforce:1666',
+                                                 '//depot/Bar.c#1'))
+        self.assertEqual(2, p4.printCache.stats()['stores'])
+
+    def test_local_file_is_not_cached(self):
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        p4.print_("//depot/foo.c#3", localFile="foo.c")
+        p4.print_("//depot/foo.c#3", localFile="foo.c")
+
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_key_includes_port(self):
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        p4.print_("//depot/foo.c#3")
+        p4.print_("//depot/foo.c#3", port="other:1666")
+
+        self.assertEqual(2, p4lib._run.call_count)
+
+    def test_only_missing_files_are_printed(self):
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        p4.print_("//depot/foo.c#3")
+        p4lib._run.return_value = (
+            marshal_output(print_nodes('//depot/bar.c', 1, 'bar\n')), "", 0)
+        result = p4.print_(["//depot/foo.c#3", "//depot/bar.c#1"])
+
+        p4lib._run.assert_called_with(['p4', '-G', 'print', '//depot/bar.c#1'],
+                                      marshalled=True)
+        self.assertEqual(['foo\n', 'bar\n'], [hit['text'] for hit in result])
+
+    def test_missing_revisions_are_skipped(self):
+        p4lib._run.return_value = (marshal_output(
+            [{'code': 'error', 'severity': 2, 'generic': 17,
+              'data': '//depot/bar.c#9 - no such file(s).\n'}] +
+            print_nodes('//depot/foo.c', 3, 'foo\n')), "", 0)
+
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        result = p4.print_(["//depot/bar.c#9", "//depot/foo.c#3"])
+
+        self.assertEqual([FOO_HIT], result)
+        self.assertEqual(1, p4.printCache.stats()['stores'])
+
+    def test_missing_revision_among_revisions_of_the_same_file(self):
+        p4lib._run.return_value = (marshal_output(
+            [{'code': 'error', 'severity': 2, 'generic': 17,
+              'data': '//depot/foo.c#1 - no such file(s).\n'}] +
+            print_nodes('//depot/foo.c', 2, 'foo 2\n') +
+            print_nodes('//depot/foo.c', 3, 'foo 3\n')), "", 0)
+
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        result = p4.print_(["//depot/foo.c#1", "//depot/foo.c#2",
+                            "//depot/foo.c#3"])
+
+        self.assertEqual(['foo 2\n', 'foo 3\n'],
+                         [hit['text'] for hit in result])
+        cache = p4.printCache
+        self.assertEqual(None, cache.get('perforce:1666', '//depot/foo.c#1'))
+        self.assertEqual('foo 2\n',
+                         cache.get('perforce:1666', '//depot/foo.c#2')['text'])
+        self.assertEqual('foo 3\n',
+                         cache.get('perforce:1666', '//depot/foo.c#3')['text'])
+
+    def test_quiet_result_has_only_text(self):
+        p4 = p4lib.P4(printCache=self.tmpdir)
+        p4.print_("//depot/foo.c#3")
+        result = p4.print_("//depot/foo.c#3", quiet=True)
+
+        self.assertEqual([{'text': 'foo\n'}], result)
+
+    def test_identical_contents_are_stored_once(self):
+        cache = p4lib.PrintCache(self.tmpdir)
+        cache.put('port', '//depot/foo.c#3', FOO_HIT)
+        cache.put('port', '//depot/bar.c#1', FOO_HIT)
+
+        self.assertEqual(1, len(os.listdir(os.path.join(self.tmpdir,
+                                                        'objects'))))
+        self.assertEqual(FOO_HIT, cache.get('port', '//depot/bar.c#1'))
+        digest = p4lib.hashlib.md5(b'foo\n').hexdigest()
+        self.assertEqual(b'foo\n', cache.content(digest))
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = p4lib.PrintCache(self.tmpdir, maxSize=3000)
+        for rev in range(1, 6):
+            hit = dict(FOO_HIT, rev=rev, text='%d' % rev * 1000)
+            cache.put('port', '//depot/foo.c#%d' % rev, hit)
+            # Older files get older modification times.
+            for directory in ('index', 'objects'):
+                for name in os.listdir(os.path.join(self.tmpdir, directory)):
+                    path = os.path.join(self.tmpdir, directory, name)
+                    st = os.stat(path)
+                    os.utime(path, (st.st_atime - 10, st.st_mtime - 10))
+
+        self.assertTrue(cache.stats()['evictions'] > 0)
+        self.assertIsNone(cache.get('port', '//depot/foo.c#1'))
+        self.assertEqual('5' * 1000,
+                         cache.get('port', '//depot/foo.c#5')['text'])
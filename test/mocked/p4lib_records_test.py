@@ -0,0 +1,116 @@
+import pickle
+import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import change_stdout
+
+
+HAVE_OUTPUT = """//depot/dir/file1.cpp#4 - /client/dir/file1.cpp
+//depot/dir/file2.cpp#1 - /client/dir/file2.cpp
+"""
+
+OPENED_OUTPUT = "//depot/dir/file1.cpp#4 - edit default change (text)\n"
+
+FILELOG_OUTPUT = """//depot/dir/file1.cpp
+... #2 change 42 edit on 2002/05/09 by bertha@home (text) 'second'
+... ... copy into //depot/other/file1.cpp#1
+... #1 change 12 add on 2002/05/07 by bertha@home (text) 'first'
+"""
+
+
+class RecordTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fields = {'depotFile': '//depot/dir/file.cpp', 'rev': 4,
+                       'localFile': '/client/dir/file.cpp'}
+        self.record = p4lib.HaveEntry(self.fields)
+
+    def test_reads_like_a_dict(self):
+        self.assertEqual('//depot/dir/file.cpp', self.record['depotFile'])
+        self.assertEqual(4, self.record['rev'])
+        self.assertEqual('//depot/dir/file.cpp', self.record.depotFile)
+        self.assertEqual(4, self.record.rev)
+        self.assertEqual(['depotFile', 'rev', 'localFile'],
+                         self.record.keys())
+        self.assertEqual(sorted(self.fields.items()),
+                         sorted(self.record.items()))
+        self.assertEqual(3, len(self.record))
+        self.assertEqual(self.fields, dict(self.record))
+        self.assertIn('rev', self.record)
+        self.assertTrue(self.record.has_key('rev'))
+        self.assertEqual('%(depotFile)s#%(rev)d' % self.fields,
+                         '%(depotFile)s#%(rev)d' % self.record)
+
+    def test_missing_fields(self):
+        record = p4lib.FileRev({'depotFile': '//depot/file.cpp', 'rev': 1})
+
+        self.assertNotIn('user', record)
+        self.assertEqual(None, record.get('user'))
+        self.assertRaises(KeyError, lambda: record['user'])
+        self.assertRaises(KeyError, lambda: record['unknown'])
+        self.assertEqual(['depotFile', 'rev'], record.keys())
+
+    def test_equals_its_dict(self):
+        self.assertEqual(self.fields, self.record)
+        self.assertEqual(self.record, self.fields)
+        self.assertEqual(p4lib.HaveEntry(self.fields), self.record)
+        self.assertNotEqual(dict(self.fields, rev=3), self.record)
+        self.assertFalse(self.record != self.fields)
+
+    def test_fields_can_be_set_and_added(self):
+        self.record['localFile'] = '/other/file.cpp'
+        self.record['notes'] = ['note']
+
+        self.assertEqual('/other/file.cpp', self.record['localFile'])
+        self.assertEqual(['note'], self.record['notes'])
+        self.assertEqual(['depotFile', 'rev', 'localFile', 'notes'],
+                         self.record.keys())
+
+    def test_directories_are_shared(self):
+        other = p4lib.HaveEntry({'depotFile': '//depot/' + 'dir/other.cpp'})
+
+        self.assertTrue(self.record._depotFileDir is other._depotFileDir)
+        self.assertEqual('//depot/dir/other.cpp', other['depotFile'])
+
+    def test_pickle(self):
+        copy = pickle.loads(pickle.dumps(self.record))
+
+        self.assertTrue(isinstance(copy, p4lib.HaveEntry))
+        self.assertEqual(self.record, copy)
+
+    def test_fstat_records_keep_other_fields(self):
+        record = p4lib.FstatRecord({'depotFile': '//depot/file.cpp',
+                                    'headRev': 3, 'isMapped': ''})
+
+        self.assertEqual({'depotFile': '//depot/file.cpp', 'headRev': 3,
+                          'isMapped': ''}, dict(record))
+
+
+class CompactRecordsTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', return_value=("", "", 0))
+
+    def test_have(self):
+        change_stdout(HAVE_OUTPUT)
+
+        result = p4lib.P4(compactRecords=True).have()
+
+        self.assertTrue(isinstance(result[0], p4lib.HaveEntry))
+        self.assertEqual(p4lib.P4().have(), result)
+
+    def test_opened(self):
+        change_stdout(OPENED_OUTPUT)
+
+        result = p4lib.P4(compactRecords=True).opened()
+
+        self.assertTrue(isinstance(result[0], p4lib.FileRev))
+        self.assertEqual(p4lib.P4().opened(), result)
+
+    def test_filelog_revisions(self):
+        change_stdout(FILELOG_OUTPUT)
+
+        result = p4lib.P4(compactRecords=True).filelog("//depot/dir/...")
+
+        self.assertTrue(isinstance(result[0]['revs'][0], p4lib.FilelogRev))
+        self.assertEqual(['copy into //depot/other/file1.cpp#1'],
+                         result[0]['revs'][0]['notes'])
+        self.assertEqual(p4lib.P4().filelog("//depot/dir/..."), result)
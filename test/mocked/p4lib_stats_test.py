@@ -0,0 +1,116 @@
+import shutil
+import sys
+import tempfile
+import unittest
+import p4lib
+from mock23 import Mock
+from test_utils import real_run, fake_p4_executable
+
+
+HAVE_OUTPUT = "//depot/file%d.cpp#1 - /client/file%d.cpp\n"
+
+
+def run(argv, timings=None, **kwargs):
+    files = [arg for arg in argv if arg.startswith("//")]
+    output = ''.join(HAVE_OUTPUT % (i, i) for i in range(len(files)))
+    if timings is not None:
+        timings.update({'spawnTime': 0.001, 'firstByteTime': 0.002,
+                        'bytesRead': len(output)})
+    return output, "", 0
+
+
+class StatsTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = Mock(spec='p4lib._run', side_effect=run)
+        self.files = ["//depot/file%d.cpp" % i for i in range(25)]
+
+    def test_is_disabled_by_default(self):
+        p4 = p4lib.P4()
+        p4.have(self.files[:1])
+
+        p4lib._run.assert_called_with(['p4', 'have', self.files[0]])
+        self.assertEqual({}, p4.stats())
+
+    def test_measures_are_aggregated_per_command(self):
+        p4 = p4lib.P4(instrument=True, maxWorkers=2)
+        p4.have(self.files)
+
+        stats = p4.stats()
+        self.assertEqual(['have'], list(stats))
+        have = stats['have']
+        self.assertEqual(3, have['runs'])
+        self.assertEqual(1, have['parses'])
+        self.assertEqual(10 + 10 + 5, have['records'])
+        self.assertAlmostEqual(0.003, have['spawnTime'])
+        self.assertAlmostEqual(0.006, have['firstByteTime'])
+        self.assertEqual(sum(len(run(["//file"] * count)[0])
+                             for count in (10, 10, 5)),
+                         have['bytesRead'])
+        self.assertEqual(3, sum(count for _, count
+                                in have['runTimeHistogram']))
+        self.assertEqual(None, have['parseTimeHistogram'][-1][0])
+
+    def test_empty_output_has_no_records(self):
+        events = []
+        p4 = p4lib.P4()
+        p4.addHook(events.append)
+        p4.have()
+
+        self.assertEqual(0, events[-1]['records'])
+        self.assertEqual(0, p4.stats()['have']['records'])
+
+    def test_hooks_receive_each_event(self):
+        events = []
+        p4 = p4lib.P4()
+        p4.addHook(events.append)
+        p4.have(self.files[0])
+
+        self.assertTrue(p4.instrument)
+        self.assertEqual(['run', 'parse'], [e['event'] for e in events])
+        self.assertEqual('have', events[0]['command'])
+        self.assertEqual(len("p4 have //depot/file0.cpp"),
+                         events[0]['argvSize'])
+        self.assertFalse(events[0]['marshalled'])
+        self.assertEqual(1, events[1]['records'])
+
+        p4.removeHook(events.append)
+        p4.have(self.files[0])
+        self.assertEqual(2, len(events))
+
+    def test_failed_runs_are_measured(self):
+        p4lib._run.side_effect = p4lib.P4LibError("error")
+
+        p4 = p4lib.P4(instrument=True)
+        self.assertRaises(p4lib.P4LibError, p4.files, self.files)
+
+        self.assertEqual(1, p4.stats()['files']['runs'])
+        self.assertEqual(0, p4.stats()['files']['parses'])
+
+    def test_argfile_runs_are_named_by_command(self):
+        p4 = p4lib.P4(instrument=True, batchMode='argfile')
+        p4.sync(self.files)
+
+        self.assertEqual(['sync'], list(p4.stats()))
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "needs a /bin/sh script")
+class ProcessStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = real_run
+        self.tmpdir = tempfile.mkdtemp()
+        self.p4 = fake_p4_executable(self.tmpdir, files=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_process_timings(self):
+        events = []
+        p4 = p4lib.P4(p4=self.p4, dir=self.tmpdir)
+        p4.addHook(events.append)
+        p4.files("//depot/...")
+
+        run = events[0]
+        self.assertTrue(0 < run['spawnTime'] <= run['firstByteTime']
+                        <= run['runTime'])
+        self.assertTrue(run['bytesRead'] > 100 * len("//depot/"))
+        self.assertEqual(100, events[1]['records'])
@@ -0,0 +1,77 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from multiprocessing.pool import ThreadPool
+import p4lib
+from test_utils import real_run, fake_p4_executable
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "needs a /bin/sh script")
+class SubprocessTestCase(unittest.TestCase):
+    def setUp(self):
+        p4lib._run = real_run
+        self.tmpdir = tempfile.mkdtemp()
+        self.p4 = fake_p4_executable(self.tmpdir)
+        self.dirs = []
+        for i in range(8):
+            path = os.path.realpath(os.path.join(self.tmpdir, "dir%d" % i))
+            os.mkdir(path)
+            self.dirs.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def where(self, i):
+        if i % 9 == 0:
+            directory = None
+            expected_dir = os.getcwd()
+        else:
+            directory = expected_dir = self.dirs[i % len(self.dirs)]
+        p4 = p4lib.P4(p4=self.p4, client="client%d" % i, dir=directory)
+        result = p4.where("file%d.txt" % i)
+        return result, expected_dir
+
+    def test_uses_dir_option_as_working_directory(self):
+        p4 = p4lib.P4(p4=self.p4, dir=self.dirs[0])
+        result = p4.where("file.txt")
+
+        self.assertEqual(os.path.join(self.dirs[0], "file.txt"),
+                         result[0]["localFile"])
+
+    def test_does_not_modify_environment(self):
+        old_pwd = os.environ.get("PWD")
+        os.environ["PWD"] = self.dirs[0]
+        try:
+            p4 = p4lib.P4(p4=self.p4)
+            p4.where("file.txt")
+            self.assertEqual(self.dirs[0], os.environ["PWD"])
+        finally:
+            if old_pwd is None:
+                del os.environ["PWD"]
+            else:
+                os.environ["PWD"] = old_pwd
+
+    def test_overriden_options_are_not_kept(self):
+        p4 = p4lib.P4(p4=self.p4, client="client")
+        result = p4.where("file.txt", client="other")
+
+        self.assertEqual("//other/file.txt", result[0]["clientFile"])
+        self.assertEqual({"client": "client"}, p4.optd)
+
+    def test_concurrent_calls_are_isolated(self):
+        count = 200
+        pool = ThreadPool(32)
+        try:
+            results = pool.map(self.where, range(count))
+        finally:
+            pool.close()
+            pool.join()
+
+        for i, (result, expected_dir) in enumerate(results):
+            self.assertEqual(1, len(result))
+            self.assertEqual("//client%d/file%d.txt" % (i, i),
+                             result[0]["clientFile"])
+            self.assertEqual(os.path.join(expected_dir, "file%d.txt" % i),
+                             result[0]["localFile"])
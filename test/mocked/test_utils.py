@@ -1,6 +1,52 @@
+import marshal
+import os
+import sys
 import p4lib
 
 
+# The tests replace p4lib._run and p4lib._stream with mocks. Keep the
+# real ones for the tests running real processes.
+real_run = p4lib._run
+real_stream = p4lib._stream
+real_writeTemporaryForm = p4lib._writeTemporaryForm
+real_removeTemporaryForm = p4lib._removeTemporaryForm
+
+FAKE_P4 = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, "fakep4", "fakep4.py")
+
+
+def fake_p4_executable(directory, **depot):
+    """Write a 'p4' script running the fake p4 in 'directory' and return
+    its path.
+
+    The keyword arguments configure the synthetic depot of the fake p4,
+    e.g. files=100000 for $FAKEP4_FILES.
+    """
+    path = os.path.join(directory, "p4")
+    environment = ''.join('FAKEP4_%s=%d ' % (name.upper(), value)
+                          for name, value in sorted(depot.items()))
+    with open(path, "w") as script:
+        script.write('#!/bin/sh\n%sexec "%s" "%s" "$@"\n'
+                     % (environment, sys.executable,
+                        os.path.normpath(FAKE_P4)))
+    os.chmod(path, 0o755)
+    return path
+
+
+def marshal_output(nodes):
+    """Return the output of 'p4 -G' giving the dicts 'nodes'.
+
+    p4 marshals strings as byte strings.
+    """
+    def encode(value):
+        if isinstance(value, str) and sys.version_info.major > 2:
+            return value.encode('utf-8')
+        return value
+    return b''.join(marshal.dumps(dict((encode(key), encode(value))
+                                       for key, value in node.items()), 0)
+                    for node in nodes)
+
+
 def change_stdout(stdout):
     _, stderr, retval = p4lib._run.return_value
     p4lib._run.return_value = (stdout, stderr, retval)